@@ -0,0 +1,258 @@
+"""
+Admission control for processing jobs.
+
+Before any work starts, the upload's header is probed for its duration and the
+job's cost is estimated as duration x real-time factor of the operation, i.e.
+the processing seconds it is expected to take. Against the per-node compute
+budget (settings.AUDIO_COMPUTE_BUDGET, the estimated seconds of work admitted
+at once) a job is then
+
+  * accepted, if the budget has room and nobody is waiting,
+  * queued, if the work already waiting stays below AUDIO_QUEUE_BUDGET; the
+    request blocks until the scheduler (scheduling.py) picks it and it fits,
+  * rejected with 429 and a Retry-After estimate otherwise, or with 413 if the
+    upload is longer than AUDIO_MAX_DURATION.
+
+Before that, the client's audio-seconds rate limit (ratelimit.py) is applied.
+The running and queued jobs of all workers on the host live in the node-local
+state file (local_store). The real-time factors start from settings.AUDIO_RTF
+and follow the measured ones as jobs finish.
+"""
+import math
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics, ratelimit
+from .audio_utils import probe_audio
+from .local_store import pid_alive, transaction
+from .scheduling import get_scheduler, record_usage
+
+DEFAULT_RTF = 1.0
+# Weight of the latest finished job in the moving average of the real-time factor
+RTF_SMOOTHING = 0.2
+POLL_INTERVAL = 0.25
+
+
+class Rejected(Exception):
+    def __init__(self, message, retry_after=None, status=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class Admission:
+    def __init__(self, ticket, duration, cost, probe=None):
+        self.ticket = ticket
+        self.duration = duration
+        self.cost = cost
+        self.probe = probe
+
+
+def check_rate(client, processing_type):
+    """
+    Rejected if the client's rate limit bucket is empty, else None. Runs before
+    the upload is read, so clients over their limit cost next to nothing.
+    """
+    retry_after = ratelimit.check(client, processing_type)
+    if retry_after is None:
+        return None
+    metrics.ADMISSION_DECISIONS.labels(processing_type, 'rate_limited').inc()
+    return Rejected('Rate limit exceeded, retry later', retry_after)
+
+
+def client_key(request):
+    """``user:<id>`` for logged-in users, ``ip:<address>`` for guests."""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _key(processing_type, mode):
+    return f'{processing_type}:{mode}'
+
+
+def realtime_factor(state, processing_type, mode=''):
+    measured = state.get('rtf', {}).get(_key(processing_type, mode))
+    if measured is not None:
+        return measured
+    priors = settings.AUDIO_RTF
+    return priors.get(_key(processing_type, mode), priors.get(processing_type, DEFAULT_RTF))
+
+
+def _purge(state):
+    """Drop the jobs of workers that died without releasing them."""
+    state['running'] = {t: job for t, job in state.get('running', {}).items() if pid_alive(job['pid'])}
+    state['queue'] = [job for job in state.get('queue', []) if pid_alive(job['pid'])]
+
+
+def _running_cost(state):
+    return sum(job['cost'] for job in state['running'].values())
+
+
+def _queued_cost(state):
+    return sum(job['cost'] for job in state['queue'])
+
+
+def load(state):
+    """Work running and queued on the node, as a multiple of the compute budget."""
+    _purge(state)
+    return (_running_cost(state) + _queued_cost(state)) / settings.AUDIO_COMPUTE_BUDGET
+
+
+def _retry_after(state, cost, now):
+    """Seconds until enough running jobs are expected to finish for the queue and this job to fit."""
+    outstanding = _running_cost(state) + _queued_cost(state) + cost
+    remaining = sorted(
+        (max(job['cost'] - (now - job['started']), 0), job['cost']) for job in state['running'].values()
+    )
+    seconds = 0
+    for seconds, job_cost in remaining:
+        outstanding -= job_cost
+        if outstanding <= settings.AUDIO_COMPUTE_BUDGET:
+            return max(1, math.ceil(seconds))
+    # even an idle node has to work off the queue first
+    return max(1, math.ceil(seconds + _queued_cost(state)))
+
+
+def _try_start(state, ticket, now):
+    """Move ticket from the queue to the running jobs if the scheduler picks it and it fits the budget."""
+    job = get_scheduler().select(state, now)
+    if job is None or job['ticket'] != ticket:
+        return None
+    if _running_cost(state) + job['cost'] > settings.AUDIO_COMPUTE_BUDGET:
+        return None
+    state['queue'].remove(job)
+    state['running'][ticket] = {'cost': job['cost'], 'pid': job['pid'], 'client': job.get('client', ''), 'started': now}
+    return job
+
+
+def _enqueue(processing_type, cost, duration, client):
+    """Accept or queue the job, return (ticket, queued). Raises Rejected."""
+    ticket = uuid.uuid4().hex
+    now = time.time()
+    with transaction('admission') as state:
+        _purge(state)
+        if _running_cost(state) + cost <= settings.AUDIO_COMPUTE_BUDGET and not state['queue']:
+            state['running'][ticket] = {'cost': cost, 'pid': os.getpid(), 'client': client, 'started': now}
+            metrics.ADMISSION_DECISIONS.labels(processing_type, 'accepted').inc()
+            return ticket, False
+        if _queued_cost(state) + cost <= settings.AUDIO_QUEUE_BUDGET:
+            state['queue'].append({
+                'ticket': ticket, 'cost': cost, 'duration': duration, 'client': client,
+                'pid': os.getpid(), 'enqueued': now,
+            })
+            metrics.ADMISSION_DECISIONS.labels(processing_type, 'queued').inc()
+            return ticket, True
+        retry_after = _retry_after(state, cost, now)
+    metrics.ADMISSION_DECISIONS.labels(processing_type, 'rejected').inc()
+    raise Rejected('Server is at capacity, retry later', retry_after)
+
+
+def _wait(processing_type, ticket, cost):
+    deadline = time.time() + settings.AUDIO_QUEUE_TIMEOUT
+    with metrics.JOBS_QUEUED.track_inprogress():
+        while True:
+            now = time.time()
+            with transaction('admission') as state:
+                _purge(state)
+                job = _try_start(state, ticket, now)
+                if job is not None:
+                    metrics.QUEUE_WAIT_SECONDS.labels(metrics.size_bucket(job.get('duration', 0))).observe(now - job['enqueued'])
+                    return
+                if now >= deadline:
+                    state['queue'] = [job for job in state['queue'] if job['ticket'] != ticket]
+                    retry_after = _retry_after(state, cost, now)
+                    break
+            time.sleep(POLL_INTERVAL)
+    metrics.ADMISSION_DECISIONS.labels(processing_type, 'timed_out').inc()
+    raise Rejected('Timed out waiting for capacity, retry later', retry_after)
+
+
+def _release(ticket, processing_type, mode, duration, elapsed):
+    now = time.time()
+    with transaction('admission') as state:
+        job = state.setdefault('running', {}).pop(ticket, None)
+        if job is not None:
+            record_usage(state, job.get('client', ''), job['cost'], now)
+        state['queue'] = [job for job in state.get('queue', []) if job['ticket'] != ticket]
+        if elapsed is not None and duration > 0:
+            previous = realtime_factor(state, processing_type, mode)
+            state.setdefault('rtf', {})[_key(processing_type, mode)] = (
+                (1 - RTF_SMOOTHING) * previous + RTF_SMOOTHING * elapsed / duration
+            )
+
+
+def check_upload(upload, processing_type, client='', passes=1):
+    """
+    Probe the upload's header and take its duration, ``passes`` times, out of
+    the client's rate limit. Returns the probe, raises Rejected for unreadable
+    or too long files and clients over their limit.
+    """
+    try:
+        probe = probe_audio(upload)
+    except OSError as e:
+        raise Rejected(f'Could not read the audio file: {e}', status=400)
+    if probe['duration'] > settings.AUDIO_MAX_DURATION:
+        raise Rejected(
+            f"Audio is {probe['duration']:.0f} s long, the limit is {settings.AUDIO_MAX_DURATION:.0f} s", status=413
+        )
+
+    retry_after = ratelimit.consume(client, processing_type, probe['duration'] * passes)
+    if retry_after is not None:
+        metrics.ADMISSION_DECISIONS.labels(processing_type, 'rate_limited').inc()
+        raise Rejected('Rate limit exceeded, retry later', retry_after)
+    return probe
+
+
+@contextmanager
+def admit(upload, processing_type, mode='', client='', passes=1):
+    """
+    Admission for one job: probe the upload, then accept, queue (blocking until
+    the job may start) or raise Rejected. The block runs the job; its wall time
+    updates the real-time factor of the operation. ``client`` identifies the
+    submitter for rate limiting and fair-share scheduling, see client_key().
+    A job that processes the upload several times, such as the three modes of
+    boost/compare, is charged ``passes`` times its duration against the rate limit.
+
+        with admit(audio_file, 'volume_boost', mode, client_key(request)) as admission:
+            ...
+    """
+    probe = check_upload(upload, processing_type, client, passes)
+    admitted = None
+    try:
+        with reserve(processing_type, mode, probe['duration'], client) as admitted:
+            admitted.probe = probe
+            yield admitted
+    except Rejected:
+        if admitted is None:
+            # nothing was processed, the client gets its audio-seconds back
+            ratelimit.refund(client, processing_type, probe['duration'] * passes)
+        raise
+
+
+@contextmanager
+def reserve(processing_type, mode, duration, client=''):
+    """
+    The compute budget part of admit(), for work whose duration is already
+    known: accept or queue (blocking) ``duration`` seconds of audio, or raise
+    Rejected. The rate limit is not applied.
+    """
+    mode = str(mode)
+    with transaction('admission') as state:
+        cost = duration * realtime_factor(state, processing_type, mode)
+    # a job larger than the whole budget is admitted when the node is otherwise idle
+    cost = min(cost, settings.AUDIO_COMPUTE_BUDGET)
+    ticket, queued = _enqueue(processing_type, cost, duration, client)
+    elapsed = None
+    try:
+        if queued:
+            _wait(processing_type, ticket, cost)
+        start = time.perf_counter()
+        yield Admission(ticket, duration, cost)
+        elapsed = time.perf_counter() - start
+    finally:
+        _release(ticket, processing_type, mode, duration, elapsed)
@@ -13,7 +13,8 @@ import matplotlib.pyplot as plt
 from PIL import Image
 from df import config
 from df.enhance import enhance, init_df, load_audio, save_audio
-from df.io import resample
+from voicefixer.tools.resample import resample
+from .audio_utils import mix_at_snr
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model, df, _ = init_df(model_base_dir=None, config_allow_defaults=True)
@@ -39,7 +40,6 @@ def convert_to_wav(input_path: str) -> str:
         result = subprocess.run([
             'ffmpeg', '-y', '-i', input_path,
             '-acodec', 'pcm_s16le',
-            '-ar', '48000',
             '-ac', '1',
             output_path
         ], capture_output=True, stderr=subprocess.DEVNULL)
@@ -59,25 +59,6 @@ def convert_to_wav(input_path: str) -> str:
         print(f"Pydub failed: {e}")
         raise Exception(f"Could not convert audio file: {e}")
 
-def mix_at_snr(clean, noise, snr, eps=1e-10):
-    clean = torch.as_tensor(clean).mean(0, keepdim=True)
-    noise = torch.as_tensor(noise).mean(0, keepdim=True)
-    if noise.shape[1] < clean.shape[1]:
-        noise = noise.repeat((1, int(math.ceil(clean.shape[1] / noise.shape[1]))))
-    max_start = int(noise.shape[1] - clean.shape[1])
-    start = torch.randint(0, max_start, ()).item() if max_start > 0 else 0
-    noise = noise[:, start : start + clean.shape[1]]
-    E_speech = torch.mean(clean.pow(2)) + eps
-    E_noise = torch.mean(noise.pow(2))
-    K = torch.sqrt((E_noise / E_speech) * 10 ** (snr / 10) + eps)
-    noise = noise / K
-    mixture = clean + noise
-    assert torch.isfinite(mixture).all()
-    max_m = mixture.abs().max()
-    if max_m > 1:
-        clean, noise, mixture = clean / max_m, noise / max_m, mixture / max_m
-    return clean, noise, mixture
-
 def process_audio(audio_path: str, noise_type: str = "None", snr: int = 10, max_duration: int = 60 * 60 * 60):
     # Convert to WAV if needed
     # print(f"Processing audio: {audio_path}")
@@ -87,7 +68,8 @@ def process_audio(audio_path: str, noise_type: str = "None", snr: int = 10, max_
     
     try:
         sr = config("sr", 48000, int, section="df")
-        sample, meta = load_audio(wav_path, sr)
+        sample, meta = load_audio(wav_path, None)
+        sample = resample(sample, meta.sample_rate, sr)
         
         max_len = max_duration * sr
         if sample.shape[-1] > max_len:
@@ -99,7 +81,8 @@ def process_audio(audio_path: str, noise_type: str = "None", snr: int = 10, max_
         
         noise_fn = NOISES.get(noise_type)
         if noise_fn is not None and os.path.exists(noise_fn):
-            noise, _ = load_audio(noise_fn, sr)
+            noise, noise_meta = load_audio(noise_fn, None)
+            noise = resample(noise, noise_meta.sample_rate, sr)
             _, _, sample = mix_at_snr(sample, noise, snr)
         
         enhanced = enhance(model, df, sample)
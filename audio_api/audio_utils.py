@@ -0,0 +1,107 @@
+import json
+import math
+import os
+import subprocess
+import soundfile as sf
+import torch
+
+
+def mix_at_snr(clean, noise, snr, eps=1e-10):
+    clean = torch.as_tensor(clean).mean(0, keepdim=True)
+    noise = torch.as_tensor(noise).mean(0, keepdim=True)
+    if noise.shape[1] < clean.shape[1]:
+        noise = noise.repeat((1, int(math.ceil(clean.shape[1] / noise.shape[1]))))
+    max_start = int(noise.shape[1] - clean.shape[1])
+    start = torch.randint(0, max_start, ()).item() if max_start > 0 else 0
+    noise = noise[:, start : start + clean.shape[1]]
+    E_speech = torch.mean(clean.pow(2)) + eps
+    E_noise = torch.mean(noise.pow(2))
+    K = torch.sqrt((E_noise / E_speech) * 10 ** (snr / 10) + eps)
+    noise = noise / K
+    mixture = clean + noise
+    assert torch.isfinite(mixture).all()
+    max_m = mixture.abs().max()
+    if max_m > 1:
+        clean, noise, mixture = clean / max_m, noise / max_m, mixture / max_m
+    return clean, noise, mixture
+
+
+# Bit rate assumed when neither the header nor ffprobe report one; low, so that
+# the duration estimated from the file size errs on the long side.
+FALLBACK_BIT_RATE = 32000
+
+
+def probe_audio(upload):
+    """
+    Read duration, sample rate, channels and codec of an uploaded file from its
+    header, without decoding the audio.
+
+    ``upload`` is a path or a Django UploadedFile. soundfile handles WAV/FLAC/OGG/MP3
+    headers, anything else (webm from browser recordings, m4a, ...) goes to
+    ffprobe. When the container does not state a duration, it is estimated from
+    the file size and the bit rate.
+    """
+    if isinstance(upload, (str, os.PathLike)):
+        path, fileobj, size = os.fspath(upload), None, os.path.getsize(upload)
+    elif hasattr(upload, 'temporary_file_path'):
+        path, fileobj, size = upload.temporary_file_path(), None, upload.size
+    else:
+        path, fileobj, size = None, upload, upload.size
+
+    try:
+        if fileobj is not None:
+            fileobj.seek(0)
+        info = sf.info(path if path is not None else fileobj)
+        return {
+            'duration': info.duration,
+            'sample_rate': info.samplerate,
+            'channels': info.channels,
+            'codec': info.subtype.lower(),
+            'format': info.format.lower(),
+        }
+    except RuntimeError:
+        pass
+    finally:
+        if fileobj is not None:
+            fileobj.seek(0)
+
+    return _ffprobe(path, fileobj, size)
+
+
+def _ffprobe(path, fileobj, size):
+    command = [
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_entries', 'format=duration,bit_rate,format_name:stream=codec_name,sample_rate,channels,bit_rate',
+        '-select_streams', 'a:0',
+    ]
+    try:
+        if path is not None:
+            result = subprocess.run(command + [path], capture_output=True, timeout=10)
+        else:
+            # only the beginning of the file is needed for the header
+            result = subprocess.run(command + ['pipe:0'], input=fileobj.read(1 << 20), capture_output=True, timeout=10)
+            fileobj.seek(0)
+        data = json.loads(result.stdout or b'{}')
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        data = {}
+
+    stream = (data.get('streams') or [{}])[0]
+    fmt = data.get('format', {})
+    duration = _to_float(fmt.get('duration'))
+    if duration is None:
+        bit_rate = _to_float(fmt.get('bit_rate')) or _to_float(stream.get('bit_rate')) or FALLBACK_BIT_RATE
+        duration = size * 8 / bit_rate
+    return {
+        'duration': duration,
+        'sample_rate': int(_to_float(stream.get('sample_rate')) or 0),
+        'channels': int(stream.get('channels') or 0),
+        'codec': stream.get('codec_name', 'unknown'),
+        'format': fmt.get('format_name', 'unknown'),
+    }
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,292 @@
+"""
+Batch submissions: many files, or a zip/tar archive of them, in one request.
+
+The submission only stores the files (archives are extracted member by member
+while they are read) and returns a manifest; every item is an AudioProcessing
+row with a batch_id and status 'pending'. The runner thread that each worker
+process starts claims pending items from the database, so the items of one
+batch are spread over all workers. Noise reduction items of similar length
+are claimed together and denoised in one batched DeepFilterNet call. Items
+whose worker dies while processing them go back to pending, see _claim().
+"""
+import logging
+import os
+import socket
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import admission, metrics, quality
+from .local_store import pid_alive
+from .models import AudioProcessing
+from voicefixer.tools.instrument import collect
+
+AUDIO_EXTENSIONS = {'.wav', '.mp3', '.flac', '.ogg', '.oga', '.opus', '.m4a', '.aac', '.webm', '.aiff', '.aif'}
+POLL_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def _is_audio(name):
+    base = os.path.basename(name)
+    # skip macOS resource forks and other hidden files archivers add
+    if not base or base.startswith('.') or '__MACOSX' in name:
+        return False
+    return os.path.splitext(base)[1].lower() in AUDIO_EXTENSIONS
+
+
+def iter_archive(upload):
+    """
+    Yield (name, file object) for the audio files in a zip or tar archive, one
+    member at a time, without extracting the archive to disk first.
+    """
+    name = upload.name.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(upload) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_audio(info.filename):
+                    with archive.open(info) as member:
+                        yield os.path.basename(info.filename), member
+    else:
+        # 'r|*' reads the (optionally compressed) tar stream front to back
+        with tarfile.open(fileobj=upload, mode='r|*') as archive:
+            for info in archive:
+                if info.isfile() and _is_audio(info.name):
+                    yield os.path.basename(info.name), archive.extractfile(info)
+
+
+def iter_uploads(files, archive):
+    for upload in files:
+        yield upload.name, upload
+    if archive is not None:
+        yield from iter_archive(archive)
+
+
+def submit(files, archive, processing_type, mode, user, client):
+    """
+    Store the uploads as pending items of a new batch. Items that cannot be
+    read, are too long or exceed the client's rate limit are stored as rejected.
+
+    :return: batch id
+    """
+    batch_id = uuid.uuid4()
+    mode = str(mode) if processing_type == 'volume_boost' else ''
+    for count, (name, fileobj) in enumerate(iter_uploads(files, archive)):
+        if count >= settings.AUDIO_BATCH_MAX_ITEMS:
+            break
+        audio_obj = AudioProcessing.objects.create(
+            original_audio=File(fileobj, name=name),
+            user=user,
+            processing_type=processing_type,
+            batch_id=batch_id,
+            mode=mode,
+        )
+        try:
+            probe = admission.check_upload(audio_obj.original_audio.path, processing_type, client)
+            audio_obj.duration = probe['duration']
+        except admission.Rejected as e:
+            audio_obj.status = 'rejected'
+            audio_obj.error = str(e)
+        audio_obj.save(update_fields=['duration', 'status', 'error'])
+    ensure_runner()
+    return batch_id
+
+
+def manifest(batch_id):
+    """Status of every item of a batch, None if there is no such batch."""
+    try:
+        batch_id = uuid.UUID(str(batch_id))
+    except ValueError:
+        return None
+    items = AudioProcessing.objects.filter(batch_id=batch_id).order_by('created_at')
+    if not items:
+        return None
+    counts = {}
+    entries = []
+    for item in items:
+        counts[item.status] = counts.get(item.status, 0) + 1
+        entries.append({
+            'id': str(item.id),
+            'name': os.path.basename(item.original_audio.name),
+            'status': item.status,
+            'duration': item.duration,
+            'tier': item.tier,
+            'error': item.error,
+            'processed_audio': item.processed_audio.url if item.processed_audio else None,
+        })
+    return {'batch_id': str(batch_id), 'counts': counts, 'items': entries}
+
+
+class _StreamBuffer:
+    """Write-only file object that hands out what was written since the last call."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_results(batch_id, chunk_size=1 << 20):
+    """Yield a zip archive of the processed files of a batch, built while it is sent."""
+    buffer = _StreamBuffer()
+    items = AudioProcessing.objects.filter(batch_id=batch_id, status='done').order_by('created_at')
+    # the buffer is not seekable, so zipfile writes data descriptors after each member
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for item in items:
+            stem = os.path.splitext(os.path.basename(item.original_audio.name))[0]
+            with item.processed_audio.open('rb') as source, \
+                    archive.open(f'{stem}.wav', mode='w', force_zip64=True) as target:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    target.write(data)
+                    yield buffer.take()
+        yield buffer.take()
+    yield buffer.take()
+
+
+def _worker():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _abandoned(item, now):
+    """Whether the worker that claimed a processing item is gone."""
+    host, _, pid = item.worker.rpartition(':')
+    if host == socket.gethostname() and pid.isdigit():
+        return not pid_alive(int(pid))
+    # workers on other hosts cannot be checked, their claims expire
+    timeout = getattr(settings, 'AUDIO_BATCH_CLAIM_TIMEOUT', 24 * 60 * 60)
+    return item.claimed_at is None or (now - item.claimed_at).total_seconds() > timeout
+
+
+def _requeue_abandoned():
+    """Put the items of workers that died while processing them back to pending."""
+    now = timezone.now()
+    processing = AudioProcessing.objects.filter(batch_id__isnull=False, status='processing')
+    for item in processing.only('id', 'worker', 'claimed_at'):
+        # unless another worker has claimed the item again in between
+        if _abandoned(item, now) and AudioProcessing.objects.filter(
+            id=item.id, status='processing', worker=item.worker, claimed_at=item.claimed_at
+        ).update(status='pending', worker='', claimed_at=None):
+            logger.warning(f'Batch item {item.id} was abandoned by worker {item.worker or "?"}, requeued')
+
+
+def _claim():
+    """Mark a group of pending items as processing and return them."""
+    _requeue_abandoned()
+    pending = AudioProcessing.objects.filter(batch_id__isnull=False, status='pending')
+    first = pending.order_by('created_at').first()
+    if first is None:
+        return []
+    candidates = [first]
+    if first.processing_type == 'noise_reduction' and first.duration:
+        tolerance = settings.AUDIO_BATCH_LENGTH_TOLERANCE
+        candidates += list(
+            pending.filter(
+                processing_type='noise_reduction',
+                duration__gte=first.duration * (1 - tolerance),
+                duration__lte=first.duration * (1 + tolerance),
+            ).exclude(id=first.id).order_by('created_at')[:settings.AUDIO_BATCH_SIZE - 1]
+        )
+    # the conditional update makes sure no other worker claimed the item in between
+    worker, now = _worker(), timezone.now()
+    return [
+        item for item in candidates
+        if AudioProcessing.objects.filter(id=item.id, status='pending').update(
+            status='processing', worker=worker, claimed_at=now
+        )
+    ]
+
+
+def _store_results(items, output_paths, prefix, trace, tier):
+    for item, output_path in zip(items, output_paths):
+        with open(output_path, 'rb') as f:
+            item.processed_audio.save(f'{prefix}_{item.id}.wav', File(f), save=False)
+        item.tier = tier
+        for field, value in trace.annotations.get(item.original_audio.path, {}).items():
+            setattr(item, field, value)
+        item.status = 'done'
+        item.save()
+        os.remove(output_path)
+
+
+def process_group(items):
+    first = items[0]
+    duration = sum(item.duration or 0 for item in items)
+    client = f'user:{first.user_id}' if first.user_id else ''
+    # the mode may be cheaper than requested while the node is under load
+    mode = quality.choose(first.processing_type, first.mode)
+    try:
+        with admission.reserve(first.processing_type, mode, duration, client), \
+                metrics.track_job(first.processing_type, mode) as job, collect() as trace:
+            if first.processing_type == 'noise_reduction':
+                from .noise_reducer import FAST_TIER, STANDARD_TIER, reduce_noise_batch, reduce_noise_fast
+                paths = [item.original_audio.path for item in items]
+                if mode == FAST_TIER:
+                    outputs = [reduce_noise_fast(path) for path in paths]
+                else:
+                    outputs = reduce_noise_batch(paths)
+                _store_results(items, outputs, 'enhanced', trace, mode or STANDARD_TIER)
+            else:
+                from .volume_booster import boost_volume
+                for item in items:
+                    _store_results([item], [boost_volume(item.original_audio.path, mode)], 'boosted', trace, mode)
+            job.observe(
+                trace.breakdown(),
+                bytes_read=sum(item.original_audio.size for item in items),
+                bytes_written=sum(item.processed_audio.size for item in items),
+            )
+    except admission.Rejected:
+        # the node stayed busy, try again later
+        AudioProcessing.objects.filter(id__in=[item.id for item in items]).update(status='pending')
+        time.sleep(POLL_INTERVAL)
+    except Exception as e:
+        AudioProcessing.objects.filter(id__in=[item.id for item in items], status='processing').update(
+            status='failed', error=str(e)
+        )
+
+
+def _run():
+    while True:
+        close_old_connections()
+        try:
+            items = _claim()
+        except Exception:
+            logger.exception('Batch runner could not claim work')
+            items = []
+        if not items:
+            time.sleep(POLL_INTERVAL)
+            continue
+        process_group(items)
+
+
+def ensure_runner():
+    """Start the batch runner thread of this process, unless disabled or running already."""
+    global _runner
+    if not getattr(settings, 'AUDIO_BATCH_RUNNER', True):
+        return
+    with _runner_lock:
+        if _runner is None or not _runner.is_alive():
+            _runner = threading.Thread(target=_run, name='audio-batch-runner', daemon=True)
+            _runner.start()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import torch
+from django.conf import settings
+from voicefixer.tools.instrument import span
+from voicefixer.tools.resample import resample
+from voicefixer.tools.wav import save_wave
+from .noise_reducer import convert_to_wav, denoise_inmem, load_mono, snr_gate
+from .volume_booster import voicefixer
+
+# VoiceFixer's sample rate
+RESTORE_SR = 44100
+
+
+def denoise_and_restore(audio_path: str, mode: int = 0) -> str:
+    """
+    Denoise with DeepFilterNet, then restore with VoiceFixer, in memory.
+
+    The two-request flow converts and decodes the upload twice and writes a
+    48 kHz WAV in between. Here the upload is converted and decoded once,
+    the denoised tensor is resampled once from 48 kHz to 44.1 kHz and handed
+    straight to VoiceFixer, and only the result is written. Uploads the SNR
+    gate finds clean (noise_reducer.snr_gate) are not denoised.
+
+    Args:
+        audio_path: Path to input audio file (mp3, wav, ogg, etc.)
+        mode: VoiceFixer mode, 0, 1 or 2
+
+    Returns:
+        str: Path to the restored output WAV file (44.1 kHz)
+    """
+    with span("convert_to_wav"):
+        wav_path = convert_to_wav(audio_path)
+
+    try:
+        with span("load_audio") as s:
+            sample, _ = load_mono(wav_path, 48000)
+            s.record(audio_seconds=sample.shape[-1] / 48000, tensor=sample)
+    finally:
+        if wav_path != audio_path and os.path.exists(wav_path):
+            os.remove(wav_path)
+
+    # clean uploads go to VoiceFixer without noise reduction
+    _, bypass = snr_gate(sample, 48000, key=audio_path)
+    enhanced = sample if bypass else denoise_inmem(sample)
+
+    with span("resample", enhanced.shape[-1] / 48000) as s:
+        wav_44k = resample(enhanced, 48000, RESTORE_SR)
+        s.record(tensor=wav_44k)
+
+    restored = voicefixer.restore_inmem(
+        wav_44k[0].numpy(),
+        cuda=torch.cuda.is_available(),
+        mode=mode,
+        skip_silence=getattr(settings, 'AUDIO_SKIP_SILENCE', True)
+    )
+
+    output_path = tempfile.NamedTemporaryFile(suffix="_restored.wav", delete=False).name
+    with span("save_wav", restored.shape[-1] / RESTORE_SR, restored):
+        save_wave(restored, fname=output_path, sample_rate=RESTORE_SR)
+    return output_path
@@ -0,0 +1,565 @@
+"""
+Streaming processing graphs.
+
+A pipeline is a chain of stages connected by bounded queues of audio blocks.
+Every stage runs in its own thread, so decoding, resampling, inference and
+encoding of different parts of one file overlap, and the bounded queues keep
+a fast stage from running ahead of a slow one (and from holding the whole
+file in memory). Pipelines are configuration: settings.AUDIO_PIPELINES maps a
+name to a list of ``{'stage': <type>, **options}`` entries, the types are the
+classes registered in STAGES:
+
+    decode         read the input file block by block, at its own sample rate
+    downmix        average the channels down to ``channels``
+    resample       to ``sample_rate``, or back to the input's with 'source'
+    deepfilternet  DeepFilterNet noise reduction (48 kHz mono)
+    fade_in        fade in the first ``seconds``
+    voicefixer     VoiceFixer restoration in ``mode`` (44.1 kHz mono)
+    gain           by ``gain_db``, or by the context's
+    limiter        keep the true peaks below ``ceiling_db``
+    encode         write the output file
+
+Every block a stage processes is recorded as a voicefixer.tools.instrument
+span named after the stage, so the stage breakdown and the Prometheus stage
+histograms of a job cover pipelines too. Pipeline.run() also returns per-stage
+busy, idle (waiting for input) and blocked (waiting for the next stage) times,
+which show the bottleneck of a pipeline.
+"""
+import contextvars
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+from django.conf import settings
+
+from voicefixer.tools.instrument import span
+from voicefixer.tools.resample import StreamingResampler
+from voicefixer.tools.segment import find_cut, smoothed_energy
+
+from .loudness import DEFAULT_TRUE_PEAK_DB, TruePeakLimiter, db_to_gain
+
+STAGES = {}
+
+_END = object()
+
+
+def register(name):
+    def decorator(cls):
+        cls.type = name
+        STAGES[name] = cls
+        return cls
+    return decorator
+
+
+class Block:
+    """``audio`` is a float32 tensor [channels, samples] at ``sample_rate``."""
+
+    __slots__ = ('audio', 'sample_rate', 'meta')
+
+    def __init__(self, audio, sample_rate, meta):
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.meta = meta
+
+    @property
+    def seconds(self):
+        return self.audio.shape[-1] / self.sample_rate
+
+    def replace(self, audio, sample_rate=None):
+        return Block(audio, sample_rate or self.sample_rate, self.meta)
+
+
+class Stage:
+    type = None
+
+    def __init__(self, name=None):
+        self.name = name or self.type
+
+    def start(self, context):
+        """Called before the first block with the keyword arguments of Pipeline.run()."""
+        self.context = context
+
+    def process(self, block):
+        """Return the blocks to pass on, any number of them."""
+        return [block]
+
+    def finish(self):
+        """Return the blocks still held back at the end of the stream."""
+        return []
+
+    def close(self):
+        """Release resources, also called after errors."""
+
+
+class Source(Stage):
+    def blocks(self):
+        raise NotImplementedError
+
+
+@register('decode')
+class Decoder(Source):
+    """
+    Read context['input_path'] in blocks of ``block_seconds``. Formats that
+    libsndfile cannot read are decoded by an ffmpeg child process into a pipe.
+    """
+
+    def __init__(self, block_seconds=5.0, name=None):
+        super().__init__(name or 'load_audio')
+        self.block_seconds = block_seconds
+        self.file = None
+        self.process_ = None
+
+    def blocks(self):
+        path = self.context['input_path']
+        try:
+            self.file = sf.SoundFile(path)
+        except (RuntimeError, sf.LibsndfileError):
+            yield from self._ffmpeg_blocks(path)
+            return
+        sample_rate, channels = self.file.samplerate, self.file.channels
+        meta = {'source_sample_rate': sample_rate, 'source_channels': channels}
+        frames = int(self.block_seconds * sample_rate)
+        while True:
+            data = self.file.read(frames, dtype='float32', always_2d=True)
+            if not len(data):
+                break
+            yield Block(torch.from_numpy(np.ascontiguousarray(data.T)), sample_rate, meta)
+
+    def _ffmpeg_blocks(self, path):
+        from .audio_utils import probe_audio
+
+        probe = probe_audio(path)
+        sample_rate, channels = int(probe['sample_rate'] or 48000), int(probe['channels'] or 1)
+        meta = {'source_sample_rate': sample_rate, 'source_channels': channels}
+        self.process_ = subprocess.Popen(
+            ['ffmpeg', '-v', 'error', '-i', path, '-f', 'f32le', '-acodec', 'pcm_f32le',
+             '-ar', str(sample_rate), '-ac', str(channels), '-'],
+            stdout=subprocess.PIPE,
+        )
+        block_bytes = int(self.block_seconds * sample_rate) * channels * 4
+        while True:
+            data = self.process_.stdout.read(block_bytes)
+            if not data:
+                break
+            # a read can end inside a frame, keep whole frames only
+            data = data[:len(data) - len(data) % (channels * 4)]
+            audio = np.frombuffer(data, dtype=np.float32).reshape(-1, channels).T.copy()
+            yield Block(torch.from_numpy(audio), sample_rate, meta)
+        if self.process_.wait() != 0:
+            raise Exception(f'ffmpeg could not decode {path}')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        if self.process_ is not None and self.process_.poll() is None:
+            self.process_.kill()
+            self.process_.wait()
+
+
+@register('downmix')
+class Downmix(Stage):
+    def __init__(self, channels=1, name=None):
+        super().__init__(name)
+        self.channels = channels
+
+    def process(self, block):
+        if block.audio.shape[0] == self.channels:
+            return [block]
+        if self.channels != 1:
+            raise ValueError(f'Cannot mix {block.audio.shape[0]} channels down to {self.channels}')
+        return [block.replace(block.audio.mean(dim=0, keepdim=True))]
+
+
+@register('resample')
+class Resample(Stage):
+    """Streaming resampler, see voicefixer.tools.resample.StreamingResampler."""
+
+    def __init__(self, sample_rate, quality='best', name=None):
+        super().__init__(name)
+        self.sample_rate = sample_rate
+        self.quality = quality
+        self.resampler = None
+        self.last = None
+
+    def process(self, block):
+        target = block.meta['source_sample_rate'] if self.sample_rate == 'source' else int(self.sample_rate)
+        if target == block.sample_rate:
+            return [block]
+        if self.resampler is None:
+            self.resampler = StreamingResampler(block.sample_rate, target, self.quality)
+            self.target = target
+        self.last = block
+        out = self.resampler.process(block.audio)
+        return [block.replace(out, target)] if out.shape[-1] else []
+
+    def finish(self):
+        if self.resampler is None:
+            return []
+        return [self.last.replace(self.resampler.flush(), self.target)]
+
+
+@register('deepfilternet')
+class DeepFilterNet(Stage):
+    """
+    DeepFilterNet on windows of ``block_seconds``. Each window starts with the
+    last ``context_seconds`` of the previous one, whose output is dropped, so
+    the recurrent state has settled when the new audio starts. The SNR gate
+    (noise_reducer.snr_gate) decides on the first window whether the file is
+    clean enough to pass through unchanged.
+    """
+
+    def __init__(self, block_seconds=10.0, context_seconds=1.0, name=None):
+        super().__init__(name)
+        from .noise_reducer import df
+
+        self.sample_rate = df.sr()
+        self.block_samples = int(block_seconds * self.sample_rate)
+        self.context_samples = int(context_seconds * self.sample_rate)
+        self.pending = []
+        self.pending_samples = 0
+        self.previous = None
+        self.bypass = None
+
+    def _denoise(self, block, audio):
+        from df.enhance import enhance
+        from .noise_reducer import df, model, snr_gate
+
+        if self.bypass is None:
+            _, self.bypass = snr_gate(audio, self.sample_rate, key=self.context.get('input_path'))
+        if self.bypass:
+            return block.replace(audio)
+        window = audio if self.previous is None else torch.cat([self.previous, audio], -1)
+        enhanced = enhance(model, df, window)
+        skip = 0 if self.previous is None else self.previous.shape[-1]
+        self.previous = window[..., -self.context_samples:]
+        return block.replace(enhanced[..., skip:])
+
+    def process(self, block):
+        if block.sample_rate != self.sample_rate:
+            raise ValueError(f'DeepFilterNet needs {self.sample_rate} Hz input, add a resample stage')
+        self.last = block
+        self.pending.append(block.audio)
+        self.pending_samples += block.audio.shape[-1]
+        out = []
+        while self.pending_samples >= self.block_samples:
+            audio = torch.cat(self.pending, -1)
+            out.append(self._denoise(block, audio[..., :self.block_samples]))
+            rest = audio[..., self.block_samples:]
+            self.pending, self.pending_samples = [rest], rest.shape[-1]
+        return out
+
+    def finish(self):
+        if not self.pending_samples:
+            return []
+        return [self._denoise(self.last, torch.cat(self.pending, -1))]
+
+
+@register('fade_in')
+class FadeIn(Stage):
+    def __init__(self, seconds=0.15, name=None):
+        super().__init__(name)
+        self.seconds = seconds
+        self.position = 0
+
+    def process(self, block):
+        fade_samples = int(self.seconds * block.sample_rate)
+        if self.position >= fade_samples:
+            return [block]
+        length = block.audio.shape[-1]
+        ramp = torch.clamp(
+            torch.arange(self.position, self.position + length, dtype=torch.float32) / fade_samples, max=1.0
+        )
+        self.position += length
+        return [block.replace(block.audio * ramp)]
+
+
+@register('voicefixer')
+class VoiceFixer(Stage):
+    """
+    VoiceFixer restoration. VoiceFixer restores segments of about 30 s
+    independently, so the stream is cut into such segments at pauses, as
+    restore_inmem cuts a whole file (voicefixer.tools.segment). Once more
+    than two segments are buffered, the first one is cut off at the quietest
+    point within TOLERANCE_SECONDS of SEGMENT_SECONDS. The rest at the end
+    is left to restore_inmem, which splits it evenly, so there is no short
+    last segment. ``mode`` defaults to context['mode'].
+    """
+
+    SAMPLE_RATE = 44100
+    SEGMENT_SECONDS = 30
+    TOLERANCE_SECONDS = 2
+
+    def __init__(self, mode=None, name=None):
+        super().__init__(name)
+        self.mode = mode
+        self.pending = []
+        self.pending_samples = 0
+
+    def _restore(self, block, audio):
+        from .volume_booster import voicefixer
+
+        mode = self.mode if self.mode is not None else self.context.get('mode', 0)
+        restored = voicefixer.restore_inmem(
+            audio[0].numpy(), cuda=torch.cuda.is_available(), mode=int(mode),
+            skip_silence=getattr(settings, 'AUDIO_SKIP_SILENCE', True),
+        )
+        return block.replace(torch.from_numpy(restored).reshape(1, -1))
+
+    def process(self, block):
+        if block.sample_rate != self.SAMPLE_RATE or block.audio.shape[0] != 1:
+            raise ValueError('VoiceFixer needs 44100 Hz mono input, add downmix and resample stages')
+        self.last = block
+        self.pending.append(block.audio)
+        self.pending_samples += block.audio.shape[-1]
+        segment = self.SEGMENT_SECONDS * self.SAMPLE_RATE
+        tolerance = self.TOLERANCE_SECONDS * self.SAMPLE_RATE
+        out = []
+        while self.pending_samples >= 2 * segment + tolerance:
+            audio = torch.cat(self.pending, -1)
+            energy, hop = smoothed_energy(audio[0, :segment + tolerance].numpy(), self.SAMPLE_RATE)
+            cut = find_cut(energy, hop, segment, tolerance)
+            out.append(self._restore(block, audio[..., :cut]))
+            rest = audio[..., cut:]
+            self.pending, self.pending_samples = [rest], rest.shape[-1]
+        return out
+
+    def finish(self):
+        if not self.pending_samples:
+            return []
+        return [self._restore(self.last, torch.cat(self.pending, -1))]
+
+
+@register('gain')
+class Gain(Stage):
+    """Multiply by ``gain_db``, or by context['gain_db'] when it is None."""
+
+    def __init__(self, gain_db=None, name=None):
+        super().__init__(name)
+        self.gain_db = gain_db
+
+    def process(self, block):
+        gain_db = self.context.get('gain_db', 0.0) if self.gain_db is None else self.gain_db
+        return [block.replace(block.audio * db_to_gain(gain_db))]
+
+
+@register('limiter')
+class Limiter(Stage):
+    """Look-ahead true-peak limiter, see loudness.TruePeakLimiter."""
+
+    def __init__(self, ceiling_db=DEFAULT_TRUE_PEAK_DB, lookahead=0.005, hold=0.02, name=None):
+        super().__init__(name)
+        self.options = {'ceiling_db': ceiling_db, 'lookahead': lookahead, 'hold': hold}
+        self.limiter = None
+        self.last = None
+
+    def process(self, block):
+        if self.limiter is None:
+            self.limiter = TruePeakLimiter(block.sample_rate, **self.options)
+        self.last = block
+        out = self.limiter.process(block.audio.numpy())
+        return [block.replace(torch.from_numpy(out))] if out.shape[-1] else []
+
+    def finish(self):
+        if self.limiter is None:
+            return []
+        return [self.last.replace(torch.from_numpy(self.limiter.flush()))]
+
+
+@register('encode')
+class Encoder(Stage):
+    """Write the blocks to context['output_path'] as they arrive."""
+
+    def __init__(self, subtype='PCM_16', name=None):
+        super().__init__(name or 'save_audio')
+        self.subtype = subtype
+        self.file = None
+
+    def process(self, block):
+        if self.file is None:
+            self.file = sf.SoundFile(
+                self.context['output_path'], 'w', samplerate=block.sample_rate,
+                channels=block.audio.shape[0], subtype=self.subtype,
+            )
+        self.file.write(block.audio.numpy().T)
+        return []
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class StageStats:
+    __slots__ = ('blocks', 'audio_s', 'busy_s', 'idle_s', 'blocked_s')
+
+    def __init__(self):
+        self.blocks = 0
+        self.audio_s = 0.0
+        self.busy_s = 0.0
+        self.idle_s = 0.0
+        self.blocked_s = 0.0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Pipeline:
+    def __init__(self, stages, queue_blocks=4):
+        if not stages or not isinstance(stages[0], Source):
+            raise ValueError('A pipeline starts with a source stage')
+        self.stages = stages
+        self.queue_blocks = queue_blocks
+
+    def _put(self, target, item, stats):
+        start = time.perf_counter()
+        target.put(item)
+        stats.blocked_s += time.perf_counter() - start
+
+    def _run_source(self, stage, target, stats):
+        try:
+            blocks = iter(stage.blocks())
+            while not self.failed.is_set():
+                start = time.perf_counter()
+                with span(stage.name) as s:
+                    block = next(blocks, None)
+                    if block is not None:
+                        s.record(audio_seconds=block.seconds, tensor=block.audio)
+                stats.busy_s += time.perf_counter() - start
+                if block is None:
+                    break
+                stats.blocks += 1
+                stats.audio_s += block.seconds
+                self._put(target, block, stats)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            stage.close()
+            target.put(_END)
+
+    def _run_stage(self, stage, source, target, stats):
+        try:
+            while True:
+                start = time.perf_counter()
+                item = source.get()
+                stats.idle_s += time.perf_counter() - start
+                if item is _END:
+                    break
+                if self.failed.is_set():
+                    # keep draining so the stages before this one do not block
+                    continue
+                try:
+                    start = time.perf_counter()
+                    with span(stage.name, item.seconds):
+                        out = stage.process(item)
+                    stats.busy_s += time.perf_counter() - start
+                    stats.blocks += 1
+                    for block in out:
+                        stats.audio_s += block.seconds
+                        if target is not None:
+                            self._put(target, block, stats)
+                except BaseException as e:
+                    self._fail(e)
+            if not self.failed.is_set():
+                with span(stage.name):
+                    out = stage.finish()
+                for block in out:
+                    stats.audio_s += block.seconds
+                    if target is not None:
+                        self._put(target, block, stats)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            stage.close()
+            if target is not None:
+                target.put(_END)
+
+    def _fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.failed.set()
+
+    def run(self, **context):
+        """
+        Run the pipeline to the end. The keyword arguments (input_path,
+        output_path, mode, ...) are passed to every stage's start().
+
+        :return: {stage name: {blocks, audio_s, busy_s, idle_s, blocked_s}}
+        """
+        self.error = None
+        self.failed = threading.Event()
+        self.lock = threading.Lock()
+        for stage in self.stages:
+            stage.start(context)
+        queues = [queue.Queue(self.queue_blocks) for _ in self.stages[1:]]
+        stats = [StageStats() for _ in self.stages]
+        threads = [threading.Thread(target=self._run_source, args=(self.stages[0], queues[0], stats[0]))]
+        for i, stage in enumerate(self.stages[1:], 1):
+            target = queues[i] if i < len(queues) else None
+            threads.append(threading.Thread(target=self._run_stage, args=(stage, queues[i - 1], target, stats[i])))
+        for thread in threads:
+            thread.name = f'audio-pipeline-{thread.name}'
+            # every thread records its spans into the caller's trace
+            thread.run = _in_context(thread.run)
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        result = {}
+        for stage, stage_stats in zip(self.stages, stats):
+            name, suffix = stage.name, 2
+            while name in result:
+                name, suffix = f'{stage.name}_{suffix}', suffix + 1
+            result[name] = stage_stats.as_dict()
+        return result
+
+
+def _in_context(run):
+    context = contextvars.copy_context()
+    return lambda: context.run(run)
+
+
+def build(config, queue_blocks=None):
+    """Pipeline from a list of ``{'stage': <type>, **options}``."""
+    if queue_blocks is None:
+        queue_blocks = getattr(settings, 'AUDIO_PIPELINE_QUEUE_BLOCKS', 4)
+    stages = []
+    for entry in config:
+        options = dict(entry)
+        kind = options.pop('stage')
+        if kind not in STAGES:
+            raise ValueError(f'Unknown pipeline stage {kind!r}, known ones are {sorted(STAGES)}')
+        stages.append(STAGES[kind](**options))
+    return Pipeline(stages, queue_blocks)
+
+
+def process_file(pipeline, input_path, **context):
+    """
+    Run the pipeline called ``pipeline`` in settings.AUDIO_PIPELINES on a file.
+
+    :return: path of the output file
+    """
+    output_path = tempfile.NamedTemporaryFile(suffix=f'_{pipeline}.wav', delete=False).name
+    try:
+        build(settings.AUDIO_PIPELINES[pipeline]).run(input_path=input_path, output_path=output_path, **context)
+    except Exception:
+        os.remove(output_path)
+        raise
+    return output_path
+
+
+def processor(processing_type, fallback, **context):
+    """
+    ``process(input_path) -> output_path`` for a processing type: its streaming
+    pipeline if the type is listed in settings.AUDIO_STREAMING_PIPELINES, else
+    ``fallback``.
+    """
+    if processing_type in getattr(settings, 'AUDIO_STREAMING_PIPELINES', ()):
+        return lambda path: process_file(processing_type, path, **context)
+    return fallback
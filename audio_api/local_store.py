@@ -0,0 +1,79 @@
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+def default_state_path():
+    # tmpfs where available, the state is small and rewritten on every request
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'audio_api_state.json')
+
+
+def _state_path():
+    return getattr(settings, 'AUDIO_STATE_PATH', None) or default_state_path()
+
+
+def _parse(raw):
+    try:
+        return json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+
+
+def read(name):
+    """
+    A copy of one section of the node-local state file, read under a shared
+    lock. For lookups: readers do not wait for each other and the file is not
+    rewritten. Changes to the returned dict are not saved, use transaction().
+    """
+    try:
+        f = open(_state_path())
+    except FileNotFoundError:
+        return {}
+    with f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            raw = f.read()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return _parse(raw).get(name, {})
+
+
+@contextmanager
+def transaction(name):
+    """
+    Read-modify-write one section of the node-local state file under an
+    exclusive lock, so all gunicorn workers on the host see the same values.
+
+        with transaction('admission') as state:
+            state['running'] = ...
+
+    The state is a plain dict that must stay JSON serializable. It does not
+    survive a reboot, which is fine for counters that describe the current load.
+    """
+    fd = os.open(_state_path(), os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            data = _parse(f.read())
+            state = data.setdefault(name, {})
+            yield state
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
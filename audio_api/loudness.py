@@ -0,0 +1,186 @@
+"""
+Loudness normalization without a model: ITU-R BS.1770 / EBU R128 loudness
+measurement, gain and a look-ahead true-peak limiter, all streaming over
+blocks of [channels, samples] float arrays.
+
+LoudnessMeter K-weights the blocks (a high shelf and a high pass biquad, with
+the filter state carried from block to block) and keeps the mean square of
+every 100 ms step. The integrated loudness gates the 400 ms blocks of four
+consecutive steps (75 % overlap) at -70 LUFS and then 10 LU below the mean.
+
+TruePeakLimiter estimates the true peak of every sample from the 4x
+oversampled signal, turns it into the gain that keeps it below the ceiling,
+and smooths that gain with a sliding minimum followed by a moving average.
+The minimum reaches ``lookahead`` into the future and ``lookahead + hold``
+into the past, the average spans ``lookahead`` on either side, so the gain
+is down to the required value at every peak and ramps in and out over
+2 x lookahead. Both windows are vectorized (scipy.ndimage), the limiter
+holds back 2 x lookahead of input to see the peaks coming.
+"""
+import math
+
+import numpy as np
+import torch
+from scipy.ndimage import minimum_filter1d, uniform_filter1d
+from scipy.signal import sosfilt
+
+from voicefixer.tools.resample import filter_bank, resample
+
+# EBU R128 for speech on streaming platforms would be -16 to -14 LUFS
+DEFAULT_TARGET_LUFS = -16.0
+DEFAULT_TRUE_PEAK_DB = -1.0
+# Quiet or silent uploads are not raised by more than this
+DEFAULT_MAX_GAIN_DB = 30.0
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+STEP_SECONDS = 0.1
+STEPS_PER_BLOCK = 4
+OVERSAMPLING = 4
+
+
+def db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+
+def k_weighting(sample_rate):
+    """Second-order sections of the BS.1770 K-weighting filter at ``sample_rate``."""
+    # high shelf, +4 dB above ~1.7 kHz
+    gain_db, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = math.tan(math.pi * fc / sample_rate)
+    vh = 10.0 ** (gain_db / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1.0 + k / q + k * k
+    shelf = [
+        (vh + vb * k / q + k * k) / a0, 2.0 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+        1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0,
+    ]
+    # high pass at ~38 Hz
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = math.tan(math.pi * fc / sample_rate)
+    a0 = 1.0 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+
+class LoudnessMeter:
+    """Integrated loudness of a stream of [channels, samples] blocks."""
+
+    def __init__(self, sample_rate, channels=1):
+        self.sample_rate = sample_rate
+        self.sos = k_weighting(sample_rate)
+        # filter state for a signal that starts from silence, per channel
+        self.zi = np.zeros((len(self.sos), channels, 2))
+        self.step = int(round(STEP_SECONDS * sample_rate))
+        self.rest = np.zeros((channels, 0))
+        self.steps = []
+
+    def process(self, block):
+        weighted, self.zi = sosfilt(self.sos, np.asarray(block, dtype=np.float64), axis=-1, zi=self.zi)
+        weighted = np.concatenate([self.rest, weighted], axis=-1)
+        full = weighted.shape[-1] // self.step * self.step
+        if full:
+            squares = weighted[:, :full].reshape(weighted.shape[0], -1, self.step) ** 2
+            # channels are summed with weight 1 (mono, stereo; no surround weights)
+            self.steps.extend(squares.mean(axis=-1).sum(axis=0))
+        self.rest = weighted[:, full:]
+
+    def integrated(self):
+        """Gated loudness in LUFS, -inf for silence."""
+        steps = np.array(self.steps)
+        if self.rest.shape[-1]:
+            steps = np.append(steps, (self.rest ** 2).mean(axis=-1).sum())
+        if not len(steps):
+            return -math.inf
+        if len(steps) < STEPS_PER_BLOCK:
+            blocks = steps.mean(keepdims=True)
+        else:
+            blocks = np.convolve(steps, np.ones(STEPS_PER_BLOCK) / STEPS_PER_BLOCK, mode='valid')
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10.0 * np.log10(blocks)
+        gated = blocks[loudness > ABSOLUTE_GATE_LUFS]
+        if not len(gated):
+            return -math.inf
+        relative_gate = -0.691 + 10.0 * math.log10(gated.mean()) + RELATIVE_GATE_LU
+        gated = blocks[loudness > max(relative_gate, ABSOLUTE_GATE_LUFS)]
+        return -0.691 + 10.0 * math.log10(gated.mean())
+
+
+def normalization_gain(loudness, target=DEFAULT_TARGET_LUFS, max_gain_db=DEFAULT_MAX_GAIN_DB):
+    """Gain in dB from ``loudness`` to ``target`` LUFS, 0 for silence."""
+    if not math.isfinite(loudness):
+        return 0.0
+    return min(target - loudness, max_gain_db)
+
+
+class TruePeakLimiter:
+    """
+    Look-ahead true-peak limiter over a stream of [channels, samples] blocks.
+    The channels share one gain. The output has as many samples as the input
+    but lags it: process() returns what is complete, flush() the rest.
+    """
+
+    def __init__(self, sample_rate, ceiling_db=DEFAULT_TRUE_PEAK_DB, lookahead=0.005, hold=0.02):
+        self.sample_rate = sample_rate
+        self.ceiling = db_to_gain(ceiling_db)
+        self.lookahead = max(1, int(round(lookahead * sample_rate)))
+        self.hold = 2 * int(round(hold * sample_rate / 2))
+        # input the oversampling filters reach beyond a sample
+        reach = filter_bank(sample_rate, OVERSAMPLING * sample_rate).width
+        self.right = 2 * self.lookahead + reach
+        self.left = 2 * self.lookahead + self.hold + reach
+        self.buffer = None
+        # global index of the first buffered sample and of the next output sample
+        self.offset = -self.left
+        self.emitted = 0
+
+    def _true_peak(self, audio):
+        audio = torch.from_numpy(audio)
+        oversampled = resample(audio, self.sample_rate, OVERSAMPLING * self.sample_rate)
+        peak = oversampled[:, : audio.shape[-1] * OVERSAMPLING].abs().reshape(audio.shape[0], -1, OVERSAMPLING)
+        return torch.maximum(peak.amax(dim=(0, 2)), audio.abs().amax(dim=0)).numpy()
+
+    def _gain(self, audio):
+        peak = self._true_peak(audio)
+        gain = np.minimum(1.0, self.ceiling / np.maximum(peak, 1e-12))
+        window = 2 * self.lookahead + self.hold + 1
+        centered = minimum_filter1d(gain, window, mode='nearest')
+        # minimum over [t - lookahead - hold, t + lookahead]
+        shift = self.hold // 2
+        smallest = np.concatenate([np.full(shift, centered[0]), centered[: len(centered) - shift]])
+        return uniform_filter1d(smallest, 2 * self.lookahead + 1, mode='nearest')
+
+    def _emit(self, final):
+        if final:
+            pad = np.zeros((self.buffer.shape[0], self.right), dtype=self.buffer.dtype)
+            self.buffer = np.concatenate([self.buffer, pad], axis=-1)
+        end = self.offset + self.buffer.shape[-1]
+        ready = end - self.right
+        if ready <= self.emitted:
+            return self.buffer[:, :0]
+        start, stop = self.emitted - self.offset, ready - self.offset
+        gain = self._gain(self.buffer)[start:stop]
+        out = np.clip(self.buffer[:, start:stop] * gain, -self.ceiling, self.ceiling)
+        self.emitted = ready
+        keep_from = ready - self.left
+        self.buffer = self.buffer[:, keep_from - self.offset:]
+        self.offset = keep_from
+        return out
+
+    def process(self, block):
+        """
+        :param block: float array [channels, samples]
+        :return: float array [channels, samples] of limited output, may be empty
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if self.buffer is None:
+            self.buffer = np.zeros((block.shape[0], self.left), dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer, block], axis=-1)
+        return self._emit(final=False)
+
+    def flush(self):
+        """:return: the rest of the output at the end of the stream"""
+        if self.buffer is None:
+            return np.zeros((1, 0), dtype=np.float32)
+        out = self._emit(final=True)
+        self.buffer = None
+        return out
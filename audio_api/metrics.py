@@ -0,0 +1,174 @@
+"""
+Prometheus metrics of the processing service, exposed on ``/metrics``.
+
+Under gunicorn every worker is a separate process with its own counters.
+When ``PROMETHEUS_MULTIPROC_DIR`` is set (gunicorn.conf.py does this) the
+metrics are written to memory-mapped files in that directory and the
+``/metrics`` view aggregates the files of all workers, so a scrape that lands
+on any worker sees the totals of the whole node.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+from voicefixer.tools import resample
+
+# Requests take from under a second to many minutes for hour-long uploads
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, float('inf'))
+# Upper bounds in seconds of audio and labels of the job size buckets
+SIZE_BUCKETS = ((30, 'under_30s'), (300, '30s_5m'), (1800, '5m_30m'), (float('inf'), 'over_30m'))
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, float('inf'))
+# Stages that report the duration of the input audio, see voicefixer.tools.instrument
+AUDIO_DURATION_STAGES = ('load_audio', 'load_wav')
+
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    # the gauges without labels write their files as soon as they are defined
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+PROCESSING_SECONDS = Histogram(
+    'audio_processing_seconds', 'Wall time of one processing job',
+    ['processing_type', 'mode'], buckets=LATENCY_BUCKETS,
+)
+REALTIME_FACTOR = Histogram(
+    'audio_realtime_factor', 'Processing wall time divided by the audio duration',
+    ['processing_type', 'mode'], buckets=RTF_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    'audio_stage_seconds', 'Wall time of one pipeline stage',
+    ['processing_type', 'stage'], buckets=LATENCY_BUCKETS,
+)
+VAD_SKIPPED_RATIO = Histogram(
+    'audio_vad_skipped_ratio', 'Fraction of the audio of a job that the models skipped as non-speech',
+    ['processing_type'], buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0),
+)
+SNR_BYPASSED = Counter(
+    'audio_snr_bypassed_files', 'Files whose estimated SNR was high enough to skip noise reduction',
+    ['processing_type'],
+)
+AUDIO_SECONDS = Counter(
+    'audio_processed_audio_seconds', 'Seconds of audio processed',
+    ['processing_type', 'mode'],
+)
+JOBS_TOTAL = Counter(
+    'audio_jobs', 'Finished processing jobs',
+    ['processing_type', 'mode', 'status'],
+)
+JOBS_IN_FLIGHT = Gauge(
+    'audio_jobs_in_flight', 'Jobs currently being processed',
+    multiprocess_mode='livesum',
+)
+JOBS_QUEUED = Gauge(
+    'audio_jobs_queued', 'Jobs waiting in the admission queue',
+    multiprocess_mode='livesum',
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    'audio_queue_wait_seconds', 'Time a job waited in the admission queue, by audio duration',
+    ['size'], buckets=LATENCY_BUCKETS,
+)
+ADMISSION_DECISIONS = Counter(
+    'audio_admission_decisions', 'Admission control decisions (accepted, queued, rejected, timed_out)',
+    ['processing_type', 'decision'],
+)
+QUALITY_LEVEL = Gauge(
+    'audio_quality_level', 'Quality level new jobs run at, 0 is full quality, see quality.py',
+    multiprocess_mode='livemostrecent',
+)
+DEGRADED_JOBS = Counter(
+    'audio_degraded_jobs', 'Jobs switched to a cheaper mode under load, by the mode they ran in',
+    ['processing_type', 'mode'],
+)
+MODEL_LOAD_SECONDS = Gauge(
+    'audio_model_load_seconds', 'Time it took to load a model',
+    ['model'], multiprocess_mode='max',
+)
+CACHE_REQUESTS = Counter(
+    'audio_cache_requests', 'Cache lookups by result (hit or miss)',
+    ['cache', 'result'],
+)
+BYTES_READ = Counter('audio_bytes_read', 'Bytes of uploaded audio read', ['processing_type'])
+BYTES_WRITTEN = Counter('audio_bytes_written', 'Bytes of processed audio written', ['processing_type'])
+
+
+def size_bucket(duration):
+    for limit, label in SIZE_BUCKETS:
+        if duration < limit:
+            return label
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+resample.add_cache_listener(lambda hit: record_cache('resampler', hit))
+
+
+@contextmanager
+def time_model_load(model):
+    start = time.perf_counter()
+    yield
+    MODEL_LOAD_SECONDS.labels(model).set(time.perf_counter() - start)
+
+
+class _Job:
+    def __init__(self, processing_type, mode):
+        self.processing_type = processing_type
+        self.mode = str(mode)
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def observe(self, stages, bytes_read=0, bytes_written=0):
+        """Attach the stage breakdown (Trace.breakdown()) and the I/O volume of the job."""
+        self.stages = stages
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+
+
+@contextmanager
+def track_job(processing_type, mode=''):
+    """
+    Record latency, real-time factor, per-stage time, I/O volume and the
+    outcome of the processing job run inside this block.
+    """
+    job = _Job(processing_type, mode)
+    status = 'error'
+    start = time.perf_counter()
+    JOBS_IN_FLIGHT.inc()
+    try:
+        yield job
+        status = 'ok'
+    finally:
+        JOBS_IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - start
+        JOBS_TOTAL.labels(processing_type, job.mode, status).inc()
+        if status == 'ok':
+            PROCESSING_SECONDS.labels(processing_type, job.mode).observe(elapsed)
+            for stage, values in job.stages.items():
+                STAGE_SECONDS.labels(processing_type, stage).observe(values['duration_s'])
+            audio_seconds = sum(
+                job.stages[stage]['audio_s'] for stage in AUDIO_DURATION_STAGES if stage in job.stages
+            )
+            if audio_seconds > 0:
+                AUDIO_SECONDS.labels(processing_type, job.mode).inc(audio_seconds)
+                REALTIME_FACTOR.labels(processing_type, job.mode).observe(elapsed / audio_seconds)
+            if job.stages.get('vad', {}).get('audio_s'):
+                VAD_SKIPPED_RATIO.labels(processing_type).observe(
+                    job.stages.get('vad_skipped', {}).get('audio_s', 0.0) / job.stages['vad']['audio_s']
+                )
+            if 'snr_bypassed' in job.stages:
+                SNR_BYPASSED.labels(processing_type).inc(job.stages['snr_bypassed']['count'])
+            BYTES_READ.labels(processing_type).inc(job.bytes_read)
+            BYTES_WRITTEN.labels(processing_type).inc(job.bytes_written)
+
+
+def metrics_view(request):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_api', '0007_remove_audioprocessing_enhanced_spectrogram_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='stage_metrics',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_api', '0008_audioprocessing_stage_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:12
+
+from django.db import migrations, models
+
+
+def mark_existing_done(apps, schema_editor):
+    # rows that exist already were processed in their request
+    AudioProcessing = apps.get_model('audio_api', 'AudioProcessing')
+    AudioProcessing.objects.update(status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_api', '0009_audioprocessing_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='batch_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='mode',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed'), ('rejected', 'Rejected')], default='pending', max_length=12),
+        ),
+        migrations.RunPython(mark_existing_done, migrations.RunPython.noop),
+    ]
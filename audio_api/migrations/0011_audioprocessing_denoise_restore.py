@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_api', '0010_audioprocessing_batch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='audioprocessing',
+            name='processing_type',
+            field=models.CharField(choices=[('noise_reduction', 'Noise Reduction'), ('volume_boost', 'Volume Boost'), ('denoise_restore', 'Denoise and Restore')], max_length=20),
+        ),
+    ]
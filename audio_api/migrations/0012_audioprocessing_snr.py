@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_api', '0011_audioprocessing_denoise_restore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='bypassed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='snr_db',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_api', '0012_audioprocessing_snr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioprocessing',
+            name='tier',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+    ]
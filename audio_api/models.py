@@ -6,6 +6,7 @@ class AudioProcessing(models.Model):
     PROCESSING_TYPES = [
         ('noise_reduction', 'Noise Reduction'),
         ('volume_boost', 'Volume Boost'),
+        ('denoise_restore', 'Denoise and Restore'),
     ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -16,6 +17,34 @@ class AudioProcessing(models.Model):
     # Processing metadata
     processing_type = models.CharField(max_length=20, choices=PROCESSING_TYPES)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Per-stage timing/memory breakdown, see voicefixer.tools.instrument
+    stage_metrics = models.JSONField(null=True, blank=True)
+    # Duration in seconds probed from the file header before processing
+    duration = models.FloatField(null=True, blank=True)
+    # SNR estimated before noise reduction and whether it was clean enough
+    # to skip the model, see noise_reducer.snr_gate
+    snr_db = models.FloatField(null=True, blank=True)
+    bypassed = models.BooleanField(default=False)
+    # Mode (noise reduction: tier) the upload was processed in, cheaper than
+    # the requested one while the node was under load, see quality.py
+    tier = models.CharField(max_length=8, blank=True, default='')
+    
+    # Batch submissions, see batch.py; single uploads are processed in the request
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('rejected', 'Rejected'),
+    ]
+    batch_id = models.UUIDField(null=True, blank=True, db_index=True)
+    mode = models.CharField(max_length=8, blank=True, default='')
+    status = models.CharField(max_length=12, choices=STATUSES, default='pending')
+    error = models.TextField(blank=True, default='')
+    # '<hostname>:<pid>' of the worker processing the item and when it claimed
+    # it, so the items of a worker that died go back to pending
+    worker = models.CharField(max_length=100, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
\ No newline at end of file
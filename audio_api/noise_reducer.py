@@ -1,18 +1,31 @@
 import os
+import shutil
 import tempfile
 import subprocess
 import torch
+from django.conf import settings
 from df.enhance import enhance, init_df, load_audio, save_audio
-from df.io import resample
+from voicefixer.tools import vad
+from voicefixer.tools.instrument import annotate, span
+from voicefixer.tools.modules.spectral_gate import SpectralGate
+from voicefixer.tools.resample import resample
+from .metrics import time_model_load
+
+# Denoising tiers of the denoise endpoint: DeepFilterNet, or the spectral gate
+# at about 1/100 of its cost for bulk and low-priority work
+STANDARD_TIER = 'standard'
+FAST_TIER = 'fast'
+TIERS = (STANDARD_TIER, FAST_TIER)
 
 # Initialize model
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model, df, _ = init_df(model_base_dir=None, config_allow_defaults=True)
-model = model.to(device=device).eval()
+with time_model_load('deepfilternet'):
+    model, df, _ = init_df(model_base_dir=None, config_allow_defaults=True)
+    model = model.to(device=device).eval()
 
 
 def convert_to_wav(input_path: str) -> str:
-    """Convert audio file to standard WAV format (48kHz, mono, PCM 16-bit)"""
+    """Convert audio file to standard WAV format (mono, PCM 16-bit, sample rate kept)"""
     # Always re-encode to ensure compatibility (especially for browser-recorded audio)
     output_path = tempfile.NamedTemporaryFile(suffix='.wav', delete=False).name
     
@@ -21,7 +34,6 @@ def convert_to_wav(input_path: str) -> str:
         result = subprocess.run([
             'ffmpeg', '-y', '-i', input_path,
             '-acodec', 'pcm_s16le',
-            '-ar', '48000',
             '-ac', '1',
             output_path
         ], capture_output=True, text=True)
@@ -39,7 +51,7 @@ def convert_to_wav(input_path: str) -> str:
     try:
         from pydub import AudioSegment
         audio = AudioSegment.from_file(input_path)
-        audio = audio.set_frame_rate(48000).set_channels(1)
+        audio = audio.set_channels(1)
         audio.export(output_path, format='wav')
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             return output_path
@@ -51,6 +63,138 @@ def convert_to_wav(input_path: str) -> str:
         raise Exception(f"Could not convert audio file: {e}")
 
 
+def fade_in(enhanced, sr, seconds=0.15):
+    """Fade in the first 150 ms of denoised audio to avoid clicks at the beginning"""
+    fade_duration = min(int(sr * seconds), enhanced.shape[-1])
+    ramp = torch.linspace(0.0, 1.0, fade_duration).unsqueeze(0)
+    enhanced[:, :fade_duration] = enhanced[:, :fade_duration] * ramp
+    return enhanced
+
+
+def load_mono(wav_path: str, sr: int = 48000):
+    """Load a WAV file as a [1, samples] tensor at sr (None keeps the file's), meta has the file's own sample rate"""
+    sample, meta = load_audio(wav_path, None)
+    # Handle multi-channel audio - convert to mono
+    if sample.dim() > 1 and sample.shape[0] > 1:
+        sample = sample.mean(dim=0, keepdim=True)
+    if sr is None:
+        return sample, meta
+    with span("resample", sample.shape[-1] / meta.sample_rate) as s:
+        sample = resample(sample, meta.sample_rate, sr)
+        s.record(tensor=sample)
+    return sample, meta
+
+
+def skip_silence_enabled():
+    return getattr(settings, 'AUDIO_SKIP_SILENCE', True)
+
+
+def snr_gate(sample, sr, key=None):
+    """
+    Estimate the SNR of a [1, samples] tensor from a few windows (see
+    voicefixer.tools.vad.estimate_snr) and decide whether it is clean enough
+    to skip DeepFilterNet, i.e. at or above settings.AUDIO_SNR_BYPASS_DB.
+    The estimate and the decision are annotated on the trace under ``key``
+    as snr_db and bypassed.
+    
+    Returns:
+        tuple: (estimated SNR in dB or None, True to bypass noise reduction)
+    """
+    threshold = getattr(settings, 'AUDIO_SNR_BYPASS_DB', 40.0)
+    if threshold is None:
+        return None, False
+    seconds = sample.shape[-1] / sr
+    with span("snr_estimate", seconds):
+        snr = vad.estimate_snr(sample[0].numpy(), sr)
+    bypass = snr is not None and snr >= threshold
+    if bypass:
+        # a span without work of its own, it carries the seconds passed through
+        with span("snr_bypassed", seconds):
+            pass
+    if key is not None:
+        annotate(key, snr_db=snr, bypassed=bypass)
+    return snr, bypass
+
+
+def denoise_inmem(sample):
+    """
+    Denoise a [1, samples] tensor at 48 kHz with DeepFilterNet, in memory.
+    Long non-speech regions are not denoised, see voicefixer.tools.vad.
+    
+    Returns:
+        Tensor: denoised audio at 48 kHz, faded in
+    """
+    def denoise(audio):
+        with span("model_forward", audio.shape[-1] / df.sr()) as s:
+            enhanced = enhance(model, df, torch.from_numpy(audio))
+            s.record(tensor=enhanced)
+        return enhanced.numpy()
+
+    if skip_silence_enabled():
+        enhanced, _ = vad.skip_silence(sample.numpy(), df.sr(), denoise)
+    else:
+        enhanced = denoise(sample.numpy())
+    return fade_in(torch.from_numpy(enhanced), df.sr())
+
+
+_spectral_gates = {}
+
+
+def spectral_gate(sr):
+    """The spectral gate for a sample rate, kept for the next file at that rate"""
+    gate = _spectral_gates.get(sr)
+    if gate is None:
+        gate = _spectral_gates[sr] = SpectralGate(sr).eval()
+    return gate
+
+
+def reduce_noise_fast(audio_path: str) -> str:
+    """
+    Reduce noise from audio file with the spectral gate instead of DeepFilterNet,
+    the 'fast' tier. The gate runs at the file's own sample rate, so nothing is
+    resampled. Clean uploads pass through (snr_gate).
+    
+    Args:
+        audio_path (str): Path to input audio file (mp3, wav, ogg, etc.)
+        
+    Returns:
+        str: Path to denoised output WAV file
+    """
+    with span("convert_to_wav"):
+        wav_path = convert_to_wav(audio_path)
+    
+    output_path = None
+    try:
+        output_path = tempfile.NamedTemporaryFile(suffix="_denoised.wav", delete=False).name
+        with span("load_audio") as s:
+            sample, meta = load_mono(wav_path, None)
+            sr = meta.sample_rate
+            s.record(audio_seconds=sample.shape[-1] / sr, tensor=sample)
+        
+        _, bypass = snr_gate(sample, sr, key=audio_path)
+        if bypass:
+            shutil.copyfile(wav_path, output_path)
+            return output_path
+        
+        with span("spectral_gate", sample.shape[-1] / sr) as s, torch.no_grad():
+            enhanced = spectral_gate(sr)(sample)
+            s.record(tensor=enhanced)
+        
+        with span("save_audio", sample.shape[-1] / sr, enhanced):
+            save_audio(output_path, enhanced, sr)
+        return output_path
+    
+    except Exception:
+        # Clean up the partial output file
+        if output_path is not None and os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+        
+    finally:
+        if wav_path != audio_path and os.path.exists(wav_path):
+            os.remove(wav_path)
+
+
 def reduce_noise(audio_path: str) -> str:
     """
     Reduce noise from audio file using DeepFilterNet.
@@ -61,39 +205,102 @@ def reduce_noise(audio_path: str) -> str:
     Returns:
         str: Path to denoised output WAV file
     """
-    # Convert to standard WAV format if needed
-    wav_path = convert_to_wav(audio_path)
-    should_cleanup = wav_path != audio_path
+    return reduce_noise_batch([audio_path])[0]
+
+
+def reduce_noise_batch(audio_paths: list) -> list:
+    """
+    Reduce noise from several audio files with one DeepFilterNet call.
+    
+    DeepFilterNet processes the channels of its input independently, so the
+    clips are zero-padded to the longest one and stacked as channels. Clips of
+    similar length batch best, the padding is computed and thrown away.
+    Clips the SNR gate finds clean (snr_gate) are not denoised, their output
+    is the converted input. Long non-speech regions are cut out of the clips
+    before and filled with the attenuated input after, see voicefixer.tools.vad.
     
+    Args:
+        audio_paths (list): Paths to input audio files
+        
+    Returns:
+        list: Paths to the denoised output WAV files, in the same order
+    """
+    wav_paths, output_paths = [], []
     try:
+        # Convert to standard WAV format if needed, one clip at a time so the
+        # clips converted before a failure are cleaned up
+        with span("convert_to_wav"):
+            for path in audio_paths:
+                wav_paths.append(convert_to_wav(path))
+        
         # Load audio at 48kHz (DeepFilterNet native sample rate)
         sr = 48000
-        sample, meta = load_audio(wav_path, sr)
+        samples, metas = [], []
+        with span("load_audio") as s:
+            for wav_path in wav_paths:
+                sample, meta = load_mono(wav_path, sr)
+                samples.append(sample)
+                metas.append(meta)
+            s.record(audio_seconds=sum(sample.shape[-1] for sample in samples) / sr, tensor=samples)
         
-        # Handle multi-channel audio - convert to mono
-        if sample.dim() > 1 and sample.shape[0] > 1:
-            sample = sample.mean(dim=0, keepdim=True)
+        # Clean clips skip the model, only the speech spans of the others go through it
+        bypass = [snr_gate(sample, sr, key=path)[1] for sample, path in zip(samples, audio_paths)]
+        spans = [None] * len(samples)
+        speech = [sample.numpy() for sample in samples]
+        for i, sample in enumerate(speech):
+            if bypass[i]:
+                speech[i] = sample[:, :0]
+            elif skip_silence_enabled():
+                spans[i], _ = vad.detect(sample, sr)
+                if spans[i] != [(0, sample.shape[-1])]:
+                    speech[i] = vad.compact(sample, spans[i]) if spans[i] else sample[:, :0]
+        lengths = [sample.shape[-1] for sample in speech]
+        audio_seconds = sum(lengths) / sr
+        batch = torch.zeros(len(samples), max(lengths))
+        for i, sample in enumerate(speech):
+            batch[i, :lengths[i]] = torch.from_numpy(sample[0])
         
         # Apply noise reduction using DeepFilterNet
-        enhanced = enhance(model, df, sample)
-        
-        # Apply fade-in to avoid clicks at the beginning
-        fade_duration = int(sr * 0.15)
-        fade_in = torch.linspace(0.0, 1.0, fade_duration).unsqueeze(0)
-        enhanced[:, :fade_duration] = enhanced[:, :fade_duration] * fade_in
-        
-        # Resample back to original sample rate if needed
-        if meta.sample_rate != sr:
-            enhanced = resample(enhanced, sr, meta.sample_rate)
-            sr = meta.sample_rate
+        with span("model_forward", audio_seconds) as s:
+            enhanced_batch = enhance(model, df, batch) if audio_seconds else batch
+            s.record(tensor=enhanced_batch)
         
-        # Save enhanced audio
-        output_path = tempfile.NamedTemporaryFile(suffix="_denoised.wav", delete=False).name
-        save_audio(output_path, enhanced, sr)
+        for i, meta in enumerate(metas):
+            if bypass[i]:
+                output_path = tempfile.NamedTemporaryFile(suffix="_denoised.wav", delete=False).name
+                output_paths.append(output_path)
+                shutil.copyfile(wav_paths[i], output_path)
+                continue
+            enhanced = enhanced_batch[i:i + 1, :lengths[i]].numpy()
+            if spans[i] is not None and spans[i] != [(0, samples[i].shape[-1])]:
+                enhanced = vad.expand(enhanced, samples[i].numpy(), spans[i], sr)
+            enhanced = fade_in(torch.from_numpy(enhanced).clone(), sr)
+            out_sr = sr
+            
+            # Resample back to original sample rate if needed
+            if meta.sample_rate != sr:
+                with span("resample", samples[i].shape[-1] / sr) as s:
+                    enhanced = resample(enhanced, sr, meta.sample_rate)
+                    s.record(tensor=enhanced)
+                out_sr = meta.sample_rate
+            
+            # Save enhanced audio
+            output_path = tempfile.NamedTemporaryFile(suffix="_denoised.wav", delete=False).name
+            output_paths.append(output_path)
+            with span("save_audio", samples[i].shape[-1] / sr, enhanced):
+                save_audio(output_path, enhanced, out_sr)
         
-        return output_path
+        return output_paths
+    
+    except Exception:
+        # Clean up the outputs of the clips done before the failure
+        for output_path in output_paths:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        raise
         
     finally:
-        # Clean up temporary converted file
-        if should_cleanup and os.path.exists(wav_path):
-            os.remove(wav_path)
+        # Clean up temporary converted files
+        for audio_path, wav_path in zip(audio_paths, wav_paths):
+            if wav_path != audio_path and os.path.exists(wav_path):
+                os.remove(wav_path)
@@ -0,0 +1,41 @@
+import gc
+import os
+import torch
+from voicefixer.tools.pytorch_util import freeze_for_fork
+
+
+def preload_models():
+    """
+    Load DeepFilterNet and VoiceFixer once in the master process before the
+    workers are forked (gunicorn ``preload_app``).
+
+    The weights are frozen and placed in shared memory, and every object that
+    exists after loading is moved to the permanent GC generation, so neither
+    autograd nor the garbage collector touches the inherited pages and the
+    workers keep sharing them copy-on-write.
+    """
+    # Avoid starting an OpenMP pool in the master, it does not survive fork()
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        from . import noise_reducer, volume_booster
+
+        freeze_for_fork(noise_reducer.model)
+        # VoiceFixer weights are mmap-backed already (load_state_dict_mmap)
+        freeze_for_fork(volume_booster.voicefixer, share_memory=False)
+    finally:
+        torch.set_num_threads(threads)
+
+    gc.collect()
+    gc.freeze()
+
+
+def worker_init():
+    """Per-worker setup after fork."""
+    threads = os.environ.get('AUDIO_API_TORCH_THREADS')
+    if threads:
+        torch.set_num_threads(int(threads))
+
+    # every worker picks up pending batch items
+    from .batch import ensure_runner
+    ensure_runner()
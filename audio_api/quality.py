@@ -0,0 +1,77 @@
+"""
+Load-adaptive quality: under pressure, new jobs run in cheaper configurations.
+
+The load of the node is the work running and waiting in the admission queue
+(admission.load), as a multiple of the compute budget. So it grows with both
+utilization and queue depth. settings.AUDIO_QUALITY_LEVELS is a list of
+levels of increasing load, each with the substitutions of modes it makes:
+
+    {'load': 0.9, 'modes': {'noise_reduction': 'fast', 'volume_boost:2': '0'}},
+    {'load': 1.5, 'modes': {'volume_boost:0': 'dsp'}},
+
+Keys are ``<processing_type>:<mode>``, or the processing type alone for its
+default mode, as in settings.AUDIO_RTF. At a level, the substitutions of it
+and of all levels below apply in order, so above a load of 1.5 a mode 2 boost
+runs as 'dsp'. A level is entered as soon as the load reaches it, but only left
+once the load is below AUDIO_QUALITY_HYSTERESIS x its threshold, so the
+quality does not flap with every job. The level is kept in the node-local
+admission state, all workers of the node share it.
+
+Jobs are degraded before admission, so their cost is estimated for the mode
+they actually run in. The mode used is recorded as AudioProcessing.tier.
+"""
+from django.conf import settings
+
+from . import admission, metrics
+from .local_store import transaction
+
+
+def _key(processing_type, mode):
+    return f'{processing_type}:{mode}' if mode else processing_type
+
+
+def level_for(load, current, levels, hysteresis):
+    """The quality level at ``load``, coming from level ``current`` (0 is full quality)."""
+    level = sum(1 for entry in levels if load >= entry['load'])
+    while current > level and load <= levels[current - 1]['load'] * hysteresis:
+        current -= 1
+    return max(level, min(current, len(levels)))
+
+
+def degrade(processing_type, mode, levels):
+    """The mode a job requested in ``mode`` runs in with the substitutions of ``levels``."""
+    mode = str(mode)
+    for entry in levels:
+        mode = str(entry['modes'].get(_key(processing_type, mode), mode))
+    return mode
+
+
+def current_level():
+    """Update the quality level of the node from its load and return it."""
+    levels = getattr(settings, 'AUDIO_QUALITY_LEVELS', [])
+    if not levels:
+        return 0
+    hysteresis = getattr(settings, 'AUDIO_QUALITY_HYSTERESIS', 0.7)
+    with transaction('admission') as state:
+        level = level_for(admission.load(state), state.get('quality_level', 0), levels, hysteresis)
+        state['quality_level'] = level
+    metrics.QUALITY_LEVEL.set(level)
+    return level
+
+
+def choose(processing_type, mode=''):
+    """
+    The mode to run a new job in, given the load of the node.
+
+    Args:
+        processing_type: 'noise_reduction', 'volume_boost' or 'denoise_restore'
+        mode: the requested mode, '' for the default one
+
+    Returns:
+        str: the requested mode, or a cheaper one under load
+    """
+    level = current_level()
+    used = degrade(processing_type, mode, getattr(settings, 'AUDIO_QUALITY_LEVELS', [])[:level])
+    if used != str(mode):
+        metrics.DEGRADED_JOBS.labels(processing_type, used).inc()
+    return used
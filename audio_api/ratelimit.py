@@ -0,0 +1,90 @@
+"""
+Token buckets of audio-seconds per client and processing type.
+
+Every client (``user:<id>`` or ``ip:<address>``) has one bucket per processing
+type, refilled at ``per_hour / 3600`` audio-seconds per second up to ``burst``,
+as configured in settings.AUDIO_RATE_LIMITS for 'user' and 'guest'. A job
+takes its probed duration out of the bucket. A job longer than the burst is
+let through when the bucket is full and leaves it in debt, so it delays the
+client's following jobs instead of being impossible to submit.
+
+The buckets live in the node-local state file, shared by all workers.
+"""
+import math
+import time
+
+from django.conf import settings
+
+from .local_store import read, transaction
+
+
+def _limit(client, processing_type):
+    limits = getattr(settings, 'AUDIO_RATE_LIMITS', None) or {}
+    kind = 'user' if client.startswith('user:') else 'guest'
+    return (limits.get(kind) or {}).get(processing_type)
+
+
+def _refill(buckets, key, limit, now):
+    tokens, updated = buckets.get(key, (limit['burst'], now))
+    tokens = min(limit['burst'], tokens + (now - updated) * limit['per_hour'] / 3600)
+    return tokens
+
+
+def _wait_for(tokens, needed, limit):
+    return max(1, math.ceil((needed - tokens) * 3600 / limit['per_hour']))
+
+
+def _prune(buckets, now):
+    """Forget the buckets that have filled up again, they are the same as new ones."""
+    for key, (tokens, updated) in list(buckets.items()):
+        client, _, processing_type = key.rpartition('|')
+        limit = _limit(client, processing_type)
+        if limit is None or _refill(buckets, key, limit, now) >= limit['burst']:
+            del buckets[key]
+
+
+def check(client, processing_type):
+    """
+    Seconds to wait before the client may submit anything, None if its bucket is
+    not empty. Cheap enough to run before the upload is read.
+    """
+    limit = _limit(client, processing_type)
+    if limit is None:
+        return None
+    # a shared lock, only consume() writes the buckets
+    tokens = _refill(read('ratelimit'), f'{client}|{processing_type}', limit, time.time())
+    if tokens > 0:
+        return None
+    return _wait_for(tokens, 1, limit)
+
+
+def consume(client, processing_type, seconds):
+    """
+    Take ``seconds`` of audio out of the client's bucket.
+
+    :return: None if allowed, else the seconds to wait until it would be
+    """
+    limit = _limit(client, processing_type)
+    if limit is None:
+        return None
+    now = time.time()
+    key = f'{client}|{processing_type}'
+    with transaction('ratelimit') as buckets:
+        tokens = _refill(buckets, key, limit, now)
+        needed = min(seconds, limit['burst'])
+        if tokens < needed:
+            return _wait_for(tokens, needed, limit)
+        buckets[key] = (tokens - seconds, now)
+        _prune(buckets, now)
+    return None
+
+
+def refund(client, processing_type, seconds):
+    """Give back the audio-seconds of a job that was not run."""
+    limit = _limit(client, processing_type)
+    if limit is None:
+        return
+    now = time.time()
+    key = f'{client}|{processing_type}'
+    with transaction('ratelimit') as buckets:
+        buckets[key] = (min(limit['burst'], _refill(buckets, key, limit, now) + seconds), now)
@@ -0,0 +1,99 @@
+"""
+Order in which queued jobs are admitted, see admission.py.
+
+A scheduler picks the next job from the admission queue. Queue entries are
+dicts with ticket, cost (estimated processing seconds), client (``user:<id>``
+or ``ip:<address>``), enqueued (epoch seconds) and pid. Select the scheduler
+with settings.AUDIO_SCHEDULER, any class with a ``select(state, now)`` method
+works.
+"""
+import math
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_SCHEDULER = 'audio_api.scheduling.WeightedFairScheduler'
+
+# (settings.AUDIO_SCHEDULER, instance), rebuilt when the setting changes
+_scheduler = (None, None)
+
+
+def get_scheduler():
+    global _scheduler
+    path = getattr(settings, 'AUDIO_SCHEDULER', DEFAULT_SCHEDULER)
+    if _scheduler[0] != path:
+        _scheduler = (path, import_string(path)())
+    return _scheduler[1]
+
+
+def client_weight(client):
+    """Fair-share weight of a client, from settings.AUDIO_FAIR_SHARE_WEIGHTS."""
+    weights = getattr(settings, 'AUDIO_FAIR_SHARE_WEIGHTS', {})
+    if client in weights:
+        return weights[client]
+    return weights.get('user' if client.startswith('user:') else 'guest', 1.0)
+
+
+def _decay(value, since, now):
+    half_life = getattr(settings, 'AUDIO_FAIR_SHARE_HALF_LIFE', 600)
+    return value * math.pow(0.5, max(now - since, 0) / half_life)
+
+
+def record_usage(state, client, cost, now):
+    """Add the cost of a finished job to the client's exponentially decaying usage."""
+    usage = state.setdefault('usage', {})
+    value, since = usage.get(client, (0.0, now))
+    usage[client] = (_decay(value, since, now) + cost, now)
+    # forget clients whose usage has decayed away
+    for other, (value, since) in list(usage.items()):
+        if _decay(value, since, now) < 1.0:
+            del usage[other]
+
+
+def client_usage(state, client, now):
+    """Decayed cost of the client's finished jobs plus the cost of its running ones."""
+    value, since = state.get('usage', {}).get(client, (0.0, now))
+    running = sum(job['cost'] for job in state.get('running', {}).values() if job.get('client') == client)
+    return _decay(value, since, now) + running
+
+
+class Scheduler:
+    def priority(self, job, state, now):
+        """Lower runs first."""
+        raise NotImplementedError
+
+    def select(self, state, now):
+        if not state['queue']:
+            return None
+        return min(state['queue'], key=lambda job: self.priority(job, state, now))
+
+
+class FifoScheduler(Scheduler):
+    def priority(self, job, state, now):
+        return job['enqueued']
+
+
+class ShortestJobFirstScheduler(Scheduler):
+    """
+    Cheapest job first. Every second of waiting takes AUDIO_SCHEDULER_AGING
+    seconds off a job's cost, so a long job overtakes newer short ones eventually.
+    """
+
+    def priority(self, job, state, now):
+        aging = getattr(settings, 'AUDIO_SCHEDULER_AGING', 1.0)
+        return job['cost'] - aging * (now - job['enqueued'])
+
+
+class WeightedFairScheduler(ShortestJobFirstScheduler):
+    """
+    Shortest job first with per-client fair share: a job's cost is inflated by
+    what its client has used recently (running jobs plus decayed finished ones)
+    and divided by the client's weight, so one client submitting many jobs does
+    not crowd out everybody else.
+    """
+
+    def priority(self, job, state, now):
+        aging = getattr(settings, 'AUDIO_SCHEDULER_AGING', 1.0)
+        client = job.get('client', '')
+        share = (job['cost'] + client_usage(state, client, now)) / client_weight(client)
+        return share - aging * (now - job['enqueued'])
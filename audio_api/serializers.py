@@ -9,11 +9,42 @@ class AudioProcessingSerializer(serializers.ModelSerializer):
 
 class NoiseReductionSerializer(serializers.Serializer):
     audio_file = serializers.FileField()
+    tier = serializers.ChoiceField(
+        choices=['standard', 'fast'],
+        default='standard',
+        help_text='standard: DeepFilterNet, fast: spectral gating, about 100x cheaper at lower quality'
+    )
+
+class BatchSerializer(serializers.Serializer):
+    processing_type = serializers.ChoiceField(choices=['noise_reduction', 'volume_boost'])
+    mode = serializers.ChoiceField(
+        choices=['0', '1', '2', 'dsp'],
+        default='0',
+        help_text='Volume boost only. 0: Mild, 1: Moderate, 2: Aggressive, dsp: loudness normalization only'
+    )
+    audio_files = serializers.ListField(child=serializers.FileField(), required=False, default=list)
+    archive = serializers.FileField(required=False, help_text='zip, tar, tar.gz or tar.bz2 of audio files')
+
+    def validate(self, data):
+        if not data.get('audio_files') and not data.get('archive'):
+            raise serializers.ValidationError('Provide audio_files or an archive.')
+        return data
+
+class VolumeBoostCompareSerializer(serializers.Serializer):
+    audio_file = serializers.FileField()
 
 class VolumeBoostSerializer(serializers.Serializer):
+    audio_file = serializers.FileField()
+    mode = serializers.ChoiceField(
+        choices=['0', '1', '2', 'dsp'],
+        default='0',
+        help_text='0: Mild, 1: Moderate, 2: Aggressive (VoiceFixer restoration), dsp: loudness normalization only'
+    )
+
+class DenoiseRestoreSerializer(serializers.Serializer):
     audio_file = serializers.FileField()
     mode = serializers.ChoiceField(
         choices=['0', '1', '2'],
         default='0',
-        help_text='0: Mild, 1: Moderate, 2: Aggressive'
+        help_text='VoiceFixer mode of the restoration. 0: Mild, 1: Moderate, 2: Aggressive'
     )
\ No newline at end of file
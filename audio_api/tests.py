@@ -1,3 +1,1078 @@
-from django.test import TestCase
+import io
+import math
+import os
+import shutil
+import socket
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import soundfile as sf
+import torch
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from voicefixer.tools.resample import StreamingResampler, filter_bank, resample
+from voicefixer.tools import vad
+from voicefixer.vocoder.base import Vocoder
+from voicefixer.vocoder.config import Config
+from voicefixer.vocoder.griffin_lim import GriffinLim
+from voicefixer.vocoder.model.generator import Generator
+from voicefixer.vocoder.model.streaming import receptive_field, streaming
+from voicefixer.tools.mel_scale import MelScale
+from voicefixer.tools.modules.spectral_gate import SpectralGate
+from voicefixer.tools.segment import find_cut, segment_bounds
+
+from . import admission, batch, graph, loudness, quality, ratelimit
+from .scheduling import (
+    FifoScheduler, ShortestJobFirstScheduler, WeightedFairScheduler, client_usage, client_weight, get_scheduler,
+    record_usage,
+)
+from .local_store import read, transaction
+from .models import AudioProcessing
+
+
+def write_wav(seconds, sample_rate=16000):
+    """Path of a temporary WAV file of ``seconds`` of silence, removed by the caller."""
+    fd, path = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    sf.write(path, np.zeros(int(seconds * sample_rate), dtype=np.float32), sample_rate)
+    return path
+
+
+def wav_bytes(seconds, sample_rate=16000):
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros(int(seconds * sample_rate), dtype=np.float32), sample_rate, format='WAV')
+    return buffer.getvalue()
+
+
+class LocalStateTestCase(SimpleTestCase):
+    """Points the node-local state file (local_store) at a fresh temporary file for every test."""
+
+    def setUp(self):
+        super().setUp()
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        state = override_settings(AUDIO_STATE_PATH=path)
+        state.enable()
+        self.addCleanup(state.disable)
+
+
+@override_settings(
+    AUDIO_COMPUTE_BUDGET=10, AUDIO_QUEUE_BUDGET=10, AUDIO_QUEUE_TIMEOUT=5,
+    AUDIO_MAX_DURATION=60, AUDIO_RTF={'test': 1.0}, AUDIO_RATE_LIMITS={},
+)
+class AdmissionTests(LocalStateTestCase):
+    def test_check_upload_returns_the_probe(self):
+        path = write_wav(2)
+        self.addCleanup(os.remove, path)
+        probe = admission.check_upload(path, 'test')
+        self.assertAlmostEqual(probe['duration'], 2)
+        self.assertEqual(probe['sample_rate'], 16000)
+
+    def test_check_upload_rejects_unreadable_files(self):
+        with self.assertRaises(admission.Rejected) as raised:
+            admission.check_upload('/nonexistent/upload.wav', 'test')
+        self.assertEqual(raised.exception.status, 400)
+
+    def test_check_upload_rejects_long_files(self):
+        path = write_wav(2)
+        self.addCleanup(os.remove, path)
+        with self.settings(AUDIO_MAX_DURATION=1):
+            with self.assertRaises(admission.Rejected) as raised:
+                admission.check_upload(path, 'test')
+        self.assertEqual(raised.exception.status, 413)
+
+    def test_accepted_job_is_released(self):
+        with admission.reserve('test', '', 4) as admitted:
+            self.assertEqual(admitted.cost, 4)
+            with transaction('admission') as state:
+                self.assertIn(admitted.ticket, state['running'])
+        with transaction('admission') as state:
+            self.assertEqual(state['running'], {})
+            self.assertEqual(admission.load(state), 0)
+
+    def test_cost_is_capped_at_the_budget(self):
+        with admission.reserve('test', '', 100) as admitted:
+            self.assertEqual(admitted.cost, 10)
+
+    def test_finished_job_updates_the_realtime_factor(self):
+        with admission.reserve('test', 'mode', 4):
+            pass
+        with transaction('admission') as state:
+            rtf = admission.realtime_factor(state, 'test', 'mode')
+        # the job took next to no time, so the factor moves from 1.0 towards 0
+        self.assertLess(rtf, 1.0)
+        self.assertGreaterEqual(rtf, 1 - admission.RTF_SMOOTHING)
+
+    def test_rejected_when_the_queue_is_full(self):
+        with admission.reserve('test', '', 10), self.settings(AUDIO_QUEUE_BUDGET=5):
+            with self.assertRaises(admission.Rejected) as raised:
+                with admission.reserve('test', '', 6):
+                    self.fail('admitted over the budget')
+        self.assertEqual(raised.exception.status, 429)
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+
+    def test_queued_job_times_out(self):
+        with admission.reserve('test', '', 10), self.settings(AUDIO_QUEUE_TIMEOUT=0):
+            with self.assertRaises(admission.Rejected):
+                with admission.reserve('test', '', 2):
+                    self.fail('admitted over the budget')
+            with transaction('admission') as state:
+                self.assertEqual(state['queue'], [])
+
+    def test_queued_job_starts_when_the_budget_frees_up(self):
+        started = threading.Event()
+
+        def queued():
+            with admission.reserve('test', '', 6):
+                started.set()
+
+        with admission.reserve('test', '', 8):
+            worker = threading.Thread(target=queued)
+            worker.start()
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                with transaction('admission') as state:
+                    if state.get('queue'):
+                        break
+                time.sleep(0.01)
+            self.assertAlmostEqual(admission.load(state), 1.4)
+            time.sleep(2 * admission.POLL_INTERVAL)
+            self.assertFalse(started.is_set())
+        worker.join(timeout=5)
+        self.assertTrue(started.is_set())
+
+
+def queued_job(ticket, cost, enqueued, client=''):
+    return {'ticket': ticket, 'cost': cost, 'client': client, 'enqueued': enqueued, 'pid': os.getpid()}
+
+
+@override_settings(
+    AUDIO_SCHEDULER_AGING=1.0, AUDIO_FAIR_SHARE_HALF_LIFE=600,
+    AUDIO_FAIR_SHARE_WEIGHTS={'user': 1.0, 'guest': 1.0},
+)
+class SchedulingTests(SimpleTestCase):
+    def test_empty_queue(self):
+        self.assertIsNone(WeightedFairScheduler().select({'queue': []}, 0))
+
+    def test_fifo_picks_the_oldest_job(self):
+        state = {'queue': [queued_job('a', 100, 10), queued_job('b', 1, 20)]}
+        self.assertEqual(FifoScheduler().select(state, 30)['ticket'], 'a')
+
+    def test_shortest_job_first(self):
+        state = {'queue': [queued_job('a', 100, 10), queued_job('b', 1, 20)]}
+        self.assertEqual(ShortestJobFirstScheduler().select(state, 30)['ticket'], 'b')
+
+    def test_long_jobs_age_into_the_lead(self):
+        state = {'queue': [queued_job('a', 100, 0), queued_job('b', 10, 200)]}
+        # a has waited 200 s longer, which outweighs its 90 s of extra cost
+        self.assertEqual(ShortestJobFirstScheduler().select(state, 200)['ticket'], 'a')
+
+    def test_busy_client_yields_to_others(self):
+        state = {
+            'queue': [queued_job('a', 10, 0, 'ip:1'), queued_job('b', 20, 0, 'ip:2')],
+            'running': {'r': {'cost': 50, 'client': 'ip:1', 'pid': os.getpid(), 'started': 0}},
+        }
+        self.assertEqual(ShortestJobFirstScheduler().select(state, 0)['ticket'], 'a')
+        self.assertEqual(WeightedFairScheduler().select(state, 0)['ticket'], 'b')
+
+    def test_weights(self):
+        state = {'queue': [queued_job('a', 10, 0, 'ip:1'), queued_job('b', 15, 0, 'user:1')]}
+        self.assertEqual(WeightedFairScheduler().select(state, 0)['ticket'], 'a')
+        with self.settings(AUDIO_FAIR_SHARE_WEIGHTS={'user': 2.0, 'guest': 1.0, 'ip:2': 4.0}):
+            self.assertEqual(client_weight('user:7'), 2.0)
+            self.assertEqual(client_weight('ip:2'), 4.0)
+            self.assertEqual(WeightedFairScheduler().select(state, 0)['ticket'], 'b')
+
+    def test_scheduler_follows_the_setting(self):
+        with self.settings(AUDIO_SCHEDULER='audio_api.scheduling.FifoScheduler'):
+            self.assertIsInstance(get_scheduler(), FifoScheduler)
+            self.assertIs(get_scheduler(), get_scheduler())
+        with self.settings(AUDIO_SCHEDULER='audio_api.scheduling.ShortestJobFirstScheduler'):
+            self.assertIs(type(get_scheduler()), ShortestJobFirstScheduler)
+        with self.settings():
+            del settings.AUDIO_SCHEDULER
+            self.assertIs(type(get_scheduler()), WeightedFairScheduler)
+
+    def test_usage_decays(self):
+        state = {}
+        record_usage(state, 'ip:1', 100, 0)
+        self.assertAlmostEqual(client_usage(state, 'ip:1', 600), 50)
+        record_usage(state, 'ip:1', 10, 600)
+        self.assertAlmostEqual(client_usage(state, 'ip:1', 600), 60)
+
+    def test_decayed_clients_are_forgotten(self):
+        state = {}
+        record_usage(state, 'ip:1', 2, 0)
+        record_usage(state, 'ip:2', 2, 6000)
+        self.assertNotIn('ip:1', state['usage'])
+        self.assertIn('ip:2', state['usage'])
+
+
+@override_settings(AUDIO_RATE_LIMITS={
+    'user': {'test': {'burst': 200, 'per_hour': 7200}},
+    'guest': {'test': {'burst': 100, 'per_hour': 3600}},
+})
+class RateLimitTests(LocalStateTestCase):
+    def setUp(self):
+        super().setUp()
+        # guests refill at one audio-second per second
+        self.now = 1000.0
+        clock = mock.patch('audio_api.ratelimit.time')
+        clock.start().time.side_effect = lambda: self.now
+        self.addCleanup(clock.stop)
+
+    def test_consume_until_empty(self):
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 60))
+        self.assertIsNone(ratelimit.check('ip:1', 'test'))
+        self.assertEqual(ratelimit.consume('ip:1', 'test', 60), 20)
+        self.now += 20
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 60))
+        self.assertEqual(ratelimit.check('ip:1', 'test'), 1)
+
+    def test_buckets_are_per_client_and_kind(self):
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 100))
+        self.assertIsNone(ratelimit.consume('ip:2', 'test', 100))
+        self.assertIsNone(ratelimit.consume('user:1', 'test', 200))
+        self.assertEqual(ratelimit.consume('user:1', 'test', 10), 5)
+
+    def test_check_does_not_write(self):
+        ratelimit.consume('ip:1', 'test', 100)
+        with open(settings.AUDIO_STATE_PATH) as f:
+            before = f.read()
+        with mock.patch('audio_api.ratelimit.transaction', side_effect=AssertionError('check took the write lock')):
+            self.assertEqual(ratelimit.check('ip:1', 'test'), 1)
+            self.assertIsNone(ratelimit.check('ip:2', 'test'))
+        with open(settings.AUDIO_STATE_PATH) as f:
+            self.assertEqual(f.read(), before)
+
+    def test_unlimited_types(self):
+        self.assertIsNone(ratelimit.consume('ip:1', 'other', 10 ** 6))
+        self.assertIsNone(ratelimit.check('ip:1', 'other'))
+
+    def test_long_job_leaves_the_bucket_in_debt(self):
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 300))
+        self.assertEqual(ratelimit.check('ip:1', 'test'), 201)
+        self.now += 250
+        self.assertIsNone(ratelimit.check('ip:1', 'test'))
+        self.assertEqual(ratelimit.consume('ip:1', 'test', 100), 50)
+
+    def test_refund(self):
+        ratelimit.consume('ip:1', 'test', 100)
+        ratelimit.refund('ip:1', 'test', 40)
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 40))
+        ratelimit.refund('ip:1', 'test', 1000)
+        # never above the burst
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 150))
+        self.assertEqual(ratelimit.check('ip:1', 'test'), 51)
+
+    def test_check_upload_takes_the_duration(self):
+        path = write_wav(60)
+        self.addCleanup(os.remove, path)
+        admission.check_upload(path, 'test', 'ip:1')
+        with self.assertRaises(admission.Rejected) as raised:
+            admission.check_upload(path, 'test', 'ip:1')
+        self.assertEqual(raised.exception.status, 429)
+        self.assertEqual(raised.exception.retry_after, 20)
+
+    def test_passes_multiply_the_charge(self):
+        path = write_wav(10)
+        self.addCleanup(os.remove, path)
+        with self.settings(AUDIO_RTF={'test': 1.0}, AUDIO_COMPUTE_BUDGET=100, AUDIO_QUEUE_BUDGET=100):
+            with admission.admit(path, 'test', 'compare', 'ip:1', passes=3):
+                pass
+        self.assertEqual(ratelimit.consume('ip:1', 'test', 71), 1)
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 70))
+
+    def test_rejected_admission_is_refunded(self):
+        path = write_wav(60)
+        self.addCleanup(os.remove, path)
+        with self.settings(AUDIO_RTF={'test': 1.0}, AUDIO_COMPUTE_BUDGET=10, AUDIO_QUEUE_BUDGET=0):
+            with admission.reserve('test', '', 10), self.assertRaises(admission.Rejected):
+                with admission.admit(path, 'test', client='ip:1'):
+                    self.fail('admitted over the budget')
+        self.assertIsNone(ratelimit.consume('ip:1', 'test', 100))
+
+
+ARCHIVE_MEMBERS = ['a.wav', 'dir/b.FLAC', 'notes.txt', '.hidden.wav', '__MACOSX/dir/._b.FLAC']
+
+
+@override_settings(AUDIO_BATCH_RUNNER=False, AUDIO_BATCH_SIZE=3, AUDIO_BATCH_LENGTH_TOLERANCE=0.25, AUDIO_RATE_LIMITS={})
+class BatchTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        fd, state = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, state)
+        paths = override_settings(MEDIA_ROOT=media, AUDIO_STATE_PATH=state)
+        paths.enable()
+        self.addCleanup(paths.disable)
+
+    def pending(self, batch_id, duration, processing_type='noise_reduction'):
+        return AudioProcessing.objects.create(
+            original_audio=ContentFile(b'', name='item.wav'), processing_type=processing_type,
+            batch_id=batch_id, duration=duration,
+        )
+
+    def test_zip_archive(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name in ARCHIVE_MEMBERS:
+                archive.writestr(name, name)
+        buffer.name = 'upload.zip'
+        buffer.seek(0)
+        members = [(name, member.read()) for name, member in batch.iter_archive(buffer)]
+        self.assertEqual(members, [('a.wav', b'a.wav'), ('b.FLAC', b'dir/b.FLAC')])
+
+    def test_tar_archive(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for name in ARCHIVE_MEMBERS:
+                info = tarfile.TarInfo(name)
+                info.size = len(name)
+                archive.addfile(info, io.BytesIO(name.encode()))
+        buffer.name = 'upload.tar.gz'
+        buffer.seek(0)
+        members = [(name, member.read()) for name, member in batch.iter_archive(buffer)]
+        self.assertEqual(members, [('a.wav', b'a.wav'), ('b.FLAC', b'dir/b.FLAC')])
+
+    def test_submit_and_manifest(self):
+        files = [
+            SimpleUploadedFile('short.wav', wav_bytes(1)),
+            SimpleUploadedFile('long.wav', wav_bytes(3)),
+        ]
+        with self.settings(AUDIO_MAX_DURATION=2):
+            batch_id = batch.submit(files, None, 'volume_boost', 1, None, 'ip:1')
+        result = batch.manifest(batch_id)
+        self.assertEqual(result['counts'], {'pending': 1, 'rejected': 1})
+        short, long = result['items']
+        self.assertEqual((short['status'], short['duration'], short['error']), ('pending', 1.0, ''))
+        self.assertEqual(long['status'], 'rejected')
+        self.assertIn('limit', long['error'])
+        self.assertTrue(AudioProcessing.objects.filter(batch_id=batch_id, mode='1').exists())
+
+    def test_manifest_of_unknown_batches(self):
+        self.assertIsNone(batch.manifest('not a uuid'))
+        self.assertIsNone(batch.manifest(uuid.uuid4()))
+
+    def test_claim_groups_similar_noise_reduction_items(self):
+        batch_id = uuid.uuid4()
+        first = self.pending(batch_id, 100)
+        similar = self.pending(batch_id, 120)
+        self.pending(batch_id, 200)
+        self.pending(batch_id, 100, 'volume_boost')
+        another = self.pending(batch_id, 90)
+        self.pending(batch_id, 110)
+        claimed = batch._claim()
+        self.assertEqual([item.id for item in claimed], [first.id, similar.id, another.id])
+        self.assertEqual(AudioProcessing.objects.filter(status='processing').count(), 3)
+        # the next claim starts from the oldest item left
+        self.assertEqual([item.duration for item in batch._claim()], [200])
+
+    def test_claim_requeues_items_of_dead_workers(self):
+        batch_id = uuid.uuid4()
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        now = timezone.now()
+        claims = {
+            'dead': (f'{socket.gethostname()}:{dead.pid}', now),
+            'alive': (f'{socket.gethostname()}:{os.getpid()}', now),
+            'remote': ('elsewhere:1', now),
+            'expired': ('elsewhere:1', now - timedelta(seconds=120)),
+        }
+        items = {}
+        for name, (worker, claimed_at) in claims.items():
+            item = self.pending(batch_id, None, 'volume_boost')
+            AudioProcessing.objects.filter(id=item.id).update(status='processing', worker=worker, claimed_at=claimed_at)
+            items[name] = item.id
+        with self.settings(AUDIO_BATCH_CLAIM_TIMEOUT=60):
+            claimed = batch._claim()
+        # the oldest requeued item is claimed again, by this worker
+        self.assertEqual([item.id for item in claimed], [items['dead']])
+        status = dict(AudioProcessing.objects.values_list('id', 'status'))
+        self.assertEqual(status[items['expired']], 'pending')
+        self.assertEqual(status[items['alive']], 'processing')
+        self.assertEqual(status[items['remote']], 'processing')
+        item = AudioProcessing.objects.get(id=items['dead'])
+        self.assertEqual(item.worker, f'{socket.gethostname()}:{os.getpid()}')
+        self.assertIsNotNone(item.claimed_at)
+
+    def test_stream_results(self):
+        batch_id = uuid.uuid4()
+        for name, data in [('one.mp3', b'1' * 1000), ('two.wav', b'2' * 10)]:
+            item = AudioProcessing.objects.create(
+                original_audio=ContentFile(b'', name=name), processing_type='volume_boost',
+                batch_id=batch_id, status='done',
+            )
+            item.processed_audio.save('boosted.wav', ContentFile(data))
+        self.pending(batch_id, 1)
+        data = b''.join(batch.stream_results(batch_id, chunk_size=100))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), ['one.wav', 'two.wav'])
+            self.assertEqual(archive.read('one.wav'), b'1' * 1000)
+
+
+class ToneSource(graph.Source):
+    """``count`` blocks of ``samples`` samples counting up from 0, at 1000 Hz."""
+
+    type = 'tone'
+
+    def __init__(self, count=8, samples=100, fail_at=None):
+        super().__init__()
+        self.count = count
+        self.samples = samples
+        self.fail_at = fail_at
+        self.closed = False
+
+    def blocks(self):
+        for i in range(self.count):
+            if i == self.fail_at:
+                raise RuntimeError('source failed')
+            audio = torch.arange(i * self.samples, (i + 1) * self.samples, dtype=torch.float32).reshape(1, -1)
+            yield graph.Block(audio, 1000, {'source_sample_rate': 1000})
+
+    def close(self):
+        self.closed = True
+
+
+class Collect(graph.Stage):
+    """Keeps what it receives; optionally fails on block ``fail_at`` or holds everything back until the end."""
+
+    type = 'collect'
+
+    def __init__(self, fail_at=None, fail_in_finish=False, hold=False, name=None):
+        super().__init__(name)
+        self.fail_at = fail_at
+        self.fail_in_finish = fail_in_finish
+        self.hold = hold
+        self.received = []
+        self.closed = False
+
+    def process(self, block):
+        if len(self.received) == self.fail_at:
+            raise ValueError('stage failed')
+        self.received.append(block)
+        return [] if self.hold else [block]
+
+    def finish(self):
+        if self.fail_in_finish:
+            raise ValueError('finish failed')
+        return self.received if self.hold else []
+
+    def close(self):
+        self.closed = True
+
+    def audio(self):
+        return torch.cat([block.audio for block in self.received], -1)
+
+
+class PipelineTests(SimpleTestCase):
+    def temp_wav(self):
+        fd, path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_blocks_pass_through_in_order(self):
+        source, first, last = ToneSource(), Collect(), Collect(hold=True)
+        stats = graph.Pipeline([source, first, last], queue_blocks=1).run()
+        self.assertTrue(torch.equal(last.audio()[0], torch.arange(800, dtype=torch.float32)))
+        self.assertEqual(list(stats), ['tone', 'collect', 'collect_2'])
+        self.assertEqual(stats['tone']['blocks'], 8)
+        self.assertAlmostEqual(stats['tone']['audio_s'], 0.8)
+        # the held back blocks count when they are passed on at the end
+        self.assertAlmostEqual(stats['collect_2']['audio_s'], 0.8)
+        self.assertTrue(source.closed and first.closed and last.closed)
+
+    def test_context_reaches_every_stage(self):
+        stages = [ToneSource(), Collect()]
+        graph.Pipeline(stages).run(mode=2)
+        self.assertEqual([stage.context for stage in stages], [{'mode': 2}, {'mode': 2}])
+
+    def test_stage_error_is_raised_and_the_pipeline_drains(self):
+        # a queue of one block and many blocks: the stages before the failing
+        # one must keep going or the run would never end
+        source, failing, after = ToneSource(count=50), Collect(fail_at=3), Collect()
+        with self.assertRaisesMessage(ValueError, 'stage failed'):
+            graph.Pipeline([source, failing, after], queue_blocks=1).run()
+        self.assertLessEqual(len(after.received), 3)
+        self.assertTrue(source.closed and failing.closed and after.closed)
+
+    def test_source_error_is_raised(self):
+        source, after = ToneSource(fail_at=2), Collect(hold=True)
+        with self.assertRaisesMessage(RuntimeError, 'source failed'):
+            graph.Pipeline([source, after]).run()
+        self.assertTrue(source.closed and after.closed)
+
+    def test_finish_error_is_raised(self):
+        source, failing, after = ToneSource(), Collect(fail_in_finish=True), Collect()
+        with self.assertRaisesMessage(ValueError, 'finish failed'):
+            graph.Pipeline([source, failing, after]).run()
+        # the blocks still queued after the failure are dropped
+        self.assertLessEqual(len(after.received), 8)
+        self.assertTrue(after.closed)
+
+    def test_first_error_wins(self):
+        stages = [ToneSource(count=50), Collect(fail_at=2), Collect(fail_in_finish=True)]
+        with self.assertRaisesMessage(ValueError, 'stage failed'):
+            graph.Pipeline(stages, queue_blocks=1).run()
+
+    def test_pipeline_starts_with_a_source(self):
+        with self.assertRaises(ValueError):
+            graph.Pipeline([Collect(), Collect()])
+
+    def test_build_rejects_unknown_stages(self):
+        with self.assertRaisesMessage(ValueError, "Unknown pipeline stage 'nope'"):
+            graph.build([{'stage': 'decode'}, {'stage': 'nope'}])
+
+    def test_process_file_removes_its_output_on_errors(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        input_path = write_wav(1)
+        self.addCleanup(os.remove, input_path)
+        pipelines = {'copy': [{'stage': 'decode'}, {'stage': 'encode'}]}
+        with self.settings(AUDIO_PIPELINES=pipelines), mock.patch('tempfile.tempdir', output_dir):
+            with self.assertRaises(OSError):
+                graph.process_file('copy', '/nonexistent/upload.wav')
+            self.assertEqual(os.listdir(output_dir), [])
+            output_path = graph.process_file('copy', input_path)
+        self.assertEqual(os.listdir(output_dir), [os.path.basename(output_path)])
+        self.assertEqual(sf.info(output_path).frames, 16000)
+
+    def test_decode_gain_encode(self):
+        input_path, output_path = self.temp_wav(), self.temp_wav()
+        audio = np.random.default_rng(0).uniform(-0.25, 0.25, (16000, 2)).astype(np.float32)
+        sf.write(input_path, audio, 16000, subtype='FLOAT')
+        pipeline = graph.build([
+            {'stage': 'decode', 'block_seconds': 0.3},
+            {'stage': 'gain'},
+            {'stage': 'encode', 'subtype': 'FLOAT'},
+        ], queue_blocks=2)
+        stats = pipeline.run(input_path=input_path, output_path=output_path, gain_db=6.0)
+        self.assertEqual(stats['load_audio']['blocks'], 4)
+        output, sample_rate = sf.read(output_path, dtype='float32')
+        self.assertEqual(sample_rate, 16000)
+        np.testing.assert_allclose(output, audio * 10 ** (6.0 / 20), rtol=1e-6)
+
+
+class ResampleTests(SimpleTestCase):
+    RATES = [(44100, 48000), (48000, 16000), (16000, 44100), (22050, 44100)]
+
+    def test_streaming_equals_one_pass(self):
+        rng = np.random.default_rng(0)
+        audio = torch.from_numpy(rng.standard_normal((2, 20000)).astype(np.float32))
+        for orig_sr, new_sr in self.RATES:
+            expected = resample(audio, orig_sr, new_sr)
+            self.assertEqual(expected.shape[-1], filter_bank(orig_sr, new_sr).output_length(20000))
+            for block_size in [7, 441, 5000]:
+                with self.subTest(orig_sr=orig_sr, new_sr=new_sr, block_size=block_size):
+                    resampler = StreamingResampler(orig_sr, new_sr)
+                    blocks = [resampler.process(audio[:, i:i + block_size]) for i in range(0, 20000, block_size)]
+                    streamed = torch.cat(blocks + [resampler.flush()], -1)
+                    self.assertEqual(streamed.shape, expected.shape)
+                    self.assertLess((streamed - expected).abs().max().item(), 1e-5)
+
+    def test_matches_torchaudio(self):
+        try:
+            from torchaudio.functional import resample as torchaudio_resample
+        except ImportError:
+            self.skipTest('torchaudio is not installed')
+        audio = torch.from_numpy(np.random.default_rng(1).standard_normal((1, 8000)).astype(np.float32))
+        expected = torchaudio_resample(
+            audio, 48000, 16000, lowpass_filter_width=16, rolloff=0.9475937167399596,
+            resampling_method='sinc_interp_kaiser', beta=14.769656459379492,
+        )
+        self.assertLess((resample(audio, 48000, 16000) - expected).abs().max().item(), 1e-5)
+
+    def test_numpy_in_numpy_out(self):
+        audio = np.zeros(4410, dtype=np.float64)
+        out = resample(audio, 44100, 16000)
+        self.assertIsInstance(out, np.ndarray)
+        self.assertEqual((out.dtype, out.shape), (np.float32, (1600,)))
+        self.assertIs(resample(audio, 16000, 16000), audio)
+
+    def test_banks_are_cached(self):
+        self.assertIs(filter_bank(8000, 12000, 'fast'), filter_bank(8000, 12000, 'fast'))
+        self.assertIsNot(filter_bank(8000, 12000, 'fast'), filter_bank(8000, 12000, 'best'))
+        with self.assertRaises(ValueError):
+            filter_bank(8000, 12000, 'perfect')
+
+    def test_resample_stage_returns_to_the_source_rate(self):
+        source, after = ToneSource(count=7, samples=333), Collect()
+        graph.Pipeline([
+            source, graph.Resample(3000), graph.Resample('source', name='back'), after,
+        ], queue_blocks=1).run()
+        self.assertEqual(after.received[0].sample_rate, 1000)
+        self.assertEqual(after.audio().shape[-1], 7 * 333)
+
+
+def sine(frequency, seconds, sample_rate=48000, amplitude=1.0, phase=0.0):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t + phase)).astype(np.float32)[None]
+
+
+def true_peak(audio, sample_rate):
+    oversampled = resample(torch.from_numpy(np.ascontiguousarray(audio)), sample_rate, 4 * sample_rate)
+    return max(oversampled.abs().max().item(), float(np.abs(audio).max()))
+
+
+def measure(audio, sample_rate=48000, block_samples=None):
+    """Integrated loudness of [channels, samples], fed to the meter in blocks of ``block_samples``."""
+    meter = loudness.LoudnessMeter(sample_rate, audio.shape[0])
+    block_samples = block_samples or audio.shape[-1]
+    for start in range(0, audio.shape[-1], block_samples):
+        meter.process(audio[:, start:start + block_samples])
+    return meter.integrated()
+
+
+class LoudnessTests(SimpleTestCase):
+
+    def test_full_scale_sine(self):
+        # BS.1770: a 0 dBFS 997 Hz sine in one channel reads -3.01 LUFS
+        audio = sine(997, 5)
+        self.assertAlmostEqual(measure(audio), -3.01, delta=0.05)
+        self.assertAlmostEqual(measure(np.concatenate([audio, audio])), 0.0, delta=0.05)
+        self.assertAlmostEqual(measure(audio * 0.1), -23.01, delta=0.05)
+
+    def test_blocks_do_not_change_the_result(self):
+        audio = np.random.default_rng(0).standard_normal((2, 48000 * 3)).astype(np.float32) * 0.1
+        self.assertAlmostEqual(measure(audio, block_samples=1234), measure(audio), places=6)
+
+    def test_silence_is_gated(self):
+        self.assertEqual(measure(np.zeros((1, 48000), dtype=np.float32)), -np.inf)
+        self.assertEqual(loudness.normalization_gain(-np.inf), 0.0)
+        quiet = np.concatenate([sine(997, 2, amplitude=0.1), np.zeros((1, 4 * 48000), dtype=np.float32)], -1)
+        # the silence after the tone does not pull the loudness down, which
+        # would read -27.8 LUFS over the whole 6 s
+        self.assertAlmostEqual(measure(quiet), -23.01, delta=0.5)
+
+    def test_normalization_gain(self):
+        self.assertEqual(loudness.normalization_gain(-30.0, target=-16.0), 14.0)
+        self.assertEqual(loudness.normalization_gain(-10.0, target=-16.0), -6.0)
+        self.assertEqual(loudness.normalization_gain(-90.0, target=-16.0, max_gain_db=30.0), 30.0)
+
+
+class LimiterTests(SimpleTestCase):
+    def limit(self, audio, sample_rate=48000, block_samples=None, **options):
+        limiter = loudness.TruePeakLimiter(sample_rate, **options)
+        block_samples = block_samples or audio.shape[-1]
+        blocks = [limiter.process(audio[:, i:i + block_samples]) for i in range(0, audio.shape[-1], block_samples)]
+        return np.concatenate(blocks + [limiter.flush()], -1)
+
+    def test_quiet_audio_is_unchanged(self):
+        audio = sine(440, 1, amplitude=0.5)
+        np.testing.assert_allclose(self.limit(audio, block_samples=1000), audio, atol=1e-6)
+
+    def test_true_peaks_stay_below_the_ceiling(self):
+        rng = np.random.default_rng(0)
+        audio = (rng.standard_normal((2, 48000)) * 0.1).astype(np.float32)
+        # a burst up to 14 dB over full scale in the middle
+        audio[:, 20000:22000] *= 10
+        out = self.limit(audio, ceiling_db=-1.0)
+        self.assertEqual(out.shape, audio.shape)
+        self.assertLessEqual(true_peak(out, 48000), loudness.db_to_gain(-1.0) * 1.01)
+        # well away from the burst, the gain is back to 1
+        np.testing.assert_allclose(out[:, :10000], audio[:, :10000], atol=1e-6)
+        np.testing.assert_allclose(out[:, 30000:], audio[:, 30000:], atol=1e-6)
+
+    def test_inter_sample_peaks(self):
+        # samples at +-0.707 of a full-scale sine at a quarter of the sample rate
+        audio = sine(12000, 1, amplitude=1.0, phase=np.pi / 4)
+        self.assertLess(np.abs(audio).max(), loudness.db_to_gain(-1.0))
+        out = self.limit(audio, ceiling_db=-1.0)
+        # the true peak is 1.0, so the gain has to come down to the ceiling
+        gain = np.abs(out).max() / np.abs(audio).max()
+        self.assertAlmostEqual(gain, loudness.db_to_gain(-1.0), delta=0.001)
+
+    def test_streaming_equals_one_pass(self):
+        audio = (np.random.default_rng(1).standard_normal((1, 48000)) * 0.8).astype(np.float32)
+        np.testing.assert_allclose(self.limit(audio, block_samples=777), self.limit(audio), atol=1e-5)
+
+    @override_settings(AUDIO_PIPELINE_QUEUE_BLOCKS=2)
+    def test_dsp_boost_pipeline(self):
+        fd, input_path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        self.addCleanup(os.remove, input_path)
+        fd, output_path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        self.addCleanup(os.remove, output_path)
+        audio = sine(997, 4, amplitude=0.01)
+        # a click that the gain takes over full scale
+        audio[:, 48000:48005] = 0.05
+        sf.write(input_path, audio.T, 48000)
+        gain_db = loudness.normalization_gain(measure(audio), -16.0)
+        graph.build([
+            {'stage': 'decode', 'block_seconds': 1.0},
+            {'stage': 'gain'},
+            {'stage': 'limiter', 'ceiling_db': -1.0},
+            {'stage': 'encode', 'subtype': 'FLOAT'},
+        ]).run(input_path=input_path, output_path=output_path, gain_db=gain_db)
+        output, _ = sf.read(output_path, dtype='float32', always_2d=True)
+        self.assertEqual(output.shape[0], audio.shape[-1])
+        self.assertAlmostEqual(measure(output.T), -16.0, delta=0.5)
+        self.assertLessEqual(true_peak(output.T, 48000), loudness.db_to_gain(-1.0) * 1.01)
+
+
+class SegmentTests(SimpleTestCase):
+    SAMPLE_RATE = 8000
+
+    def assertSegments(self, bounds, length, longest):
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], length)
+        for (start, end), (next_start, _) in zip(bounds, bounds[1:]):
+            self.assertEqual(end, next_start)
+        for start, end in bounds:
+            self.assertLess(start, end)
+            self.assertLessEqual(end - start, longest)
+
+    def test_short_input_is_one_segment(self):
+        wav = np.zeros(31 * self.SAMPLE_RATE)
+        self.assertEqual(segment_bounds(wav, self.SAMPLE_RATE), [(0, len(wav))])
+
+    def test_segments_cover_the_input_within_the_limit(self):
+        rng = np.random.default_rng(0)
+        longest = 32 * self.SAMPLE_RATE
+        for _ in range(30):
+            length = int(rng.uniform(33, 200) * self.SAMPLE_RATE)
+            # noise with random quiet stretches
+            wav = rng.standard_normal(length) * rng.uniform(0, 1, length // 800 + 1).repeat(800)[:length]
+            bounds = segment_bounds(wav, self.SAMPLE_RATE)
+            self.assertSegments(bounds, length, longest)
+            self.assertEqual(len(bounds), math.ceil(length / longest))
+
+    def test_cuts_fall_into_pauses(self):
+        rng = np.random.default_rng(1)
+        wav = rng.standard_normal(90 * self.SAMPLE_RATE)
+        pauses = [(29.0, 29.5), (61.0, 61.5)]
+        for start, end in pauses:
+            wav[int(start * self.SAMPLE_RATE):int(end * self.SAMPLE_RATE)] *= 0.001
+        bounds = segment_bounds(wav, self.SAMPLE_RATE)
+        self.assertEqual(len(bounds), 3)
+        for (_, cut), (start, end) in zip(bounds, pauses):
+            self.assertTrue(start <= cut / self.SAMPLE_RATE <= end, cut / self.SAMPLE_RATE)
+
+    def test_find_cut_stays_in_range(self):
+        energy = np.ones(100)
+        energy[10] = 0
+        self.assertEqual(find_cut(energy, 10, 120, 50), 100)
+        # the quiet hop is out of [lo, hi], the cut stays inside
+        self.assertTrue(140 <= find_cut(energy, 10, 120, 50, lo=140) <= 170)
+        self.assertEqual(find_cut(energy, 10, 500, 5, lo=0, hi=300), 300)
+
+
+@override_settings(
+    AUDIO_RATE_LIMITS={'guest': {'volume_boost': {'burst': 100, 'per_hour': 3600}}},
+    AUDIO_RTF={'volume_boost:compare': 0.01}, AUDIO_STAGE_METRICS=False,
+)
+class BoostCompareTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        fd, state = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, state)
+        paths = override_settings(MEDIA_ROOT=media, AUDIO_STATE_PATH=state)
+        paths.enable()
+        self.addCleanup(paths.disable)
+        clock = mock.patch('audio_api.ratelimit.time')
+        clock.start().time.return_value = 1000.0
+        self.addCleanup(clock.stop)
+
+    def test_compare_is_charged_for_every_mode(self):
+        with mock.patch('audio_api.views._process_modes') as process:
+            response = self.client.post(
+                '/api/audio/boost/compare/', {'audio_file': SimpleUploadedFile('speech.wav', wav_bytes(10))}
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([audio_obj.mode for audio_obj in process.call_args.args[0]], ['0', '1', '2'])
+        # three modes of 10 s out of the bucket of 100 audio-seconds
+        tokens, _ = read('ratelimit')['ip:127.0.0.1|volume_boost']
+        self.assertAlmostEqual(tokens, 70, places=3)
+
+
+def bursts(layout, sample_rate=16000, amplitude=0.3):
+    """Tone bursts of 440 Hz in faint noise; ``layout`` is [(seconds, tone or not)]."""
+    rng = np.random.default_rng(0)
+    parts = []
+    for seconds, tone in layout:
+        part = rng.standard_normal(int(seconds * sample_rate)) * 1e-4
+        if tone:
+            part += sine(440, seconds, sample_rate, amplitude)[0]
+        parts.append(part)
+    return np.concatenate(parts).astype(np.float32)
+
+
+def syllables(seconds, sample_rate=16000, amplitude=0.3):
+    """A 440 Hz tone whose envelope dips, but never for long."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = amplitude * (0.05 + np.abs(np.sin(2 * np.pi * 2 * t)))
+    return (sine(440, seconds, sample_rate)[0] * envelope).astype(np.float32)
+
+
+# silence, 2 s tone, silence, two 1 s tones 0.5 s apart, silence
+BURSTS = [(3, False), (2, True), (3, False), (1, True), (0.5, False), (1, True), (3, False)]
+
+
+class VadTests(SimpleTestCase):
+    SAMPLE_RATE = 16000
+
+    def assertSpans(self, spans, expected):
+        self.assertEqual(len(spans), len(expected), spans)
+        for span, seconds in zip(spans, expected):
+            for sample, second in zip(span, seconds):
+                # frames are 30 ms long
+                self.assertAlmostEqual(sample / self.SAMPLE_RATE, second, delta=0.04)
+
+    def test_speech_spans(self):
+        wav = bursts(BURSTS, self.SAMPLE_RATE)
+        # padded by 0.25 s, the 0.5 s gap is too short to skip
+        self.assertSpans(vad.speech_spans(wav, self.SAMPLE_RATE), [(2.75, 5.25), (7.75, 10.75)])
+        self.assertSpans(vad.speech_spans(wav, self.SAMPLE_RATE, padding=0, min_silence=0.4), [
+            (3, 5), (8, 9), (9.5, 10.5),
+        ])
+
+    def test_expand_restores_the_spans(self):
+        wav = bursts(BURSTS, self.SAMPLE_RATE)
+        spans = vad.speech_spans(wav, self.SAMPLE_RATE)
+        out = vad.expand(vad.compact(wav, spans), wav, spans, self.SAMPLE_RATE, fill_gain=0.01, crossfade=0.02)
+        self.assertEqual(out.shape, wav.shape)
+        fade = int(0.02 * self.SAMPLE_RATE)
+        inside = np.zeros(len(wav), dtype=bool)
+        for start, end in spans:
+            inside[start:end] = True
+            np.testing.assert_allclose(out[start + fade:end - fade], wav[start + fade:end - fade], rtol=1e-6)
+        np.testing.assert_allclose(out[~inside], 0.01 * wav[~inside], rtol=1e-6)
+
+    def test_skip_silence_processes_the_speech_only(self):
+        wav = bursts(BURSTS, self.SAMPLE_RATE)
+        lengths = []
+
+        def process(audio):
+            lengths.append(audio.shape[-1])
+            return audio * 2
+
+        out, skipped = vad.skip_silence(wav, self.SAMPLE_RATE, process)
+        # one call on the two spans of 2.5 and 3 s
+        self.assertEqual(len(lengths), 1)
+        self.assertAlmostEqual(lengths[0] / self.SAMPLE_RATE, 5.5, delta=0.1)
+        self.assertAlmostEqual(skipped, 1 - 5.5 / 13.5, delta=0.01)
+        speech, silence = slice(4 * self.SAMPLE_RATE, 5 * self.SAMPLE_RATE), slice(0, 2 * self.SAMPLE_RATE)
+        np.testing.assert_allclose(out[speech], wav[speech] * 2, rtol=1e-6)
+        np.testing.assert_allclose(out[silence], wav[silence] * 0.01, rtol=1e-6)
+
+    def test_all_silence(self):
+        wav = np.zeros(5 * self.SAMPLE_RATE, dtype=np.float32)
+        wav[::7] = 1e-5
+        self.assertEqual(vad.speech_spans(wav, self.SAMPLE_RATE), [])
+        out, skipped = vad.skip_silence(wav, self.SAMPLE_RATE, lambda audio: self.fail('nothing to process'))
+        self.assertEqual(skipped, 1.0)
+        np.testing.assert_allclose(out, wav * 0.01)
+
+    def test_all_speech(self):
+        wav = syllables(5, self.SAMPLE_RATE)
+        self.assertEqual(vad.speech_spans(wav, self.SAMPLE_RATE), [(0, len(wav))])
+        out, skipped = vad.skip_silence(wav, self.SAMPLE_RATE, lambda audio: audio * 2)
+        self.assertEqual(skipped, 0.0)
+        np.testing.assert_allclose(out, wav * 2)
+
+
+@override_settings(AUDIO_SKIP_SILENCE=True, AUDIO_SNR_BYPASS_DB=None)
+class NoiseReducerVadTests(SimpleTestCase):
+    def test_batch_denoises_the_speech_spans_only(self):
+        from . import noise_reducer
+
+        paths = []
+        for wav in [bursts(BURSTS, 48000), syllables(4, 48000)]:
+            fd, path = tempfile.mkstemp(suffix='.wav')
+            os.close(fd)
+            self.addCleanup(os.remove, path)
+            sf.write(path, wav, 48000, subtype='FLOAT')
+            paths.append(path)
+        model_input = []
+
+        def enhance(model, df, batch):
+            model_input.append(batch.shape)
+            return batch * 2
+
+        def copy(path):
+            output_path = tempfile.NamedTemporaryFile(suffix='.wav', delete=False).name
+            shutil.copyfile(path, output_path)
+            return output_path
+
+        with mock.patch.object(noise_reducer, 'enhance', enhance), \
+                mock.patch.object(noise_reducer, 'convert_to_wav', copy):
+            outputs = noise_reducer.reduce_noise_batch(paths)
+        for output_path in outputs:
+            self.addCleanup(os.remove, output_path)
+        # the silence of the first clip is cut out, the second is speech throughout
+        self.assertEqual(model_input[0][0], 2)
+        self.assertAlmostEqual(model_input[0][1] / 48000, 5.5, delta=0.1)
+
+        wav = bursts(BURSTS, 48000)
+        out, sample_rate = sf.read(outputs[0], dtype='float32')
+        self.assertEqual((sample_rate, out.shape), (48000, wav.shape))
+        speech, silence = slice(4 * 48000, 5 * 48000), slice(48000, 2 * 48000)
+        np.testing.assert_allclose(out[speech], wav[speech] * 2, atol=1e-3)
+        np.testing.assert_allclose(out[silence], wav[silence] * 0.01, atol=1e-4)
+        # after the fade in
+        out, _ = sf.read(outputs[1], dtype='float32')
+        np.testing.assert_allclose(out[48000:], syllables(4, 48000)[48000:] * 2, atol=1e-3)
+
+
+def with_noise(wav, std, seed=0):
+    return (wav + np.random.default_rng(seed).standard_normal(wav.shape) * std).astype(np.float32)
+
+
+class SnrGateTests(SimpleTestCase):
+    def test_estimate_snr(self):
+        clean = bursts(BURSTS)
+        self.assertGreater(vad.estimate_snr(clean, 16000), 40)
+        self.assertLess(vad.estimate_snr(with_noise(clean, 0.05), 16000), 20)
+        self.assertIsNone(vad.estimate_snr(clean[:100], 16000))
+
+    @override_settings(AUDIO_SNR_BYPASS_DB=40.0)
+    def test_clean_uploads_bypass_the_model(self):
+        from .noise_reducer import snr_gate
+
+        clean = bursts(BURSTS)
+        snr, bypass = snr_gate(torch.from_numpy(clean)[None], 16000)
+        self.assertTrue(bypass)
+        self.assertGreaterEqual(snr, 40)
+        snr, bypass = snr_gate(torch.from_numpy(with_noise(clean, 0.05))[None], 16000)
+        self.assertFalse(bypass)
+        self.assertLess(snr, 40)
+        with self.settings(AUDIO_SNR_BYPASS_DB=None):
+            self.assertEqual(snr_gate(torch.from_numpy(clean)[None], 16000), (None, False))
+
+
+def snr(clean, audio):
+    return 10 * math.log10(np.sum(clean ** 2) / np.sum((audio - clean) ** 2))
+
+
+class SpectralGateTests(SimpleTestCase):
+    def test_chunks_match_a_single_pass(self):
+        wav = torch.from_numpy(np.stack([with_noise(bursts(BURSTS), 0.05, seed) for seed in (0, 1)]))
+        with torch.no_grad():
+            whole = SpectralGate(16000, chunk_seconds=60)(wav)
+            chunked = SpectralGate(16000, chunk_seconds=1)(wav)
+        self.assertEqual(chunked.shape, wav.shape)
+        torch.testing.assert_close(chunked, whole, atol=1e-5, rtol=0)
+
+    def test_raises_the_snr(self):
+        clean = bursts(BURSTS)
+        noisy = with_noise(clean, 0.05)
+        with torch.no_grad():
+            out = SpectralGate(16000)(torch.from_numpy(noisy)).numpy()
+        self.assertEqual(out.shape, noisy.shape)
+        self.assertGreater(snr(clean, out), snr(clean, noisy) + 3)
+
+
+class GriffinLimTests(SimpleTestCase):
+    def setUp(self):
+        self.mel_basis = MelScale(n_mels=128, sample_rate=44100, n_stft=1025).fb
+        # the mel of one second of a tone, as the vocoder sees it
+        spec = torch.stft(
+            torch.from_numpy(sine(440, 1, 44100)), 2048, 441, window=torch.hann_window(2048), return_complex=True
+        )
+        self.mel = torch.matmul(spec.abs().transpose(1, 2), self.mel_basis)[:, None].repeat(2, 1, 1, 1)
+
+    def vocode(self, seed=0):
+        with torch.no_grad():
+            return GriffinLim(self.mel_basis, n_iter=4, seed=seed)(self.mel)
+
+    def test_output_length(self):
+        wav = self.vocode()
+        self.assertEqual(wav.shape, (2, 1, self.mel.shape[2] * 441))
+        self.assertTrue(torch.isfinite(wav).all())
+
+    def test_seed_makes_it_reproducible(self):
+        torch.testing.assert_close(self.vocode(), self.vocode(), atol=0, rtol=0)
+        self.assertFalse(torch.allclose(self.vocode(), self.vocode(seed=1)))
+
+
+class QualityTests(SimpleTestCase):
+    levels = settings.AUDIO_QUALITY_LEVELS
+
+    def level(self, load, current):
+        return quality.level_for(load, current, self.levels, 0.7)
+
+    def test_levels_are_entered_at_their_threshold(self):
+        self.assertEqual(self.level(0.89, 0), 0)
+        self.assertEqual(self.level(0.9, 0), 1)
+        self.assertEqual(self.level(1.5, 0), 2)
+        self.assertEqual(self.level(1.5, 1), 2)
+
+    def test_levels_are_held_until_below_the_hysteresis(self):
+        # level 1 is left at 0.7 x 0.9
+        self.assertEqual(self.level(0.64, 1), 1)
+        self.assertEqual(self.level(0.62, 1), 0)
+        # level 2 at 0.7 x 1.5
+        self.assertEqual(self.level(1.06, 2), 2)
+        self.assertEqual(self.level(1.04, 2), 1)
+
+    def test_levels_step_down_one_at_a_time(self):
+        # below the threshold of level 2 but not yet below the hysteresis of level 1
+        self.assertEqual(self.level(0.8, 2), 1)
+        self.assertEqual(self.level(0.5, 2), 0)
+
+    def test_degrade(self):
+        self.assertEqual(quality.degrade('volume_boost', '2', []), '2')
+        self.assertEqual(quality.degrade('volume_boost', '2', self.levels[:1]), '0')
+        self.assertEqual(quality.degrade('volume_boost', '2', self.levels), 'dsp')
+        self.assertEqual(quality.degrade('volume_boost', 0, self.levels), 'dsp')
+        self.assertEqual(quality.degrade('noise_reduction', '', self.levels), 'fast')
+        self.assertEqual(quality.degrade('denoise_restore', '1', self.levels), '0')
+
+
+class StreamingVocoderTests(SimpleTestCase):
+    def generator(self, depth):
+        torch.manual_seed(0)
+        with mock.patch.object(Config, 'resstack_depth', [depth] * 4):
+            return Generator(Config.cin_channels).eval()
+
+    def vocoder(self):
+        # the released weights are not needed, a random generator streams the same way
+        vocoder = Vocoder.__new__(Vocoder)
+        torch.nn.Module.__init__(vocoder)
+        vocoder.model = self.generator(6)
+        vocoder.weight_torch = Config.get_mel_weight_torch(percent=1.0)[None, None, None, ...]
+        return vocoder
+
+    def test_receptive_field(self):
+        self.assertAlmostEqual(receptive_field(self.generator(8)), 578.3, delta=0.1)
+        self.assertAlmostEqual(receptive_field(self.generator(6)), 75.4, delta=0.1)
+
+    def test_first_block_waits_for_the_lookahead(self):
+        stream = streaming(self.generator(6))
+        with torch.no_grad():
+            fed = 1
+            while not stream.step(torch.zeros(1, 128, 1), False).shape[-1]:
+                fed += 1
+        self.assertEqual(fed, 73)
+
+    def test_stream_matches_forward(self):
+        vocoder = self.vocoder()
+        mel = torch.rand(2, 1, 301, 128, generator=torch.Generator().manual_seed(0))
+        with torch.no_grad():
+            whole = vocoder(mel)
+            # ragged chunks, the last one shorter
+            blocks = list(vocoder.stream(mel.split(37, 2)))
+            chunked = vocoder(mel, chunk_frames=37)
+        self.assertGreater(len(blocks), 2)
+        torch.testing.assert_close(torch.cat(blocks, -1), whole, atol=1e-5, rtol=0)
+        torch.testing.assert_close(chunked, whole, atol=1e-5, rtol=0)
@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (AudioProcessingViewSet, home_view, 
                    noise_reducer_view, volume_booster_view, signup_view, login_view, logout_view, profile_view)
+from .metrics import metrics_view
 
 router = DefaultRouter()
 router.register(r'audio', AudioProcessingViewSet)
@@ -15,4 +16,5 @@ urlpatterns = [
     path('login/', login_view, name='login'),
     path('logout/', logout_view, name='logout'),
     path('profile/', profile_view, name='profile'),
+    path('metrics', metrics_view, name='metrics'),
 ]
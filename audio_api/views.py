@@ -1,16 +1,119 @@
 import os
+import json
+import logging
+import tarfile
+import zipfile
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.core.files import File
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .models import AudioProcessing
-from .serializers import (AudioProcessingSerializer, NoiseReductionSerializer, VolumeBoostSerializer)
-from .noise_reducer import reduce_noise
-from .volume_booster import boost_volume
+from .serializers import (AudioProcessingSerializer, BatchSerializer, DenoiseRestoreSerializer,
+                          NoiseReductionSerializer, VolumeBoostCompareSerializer, VolumeBoostSerializer)
+from .noise_reducer import FAST_TIER, STANDARD_TIER, reduce_noise, reduce_noise_fast
+from .volume_booster import DSP_MODE, boost_volume, boost_volume_modes, parse_mode
+from .denoise_restore import denoise_and_restore
+from . import admission, batch, graph, metrics, quality
+from voicefixer.tools.instrument import collect, span
+
+logger = logging.getLogger(__name__)
+
+# Modes the boost/compare endpoint runs on one upload
+COMPARE_MODES = ('0', '1', '2')
+
+
+def _save_stage_metrics(audio_obj, trace):
+    """Store the stage breakdown unless disabled in settings."""
+    if not getattr(settings, 'AUDIO_STAGE_METRICS', True):
+        return
+    audio_obj.stage_metrics = trace.breakdown()
+    logger.info(json.dumps({
+        'event': 'audio_processed',
+        'id': str(audio_obj.id),
+        'processing_type': audio_obj.processing_type,
+        'stages': audio_obj.stage_metrics,
+    }))
+
+
+def _save_annotations(audio_obj, trace):
+    """Store what the stages decided for the upload, e.g. the SNR gate's snr_db and bypassed."""
+    for field, value in trace.annotations.get(audio_obj.original_audio.path, {}).items():
+        setattr(audio_obj, field, value)
+
+
+def _process_upload(audio_obj, process, output_name, mode=''):
+    """
+    Run ``process(input_path) -> output_path`` on the uploaded file and store the
+    result on ``audio_obj``, recording stage metrics and service metrics.
+    """
+    with metrics.track_job(audio_obj.processing_type, mode) as job, collect() as trace:
+        output_path = process(audio_obj.original_audio.path)
+        _store_output(audio_obj, output_path, output_name, trace)
+
+        job.observe(
+            trace.breakdown(),
+            bytes_read=audio_obj.original_audio.size,
+            bytes_written=audio_obj.processed_audio.size,
+        )
+
+
+def _process_modes(audio_objs, process, prefix, mode):
+    """
+    _process_upload for several rows of one upload, one per ``audio_obj.mode``:
+    ``process(input_path) -> {mode: output_path}`` processes them in one go.
+    """
+    first = audio_objs[0]
+    with metrics.track_job(first.processing_type, mode) as job, collect() as trace:
+        outputs = process(first.original_audio.path)
+        for audio_obj in audio_objs:
+            _store_output(audio_obj, outputs.get(int(audio_obj.mode)), f'{prefix}_{audio_obj.id}.wav', trace)
+
+        job.observe(
+            trace.breakdown(),
+            bytes_read=first.original_audio.size,
+            bytes_written=sum(audio_obj.processed_audio.size for audio_obj in audio_objs),
+        )
+
+
+def _store_output(audio_obj, output_path, output_name, trace):
+    if not output_path or not os.path.exists(output_path):
+        raise Exception("Audio processing returned no file")
+
+    with span('store_result'), open(output_path, 'rb') as f:
+        audio_obj.processed_audio.save(output_name, File(f), save=False)
+
+    _save_stage_metrics(audio_obj, trace)
+    _save_annotations(audio_obj, trace)
+    audio_obj.status = 'done'
+    audio_obj.save()
+    os.remove(output_path)
+
+
+def _boost_processor(mode):
+    """The 'dsp' mode streams already, the VoiceFixer modes may run as a pipeline."""
+    if mode == DSP_MODE:
+        return lambda path: boost_volume(path, mode)
+    return graph.processor('volume_boost', lambda path: boost_volume(path, mode), mode=mode)
+
+
+def _denoise_processor(tier):
+    """The 'fast' tier is a single in-memory pass, the standard one may run as a pipeline."""
+    if tier == FAST_TIER:
+        return reduce_noise_fast
+    return graph.processor('noise_reduction', reduce_noise)
+
+
+def _rejected(response, rejection):
+    if rejection.retry_after is not None:
+        response['Retry-After'] = str(rejection.retry_after)
+    return response
+
 
 class AudioProcessingViewSet(viewsets.ModelViewSet):
     queryset = AudioProcessing.objects.all()
@@ -19,69 +122,215 @@ class AudioProcessingViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def denoise(self, request):
         """Noise reduction endpoint"""
+        client = admission.client_key(request)
+        rejection = admission.check_rate(client, 'noise_reduction')
+        if rejection is not None:
+            return _rejected(Response({'error': str(rejection)}, status=rejection.status), rejection)
+        
         serializer = NoiseReductionSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         audio_file = serializer.validated_data['audio_file']
-        
-        audio_obj = AudioProcessing.objects.create(
-            original_audio=audio_file,
-            user=request.user if request.user.is_authenticated else None,
-            processing_type='noise_reduction'
-        )
+        # the standard tier keeps the unlabelled metrics and cost estimates
+        requested = serializer.validated_data['tier'] if serializer.validated_data['tier'] == FAST_TIER else ''
+        mode = quality.choose('noise_reduction', requested)
         
         try:
-            enhanced_path = reduce_noise(audio_obj.original_audio.path)
-            
-            with open(enhanced_path, 'rb') as f:
-                audio_obj.processed_audio.save(f'enhanced_{audio_obj.id}.wav', File(f), save=False)
-
-            audio_obj.save()
-            os.remove(enhanced_path)
-            
-            response_serializer = AudioProcessingSerializer(audio_obj)
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
-            audio_obj.delete()
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            with admission.admit(audio_file, 'noise_reduction', mode, client) as admitted:
+                audio_obj = AudioProcessing.objects.create(
+                    original_audio=audio_file,
+                    user=request.user if request.user.is_authenticated else None,
+                    processing_type='noise_reduction',
+                    mode=requested,
+                    tier=mode or STANDARD_TIER,
+                    duration=admitted.duration
+                )
+                
+                try:
+                    _process_upload(audio_obj, _denoise_processor(mode), f'enhanced_{audio_obj.id}.wav', mode=mode)
+                    
+                    response_serializer = AudioProcessingSerializer(audio_obj)
+                    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+                    
+                except Exception as e:
+                    audio_obj.delete()
+                    return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except admission.Rejected as e:
+            return _rejected(Response({'error': str(e)}, status=e.status), e)
     
     @action(detail=False, methods=['post'])
     def boost(self, request):
         """Volume boost endpoint"""
+        client = admission.client_key(request)
+        rejection = admission.check_rate(client, 'volume_boost')
+        if rejection is not None:
+            return _rejected(Response({'error': str(rejection)}, status=rejection.status), rejection)
+        
         serializer = VolumeBoostSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         audio_file = serializer.validated_data['audio_file']
-        mode = int(serializer.validated_data['mode'])
+        requested = serializer.validated_data['mode']
+        mode = parse_mode(quality.choose('volume_boost', requested))
         
-        audio_obj = AudioProcessing.objects.create(
-            original_audio=audio_file,
-            user=request.user if request.user.is_authenticated else None,
-            processing_type='volume_boost'
-        )
+        try:
+            with admission.admit(audio_file, 'volume_boost', mode, client) as admitted:
+                audio_obj = AudioProcessing.objects.create(
+                    original_audio=audio_file,
+                    user=request.user if request.user.is_authenticated else None,
+                    processing_type='volume_boost',
+                    mode=requested,
+                    tier=str(mode),
+                    duration=admitted.duration
+                )
+                
+                try:
+                    _process_upload(
+                        audio_obj,
+                        _boost_processor(mode),
+                        f'boosted_{audio_obj.id}.wav',
+                        mode=mode
+                    )
+                    
+                    response_serializer = AudioProcessingSerializer(audio_obj)
+                    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+                    
+                except Exception as e:
+                    audio_obj.delete()
+                    return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except admission.Rejected as e:
+            return _rejected(Response({'error': str(e)}, status=e.status), e)
+    
+    @action(detail=False, methods=['post'], url_path='boost/compare')
+    def boost_compare(self, request):
+        """Volume boost in all three modes for one upload, to compare them"""
+        client = admission.client_key(request)
+        rejection = admission.check_rate(client, 'volume_boost')
+        if rejection is not None:
+            return _rejected(Response({'error': str(rejection)}, status=rejection.status), rejection)
+        
+        serializer = VolumeBoostCompareSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        audio_file = serializer.validated_data['audio_file']
         
         try:
-            boosted_path = boost_volume(
-                audio_obj.original_audio.path,
-                mode
+            # three VoiceFixer passes, charged as three times the audio
+            with admission.admit(audio_file, 'volume_boost', 'compare', client, len(COMPARE_MODES)) as admitted:
+                audio_objs = []
+                for mode in COMPARE_MODES:
+                    audio_objs.append(AudioProcessing.objects.create(
+                        # the modes share the stored upload
+                        original_audio=audio_objs[0].original_audio.name if audio_objs else audio_file,
+                        user=request.user if request.user.is_authenticated else None,
+                        processing_type='volume_boost',
+                        mode=mode,
+                        duration=admitted.duration
+                    ))
+                
+                try:
+                    _process_modes(audio_objs, boost_volume_modes, 'boosted', 'compare')
+                    
+                    response_serializer = AudioProcessingSerializer(audio_objs, many=True)
+                    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+                    
+                except Exception as e:
+                    for audio_obj in audio_objs:
+                        audio_obj.delete()
+                    return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except admission.Rejected as e:
+            return _rejected(Response({'error': str(e)}, status=e.status), e)
+    
+    @action(detail=False, methods=['post'], url_path='enhance')
+    def denoise_restore(self, request):
+        """Noise reduction followed by VoiceFixer restoration, in one request"""
+        client = admission.client_key(request)
+        rejection = admission.check_rate(client, 'denoise_restore')
+        if rejection is not None:
+            return _rejected(Response({'error': str(rejection)}, status=rejection.status), rejection)
+        
+        serializer = DenoiseRestoreSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        audio_file = serializer.validated_data['audio_file']
+        requested = serializer.validated_data['mode']
+        mode = int(quality.choose('denoise_restore', requested))
+        
+        try:
+            with admission.admit(audio_file, 'denoise_restore', mode, client) as admitted:
+                audio_obj = AudioProcessing.objects.create(
+                    original_audio=audio_file,
+                    user=request.user if request.user.is_authenticated else None,
+                    processing_type='denoise_restore',
+                    mode=requested,
+                    tier=str(mode),
+                    duration=admitted.duration
+                )
+                
+                try:
+                    _process_upload(
+                        audio_obj,
+                        graph.processor('denoise_restore', lambda path: denoise_and_restore(path, mode), mode=mode),
+                        f'enhanced_{audio_obj.id}.wav',
+                        mode=mode
+                    )
+                    
+                    response_serializer = AudioProcessingSerializer(audio_obj)
+                    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+                    
+                except Exception as e:
+                    audio_obj.delete()
+                    return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except admission.Rejected as e:
+            return _rejected(Response({'error': str(e)}, status=e.status), e)
+    
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch_submit(self, request):
+        """Batch endpoint: many audio_files, or an archive of them, processed in the background"""
+        serializer = BatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        processing_type = serializer.validated_data['processing_type']
+        client = admission.client_key(request)
+        rejection = admission.check_rate(client, processing_type)
+        if rejection is not None:
+            return _rejected(Response({'error': str(rejection)}, status=rejection.status), rejection)
+        
+        try:
+            batch_id = batch.submit(
+                serializer.validated_data['audio_files'],
+                serializer.validated_data.get('archive'),
+                processing_type,
+                serializer.validated_data['mode'],
+                request.user if request.user.is_authenticated else None,
+                client
             )
-            
-            with open(boosted_path, 'rb') as f:
-                audio_obj.processed_audio.save(f'boosted_{audio_obj.id}.wav', File(f), save=False)
-            
-            audio_obj.save()
-            
-            os.remove(boosted_path)
-            
-            response_serializer = AudioProcessingSerializer(audio_obj)
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
-            audio_obj.delete()
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)    
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            return Response({'error': f'Could not read the archive: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(batch.manifest(batch_id), status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'], url_path=r'batch/(?P<batch_id>[0-9a-f-]+)')
+    def batch_manifest(self, request, batch_id=None):
+        """Per-item status of a batch"""
+        manifest = batch.manifest(batch_id)
+        if manifest is None:
+            return Response({'error': 'Batch not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(manifest)
+    
+    @action(detail=False, methods=['get'], url_path=r'batch/(?P<batch_id>[0-9a-f-]+)/download')
+    def batch_download(self, request, batch_id=None):
+        """All processed files of a batch as one zip archive, streamed"""
+        if batch.manifest(batch_id) is None:
+            return Response({'error': 'Batch not found'}, status=status.HTTP_404_NOT_FOUND)
+        response = StreamingHttpResponse(batch.stream_results(batch_id), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="batch_{batch_id}.zip"'
+        return response
 
 # Web Template Views
 def home_view(request):
@@ -89,6 +338,13 @@ def home_view(request):
 
 def noise_reducer_view(request):
     if request.method == 'POST':
+        client = admission.client_key(request)
+        rejection = admission.check_rate(client, 'noise_reduction')
+        if rejection is not None:
+            return _rejected(render(request, 'audio_api/noise_reducer.html', {
+                'error': str(rejection)
+            }, status=rejection.status), rejection)
+        
         audio_file = request.FILES.get('audio_file')
         
         if not audio_file:
@@ -96,69 +352,76 @@ def noise_reducer_view(request):
                 'error': 'No audio file provided'
             }, status=400)
         
-        audio_obj = AudioProcessing.objects.create(
-            original_audio=audio_file,
-            user=request.user if request.user.is_authenticated else None,
-            processing_type='noise_reduction'
-        )
+        mode = quality.choose('noise_reduction')
         
         try:
-            print(f"Processing audio file: {audio_obj.original_audio.path}")
-            enhanced_path = reduce_noise(audio_obj.original_audio.path)
-            
-            if not enhanced_path or not os.path.exists(enhanced_path):
-                raise Exception("Audio processing returned no file")
-            
-            with open(enhanced_path, 'rb') as f:
-                audio_obj.processed_audio.save(f'enhanced_{audio_obj.id}.wav', File(f), save=False)
-            
-            audio_obj.save()
-            os.remove(enhanced_path)
-            
-            # Return the result page with 200 status
-            response = render(request, 'audio_api/noise_result.html', {'audio': audio_obj})
-            return response
-            
-        except Exception as e:
-            print(f"Error during audio processing: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            audio_obj.delete()
-            return render(request, 'audio_api/noise_reducer.html', {
-                'error': str(e)
-            }, status=400)
+            with admission.admit(audio_file, 'noise_reduction', mode, client) as admitted:
+                audio_obj = AudioProcessing.objects.create(
+                    original_audio=audio_file,
+                    user=request.user if request.user.is_authenticated else None,
+                    processing_type='noise_reduction',
+                    tier=mode or STANDARD_TIER,
+                    duration=admitted.duration
+                )
+                
+                try:
+                    logger.info(f"Processing audio file: {audio_obj.original_audio.path}")
+                    _process_upload(audio_obj, _denoise_processor(mode), f'enhanced_{audio_obj.id}.wav', mode=mode)
+                    
+                    # Return the result page with 200 status
+                    response = render(request, 'audio_api/noise_result.html', {'audio': audio_obj})
+                    return response
+                    
+                except Exception as e:
+                    logger.exception(f"Error during audio processing: {e}")
+                    audio_obj.delete()
+                    return render(request, 'audio_api/noise_reducer.html', {
+                        'error': str(e)
+                    }, status=400)
+        except admission.Rejected as e:
+            return _rejected(render(request, 'audio_api/noise_reducer.html', {'error': str(e)}, status=e.status), e)
     
     return render(request, 'audio_api/noise_reducer.html')
 
 def volume_booster_view(request):
     if request.method == 'POST':
-        audio_file = request.FILES.get('audio_file')
-        mode = int(request.POST.get('mode', '0'))
+        client = admission.client_key(request)
+        rejection = admission.check_rate(client, 'volume_boost')
+        if rejection is not None:
+            return _rejected(render(request, 'audio_api/volume_booster.html', {
+                'error': str(rejection)
+            }, status=rejection.status), rejection)
         
-        audio_obj = AudioProcessing.objects.create(
-            original_audio=audio_file,
-            user=request.user if request.user.is_authenticated else None,
-            processing_type='volume_boost'
-        )
+        audio_file = request.FILES.get('audio_file')
+        requested = str(parse_mode(request.POST.get('mode', '0')))
+        mode = parse_mode(quality.choose('volume_boost', requested))
         
         try:
-            boosted_path = boost_volume(
-                audio_obj.original_audio.path,
-                mode
-            )
-            
-            with open(boosted_path, 'rb') as f:
-                audio_obj.processed_audio.save(f'boosted_{audio_obj.id}.wav', File(f), save=False)
-            
-            audio_obj.save()
-            
-            os.remove(boosted_path)
-            
-            return render(request, 'audio_api/boost_result.html', {'audio': audio_obj})
-            
-        except Exception as e:
-            audio_obj.delete()
-            return render(request, 'audio_api/volume_booster.html', {'error': str(e)})
+            with admission.admit(audio_file, 'volume_boost', mode, client) as admitted:
+                audio_obj = AudioProcessing.objects.create(
+                    original_audio=audio_file,
+                    user=request.user if request.user.is_authenticated else None,
+                    processing_type='volume_boost',
+                    mode=requested,
+                    tier=str(mode),
+                    duration=admitted.duration
+                )
+                
+                try:
+                    _process_upload(
+                        audio_obj,
+                        _boost_processor(mode),
+                        f'boosted_{audio_obj.id}.wav',
+                        mode=mode
+                    )
+                    
+                    return render(request, 'audio_api/boost_result.html', {'audio': audio_obj})
+                    
+                except Exception as e:
+                    audio_obj.delete()
+                    return render(request, 'audio_api/volume_booster.html', {'error': str(e)})
+        except admission.Rejected as e:
+            return _rejected(render(request, 'audio_api/volume_booster.html', {'error': str(e)}, status=e.status), e)
     
     return render(request, 'audio_api/volume_booster.html')
 
@@ -1,21 +1,37 @@
 import tempfile
 import torch
+from django.conf import settings
 from voicefixer import VoiceFixer
+from voicefixer.tools.instrument import span
+from . import graph, loudness
+from .metrics import time_model_load
+
+# Boost mode that normalizes loudness without VoiceFixer, next to the restore modes 0, 1 and 2
+DSP_MODE = 'dsp'
 
 # Initialize VoiceFixer model
-voicefixer = VoiceFixer()
+with time_model_load('voicefixer'):
+    voicefixer = VoiceFixer()
+
+def parse_mode(mode):
+    """DSP_MODE, or the VoiceFixer mode as int"""
+    return DSP_MODE if str(mode) == DSP_MODE else int(mode)
 
-def boost_volume(audio_path: str, mode: int = 1):
+def boost_volume(audio_path: str, mode=1):
     """
     Boost audio volume using VoiceFixer
     
     Args:
         audio_path: Path to input audio file
-        mode: 0 for mild enhancement, 1 for aggressive enhancement, 2 for very aggressive
+        mode: 0 for mild enhancement, 1 for aggressive enhancement, 2 for very aggressive,
+            'dsp' for loudness normalization only (boost_loudness)
     
     Returns:
         Tuple of (output_path, original_spectrogram, enhanced_spectrogram)
     """
+    mode = parse_mode(mode)
+    if mode == DSP_MODE:
+        return boost_loudness(audio_path)
     output_path = tempfile.NamedTemporaryFile(suffix="_boosted.wav", delete=False).name
     
     # Restore audio using VoiceFixer
@@ -23,6 +39,73 @@ def boost_volume(audio_path: str, mode: int = 1):
         input=audio_path,
         output=output_path,
         cuda=torch.cuda.is_available(),
-        mode=mode
+        mode=mode,
+        skip_silence=getattr(settings, 'AUDIO_SKIP_SILENCE', True)
+    )
+    return output_path
+
+def boost_volume_modes(audio_path: str, modes=(0, 1, 2)):
+    """
+    Boost audio volume in several modes at once, to compare them. The input is
+    decoded and its features computed once for all modes.
+    
+    Returns:
+        Dict of mode to output_path
+    """
+    outputs = {
+        mode: tempfile.NamedTemporaryFile(suffix=f"_boosted_mode{mode}.wav", delete=False).name
+        for mode in modes
+    }
+    voicefixer.restore_modes(
+        input=audio_path,
+        outputs=outputs,
+        cuda=torch.cuda.is_available()
     )
+    return outputs
+
+def measure_loudness(audio_path: str, block_seconds: float = 5.0) -> float:
+    """Integrated loudness of a file in LUFS, read block by block"""
+    decoder = graph.Decoder(block_seconds)
+    decoder.start({'input_path': audio_path})
+    meter = None
+    seconds = 0.0
+    try:
+        with span("measure_loudness") as s:
+            for block in decoder.blocks():
+                if meter is None:
+                    meter = loudness.LoudnessMeter(block.sample_rate, block.audio.shape[0])
+                meter.process(block.audio.numpy())
+                seconds += block.seconds
+            s.record(audio_seconds=seconds)
+    finally:
+        decoder.close()
+    return meter.integrated() if meter is not None else float('-inf')
+
+def boost_loudness(audio_path: str, target_lufs: float = None, true_peak_db: float = None) -> str:
+    """
+    Boost audio volume with DSP only, hundreds of times faster than VoiceFixer.
+    
+    Two streaming passes over the file: the first measures its integrated
+    loudness (EBU R128), the second applies the gain to target_lufs and the
+    look-ahead true-peak limiter (settings.AUDIO_PIPELINES['volume_boost_dsp']).
+    Sample rate and channels are kept.
+    
+    Returns:
+        str: Path to the boosted output WAV file
+    """
+    if target_lufs is None:
+        target_lufs = getattr(settings, 'AUDIO_BOOST_TARGET_LUFS', loudness.DEFAULT_TARGET_LUFS)
+    if true_peak_db is None:
+        true_peak_db = getattr(settings, 'AUDIO_BOOST_TRUE_PEAK_DB', loudness.DEFAULT_TRUE_PEAK_DB)
+    gain_db = loudness.normalization_gain(
+        measure_loudness(audio_path),
+        target_lufs,
+        getattr(settings, 'AUDIO_BOOST_MAX_GAIN_DB', loudness.DEFAULT_MAX_GAIN_DB)
+    )
+    config = [
+        dict(stage, ceiling_db=true_peak_db) if stage['stage'] == 'limiter' else stage
+        for stage in settings.AUDIO_PIPELINES['volume_boost_dsp']
+    ]
+    output_path = tempfile.NamedTemporaryFile(suffix="_boosted.wav", delete=False).name
+    graph.build(config).run(input_path=audio_path, output_path=output_path, gain_db=gain_db)
     return output_path
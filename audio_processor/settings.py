@@ -120,3 +120,158 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+
+# Audio processing
+# Record a per-stage breakdown (duration, audio seconds, tensor bytes, RSS delta)
+# of every job on AudioProcessing.stage_metrics and in the audio_api log.
+AUDIO_STAGE_METRICS = True
+
+# Admission control, see audio_api/admission.py. The cost of a job is its probed
+# duration x the real-time factor of the operation, in seconds of processing.
+# Estimated seconds of work admitted at once per node
+AUDIO_COMPUTE_BUDGET = 1200
+# Estimated seconds of work allowed to wait for the budget, beyond that uploads get 429
+AUDIO_QUEUE_BUDGET = 3600
+# Seconds a request may wait in the queue before it gets 429
+AUDIO_QUEUE_TIMEOUT = 600
+# Longer uploads are rejected with 413
+AUDIO_MAX_DURATION = 2 * 60 * 60
+# Starting real-time factors per 'processing_type' or 'processing_type:mode',
+# replaced by the measured ones as jobs finish
+AUDIO_RTF = {
+    'noise_reduction': 0.2,
+    # spectral gating, see noise_reducer.reduce_noise_fast
+    'noise_reduction:fast': 0.01,
+    'volume_boost': 2.0,
+    # all three modes of one upload, see the boost/compare endpoint
+    'volume_boost:compare': 6.0,
+    # loudness normalization only, see volume_booster.boost_loudness
+    'volume_boost:dsp': 0.01,
+    'denoise_restore': 2.2,
+}
+# Cheaper modes new jobs switch to under load, see audio_api/quality.py. The
+# load is the estimated work running and queued, as a multiple of
+# AUDIO_COMPUTE_BUDGET. A level is left again below AUDIO_QUALITY_HYSTERESIS
+# x its load. [] keeps full quality at any load.
+AUDIO_QUALITY_LEVELS = [
+    {'load': 0.9, 'modes': {
+        'noise_reduction': 'fast',
+        'volume_boost:1': '0', 'volume_boost:2': '0',
+        'denoise_restore:1': '0', 'denoise_restore:2': '0',
+    }},
+    {'load': 1.5, 'modes': {'volume_boost:0': 'dsp'}},
+]
+AUDIO_QUALITY_HYSTERESIS = 0.7
+# Order of the admission queue: FifoScheduler, ShortestJobFirstScheduler or
+# WeightedFairScheduler from audio_api/scheduling.py, or any class with select(state, now)
+AUDIO_SCHEDULER = 'audio_api.scheduling.WeightedFairScheduler'
+# Seconds of estimated cost taken off a queued job per second it waits
+AUDIO_SCHEDULER_AGING = 1.0
+# Half-life in seconds of the usage a client is charged for its finished jobs
+AUDIO_FAIR_SHARE_HALF_LIFE = 600
+# Fair-share weights per client ('user:<id>' or 'ip:<address>'), or per
+# 'user' / 'guest' as a default; a higher weight gets a larger share
+AUDIO_FAIR_SHARE_WEIGHTS = {
+    'user': 1.0,
+    'guest': 1.0,
+}
+# Token buckets of audio-seconds per client and processing type, see
+# audio_api/ratelimit.py. 'user' applies to logged-in users (per account),
+# 'guest' to anonymous clients (per IP address). Leave out a type for no limit.
+AUDIO_RATE_LIMITS = {
+    'user': {
+        'noise_reduction': {'per_hour': 4 * 3600, 'burst': 2 * 3600},
+        'volume_boost': {'per_hour': 2 * 3600, 'burst': 3600},
+        'denoise_restore': {'per_hour': 2 * 3600, 'burst': 3600},
+    },
+    'guest': {
+        'noise_reduction': {'per_hour': 3600, 'burst': 1800},
+        'volume_boost': {'per_hour': 1800, 'burst': 900},
+        'denoise_restore': {'per_hour': 1800, 'burst': 900},
+    },
+}
+# Streaming processing graphs, see audio_api/graph.py. Processing types listed in
+# AUDIO_STREAMING_PIPELINES run through the pipeline of the same name.
+AUDIO_PIPELINES = {
+    'noise_reduction': [
+        {'stage': 'decode'},
+        {'stage': 'downmix'},
+        {'stage': 'resample', 'sample_rate': 48000},
+        {'stage': 'deepfilternet'},
+        {'stage': 'fade_in', 'seconds': 0.15},
+        {'stage': 'resample', 'sample_rate': 'source'},
+        {'stage': 'encode'},
+    ],
+    'volume_boost': [
+        {'stage': 'decode'},
+        {'stage': 'downmix'},
+        {'stage': 'resample', 'sample_rate': 44100},
+        {'stage': 'voicefixer'},
+        {'stage': 'encode'},
+    ],
+    # second pass of the 'dsp' boost mode, the first one measures the loudness
+    'volume_boost_dsp': [
+        {'stage': 'decode'},
+        {'stage': 'gain'},
+        {'stage': 'limiter', 'ceiling_db': -1.0},
+        {'stage': 'encode'},
+    ],
+    'denoise_restore': [
+        {'stage': 'decode'},
+        {'stage': 'downmix'},
+        {'stage': 'resample', 'sample_rate': 48000},
+        {'stage': 'deepfilternet'},
+        {'stage': 'fade_in', 'seconds': 0.15},
+        {'stage': 'resample', 'sample_rate': 44100},
+        {'stage': 'voicefixer'},
+        {'stage': 'encode'},
+    ],
+}
+AUDIO_STREAMING_PIPELINES = []
+# Cut long non-speech regions out before DeepFilterNet and VoiceFixer run and
+# fill them with the attenuated input, see voicefixer/tools/vad.py
+AUDIO_SKIP_SILENCE = True
+# Uploads whose SNR, estimated on a few sampled windows, is at least this many
+# dB skip DeepFilterNet (passthrough), see audio_api/noise_reducer.py snr_gate.
+# The estimate reads about 6 dB above the SNR of speech mixed into noise.
+# None disables the estimate.
+AUDIO_SNR_BYPASS_DB = 40.0
+# The 'dsp' boost mode normalizes to this integrated loudness (LUFS), raises
+# the level by at most AUDIO_BOOST_MAX_GAIN_DB and keeps true peaks below
+# AUDIO_BOOST_TRUE_PEAK_DB (dBTP)
+AUDIO_BOOST_TARGET_LUFS = -16.0
+AUDIO_BOOST_MAX_GAIN_DB = 30.0
+AUDIO_BOOST_TRUE_PEAK_DB = -1.0
+# Blocks buffered between two pipeline stages
+AUDIO_PIPELINE_QUEUE_BLOCKS = 4
+# Batch submissions, see audio_api/batch.py
+AUDIO_BATCH_MAX_ITEMS = 1000
+# Noise reduction items denoised together in one call, if their durations differ
+# by at most AUDIO_BATCH_LENGTH_TOLERANCE (relative)
+AUDIO_BATCH_SIZE = 8
+AUDIO_BATCH_LENGTH_TOLERANCE = 0.25
+# Start a thread in each worker process that processes pending batch items
+AUDIO_BATCH_RUNNER = True
+# Items claimed by a worker that died go back to pending. Workers on this host
+# are checked by pid, the claims of workers on other hosts expire after this
+# many seconds
+AUDIO_BATCH_CLAIM_TIMEOUT = 24 * 60 * 60
+# Node-local state shared by the workers, defaults to /dev/shm/audio_api_state.json
+AUDIO_STATE_PATH = None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'audio_api': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audio_processor.settings')
 
 application = get_wsgi_application()
+
+# Set by gunicorn.conf.py: load the models in the master so the forked workers share them
+if os.environ.get('AUDIO_API_PRELOAD_MODELS') == '1':
+    from audio_api.preload import preload_models
+    preload_models()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Quality and speed of the denoising tiers: DeepFilterNet (standard) against
+the spectral gate (fast).
+
+    python -m benchmarks.denoise_tiers --durations 10 60 --snrs 0 5 10 20 --output tiers.json
+
+Every tier denoises the noisy clips of the synthetic corpus of
+benchmarks.pipelines (speech-like signal plus pink noise mixed at each input
+SNR) through the same entry points as the denoise endpoint, and is scored
+against the clean reference with
+
+  * snr_db     SNR of the output
+  * si_sdr_db  scale-invariant signal-to-distortion ratio of the output
+
+together with wall time and real-time factor. The improvement over the input
+and the speed-up of the fast tier are printed at the end.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from benchmarks.pipelines import corpus_file, environment, load_models
+
+TIERS = ['standard', 'fast']
+
+
+def snr(output, reference):
+    noise = np.sum((output - reference) ** 2)
+    return float(10 * np.log10(np.sum(reference ** 2) / max(noise, 1e-20)))
+
+
+def si_sdr(output, reference):
+    scale = np.dot(output, reference) / max(np.dot(reference, reference), 1e-20)
+    target = scale * reference
+    return snr(output, target) if scale else float('-inf')
+
+
+def denoise(tier, path):
+    from audio_api.noise_reducer import reduce_noise, reduce_noise_fast
+
+    return reduce_noise_fast(path) if tier == 'fast' else reduce_noise(path)
+
+
+def run_case(tier, path, clean_path, duration, repeat):
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = denoise(tier, path)
+        walls.append(time.perf_counter() - start)
+        denoised, _ = sf.read(output, dtype='float32')
+        os.remove(output)
+    clean, _ = sf.read(clean_path, dtype='float32')
+    noisy, _ = sf.read(path, dtype='float32')
+    n = min(len(denoised), len(clean))
+    wall = float(np.median(walls))
+    return {
+        'wall_s': wall,
+        'rtf': wall / duration,
+        'snr_db': snr(denoised[:n], clean[:n]),
+        'si_sdr_db': si_sdr(denoised[:n], clean[:n]),
+        'input_snr_db': snr(noisy[:n], clean[:n]),
+        'input_si_sdr_db': si_sdr(noisy[:n], clean[:n]),
+    }
+
+
+def summary(results):
+    """Print the speed-up of the fast tier and the quality both tiers reach, per input."""
+    by_case = {(r['tier'], r['input']): r for r in results}
+    for r in results:
+        if r['tier'] != 'fast' or ('standard', r['input']) not in by_case:
+            continue
+        standard = by_case[('standard', r['input'])]
+        print('{:<28} speed-up {:7.1f}x  SI-SDR gain standard {:+6.2f} dB  fast {:+6.2f} dB'.format(
+            r['input'], standard['wall_s'] / r['wall_s'],
+            standard['si_sdr_db'] - standard['input_si_sdr_db'], r['si_sdr_db'] - r['input_si_sdr_db']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quality and speed of the denoising tiers')
+    parser.add_argument('--durations', type=float, nargs='+', default=[10, 60], help='Clip durations in seconds.')
+    parser.add_argument('--snrs', type=int, nargs='+', default=[0, 5, 10, 20], help='Input SNRs in dB.')
+    parser.add_argument('--sample-rate', type=int, default=48000)
+    parser.add_argument('--tiers', nargs='+', choices=TIERS, default=TIERS)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, the median wall time is reported.')
+    parser.add_argument('--corpus-dir', default=os.path.join('media', 'benchmark_corpus'))
+    parser.add_argument('--output', default='', help='Write the results as JSON to this file.')
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    model_load_s = load_models(['denoise'])
+    results = []
+    for duration in args.durations:
+        for input_snr in args.snrs:
+            path, clean_path = corpus_file(args.corpus_dir, duration, args.sample_rate, 'wav', snr=input_snr)
+            name = '{:g}s/snr{}'.format(duration, input_snr)
+            for tier in args.tiers:
+                result = {'tier': tier, 'input': name, 'duration_s': duration, 'input_snr': input_snr}
+                result.update(run_case(tier, path, clean_path, duration, args.repeat))
+                print('{:<10} {:<16} wall {:8.3f} s  RTF {:7.4f}  SNR {:6.2f} dB  SI-SDR {:6.2f} dB (input {:6.2f})'.format(
+                    tier, name, result['wall_s'], result['rtf'], result['snr_db'], result['si_sdr_db'],
+                    result['input_si_sdr_db']), flush=True)
+                results.append(result)
+
+    summary(results)
+    report = {'environment': environment(), 'model_load_s': model_load_s, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
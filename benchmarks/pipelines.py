@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the denoise and boost pipelines.
+
+    python -m benchmarks.pipelines --durations 5 60 --ops denoise boost0 --output run.json
+    python -m benchmarks.pipelines --durations 5 60 --ops denoise boost0 --compare run.json
+
+A synthetic corpus of speech-like signals mixed with noise (mix_at_snr) is
+generated once per (duration, sample rate, format) with a fixed seed and cached
+in --corpus-dir, so two runs measure exactly the same inputs. Every case reports
+wall time, real-time factor (wall time / audio duration), peak RSS and the
+per-stage breakdown recorded by voicefixer.tools.instrument as JSON.
+With --compare, the new run is diffed against an earlier result file and cases
+slower than --threshold are flagged.
+
+The chain ops run denoising followed by VoiceFixer restoration: denoise_boostN
+as two requests would (reduce_noise, then boost_volume on its output file),
+chainN in memory (denoise_restore). The saving of chainN over denoise_boostN
+is printed at the end.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from voicefixer.tools.instrument import collect
+
+OPERATIONS = ['denoise', 'denoise_fast', 'boost0', 'boost1', 'boost2', 'boost_dsp', 'cli', 'denoise_boost0', 'chain0']
+FFMPEG_FORMATS = {'mp3': 'libmp3lame'}
+
+
+def synth_speech(duration, sample_rate, rng):
+    """
+    Speech-like test signal: voiced syllables of 80-300 ms with a gliding
+    fundamental between 90 and 250 Hz and decaying harmonics, grouped into
+    words separated by short pauses.
+    """
+    n = int(duration * sample_rate)
+    f0 = np.zeros(n, dtype=np.float64)
+    envelope = np.zeros(n, dtype=np.float64)
+    pos = 0
+    while pos < n:
+        for _ in range(rng.integers(1, 5)):
+            length = int(rng.uniform(0.08, 0.3) * sample_rate)
+            end = min(pos + length, n)
+            f0[pos:end] = np.linspace(rng.uniform(90, 250), rng.uniform(90, 250), length)[: end - pos]
+            envelope[pos:end] = np.hanning(length)[: end - pos]
+            pos = end
+        pos += int(rng.uniform(0.05, 0.6) * sample_rate)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    harmonics = np.arange(1, 16)
+    # harmonics above Nyquist are left out
+    weights = (1.0 / harmonics)[:, None] * (f0[None, :] * harmonics[:, None] < sample_rate / 2)
+    voiced = np.sum(weights * np.sin(harmonics[:, None] * phase[None, :]), axis=0)
+    return (0.3 * voiced * envelope).astype(np.float32)
+
+
+def synth_noise(duration, sample_rate, rng):
+    """Pink noise: white noise shaped by 1/sqrt(f) in the frequency domain."""
+    white = rng.standard_normal(int(duration * sample_rate))
+    spectrum = np.fft.rfft(white)
+    freqs = np.fft.rfftfreq(white.shape[0], 1.0 / sample_rate)
+    spectrum /= np.sqrt(np.maximum(freqs, 20.0))
+    return np.fft.irfft(spectrum, n=white.shape[0]).astype(np.float32)
+
+
+def corpus_file(corpus_dir, duration, sample_rate, fmt, snr=5, seed=0):
+    """Create (or reuse) a noisy test clip, return its path and the path of the clean reference."""
+    from audio_api.audio_utils import mix_at_snr
+
+    name = 'speech_{:g}s_{}hz_snr{}_seed{}'.format(duration, sample_rate, snr, seed)
+    wav_path = os.path.join(corpus_dir, name + '.wav')
+    clean_path = os.path.join(corpus_dir, name + '_clean.wav')
+    if not os.path.exists(wav_path):
+        rng = np.random.default_rng(seed)
+        clean = synth_speech(duration, sample_rate, rng)
+        noise = synth_noise(duration, sample_rate, rng)
+        torch.manual_seed(seed)
+        clean, _, noisy = mix_at_snr(torch.from_numpy(clean)[None], torch.from_numpy(noise)[None], snr)
+        sf.write(clean_path, clean[0].numpy(), sample_rate, subtype='PCM_16')
+        sf.write(wav_path, noisy[0].numpy(), sample_rate, subtype='PCM_16')
+
+    path = os.path.join(corpus_dir, name + '.' + fmt)
+    if not os.path.exists(path):
+        if fmt in FFMPEG_FORMATS:
+            subprocess.run(
+                ['ffmpeg', '-y', '-i', wav_path, '-acodec', FFMPEG_FORMATS[fmt], path],
+                check=True, capture_output=True,
+            )
+        else:
+            data, _ = sf.read(wav_path, dtype='float32')
+            sf.write(path, data, sample_rate)
+    return path, clean_path
+
+
+def reset_peak_rss():
+    """Reset VmHWM of this process (Linux >= 4.0), so the next read is the peak of one case."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_models(ops):
+    """Import the pipelines up front so model construction is not timed as part of the first case."""
+    start = time.perf_counter()
+    # the dsp boost runs a pipeline from settings.AUDIO_PIPELINES
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audio_processor.settings')
+    if any(op.startswith(('denoise', 'chain')) for op in ops):
+        import audio_api.noise_reducer  # noqa: F401
+    if any(op.startswith(('boost', 'denoise_boost', 'chain')) for op in ops):
+        import audio_api.volume_booster  # noqa: F401
+    return time.perf_counter() - start
+
+
+def run_inprocess(op, path):
+    if op == 'denoise':
+        from audio_api.noise_reducer import reduce_noise
+        output = reduce_noise(path)
+    elif op == 'denoise_fast':
+        from audio_api.noise_reducer import reduce_noise_fast
+        output = reduce_noise_fast(path)
+    elif op.startswith('denoise_boost'):
+        from audio_api.noise_reducer import reduce_noise
+        from audio_api.volume_booster import boost_volume
+        denoised = reduce_noise(path)
+        output = boost_volume(denoised, int(op[-1]))
+        os.remove(denoised)
+    elif op.startswith('chain'):
+        from audio_api.denoise_restore import denoise_and_restore
+        output = denoise_and_restore(path, int(op[-1]))
+    else:
+        from audio_api.volume_booster import boost_volume
+        # boost0, boost1, boost2 or boost_dsp
+        output = boost_volume(path, op[len('boost'):].lstrip('_'))
+    os.remove(output)
+
+
+def run_cli(path):
+    """Run the voicefixer CLI in a child process and return (wall, peak rss of the child)."""
+    output = path + '.cli_out.wav'
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'voicefixer', '-i', path, '-o', output, '--mode', '0', '--silent', '--disable-cuda'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError('voicefixer CLI failed with status {}'.format(status))
+    if os.path.exists(output):
+        os.remove(output)
+    return wall, rusage.ru_maxrss / 1024
+
+
+def run_case(op, path, duration, repeat):
+    walls, peaks, stages = [], [], {}
+    for _ in range(repeat):
+        if op == 'cli':
+            wall, peak = run_cli(path)
+        else:
+            reset_peak_rss()
+            start = time.perf_counter()
+            with collect() as trace:
+                run_inprocess(op, path)
+            wall = time.perf_counter() - start
+            peak = peak_rss_mb()
+            stages = trace.breakdown()
+        walls.append(wall)
+        peaks.append(peak)
+    wall = float(np.median(walls))
+    return {
+        'wall_s': wall,
+        'wall_s_all': walls,
+        'rtf': wall / duration,
+        'peak_rss_mb': max(peaks),
+        'stages': stages,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {r['case']: r for r in json.load(f)['results']}
+    regressions = 0
+    print('{:<40} {:>10} {:>10} {:>8} {:>10}'.format('case', 'base s', 'new s', 'delta', 'RSS delta'))
+    for r in results:
+        base = baseline.get(r['case'])
+        if base is None:
+            continue
+        delta = r['wall_s'] / base['wall_s'] - 1
+        flag = ''
+        if delta > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{:<40} {:>10.2f} {:>10.2f} {:>+7.1%} {:>+9.1f}M{}'.format(
+            r['case'], base['wall_s'], r['wall_s'], delta, r['peak_rss_mb'] - base['peak_rss_mb'], flag))
+    return regressions
+
+
+def chain_savings(results):
+    """Print the wall time the in-memory chain saves over the two-request flow, per case."""
+    by_case = {r['case']: r for r in results}
+    for r in results:
+        if not r['op'].startswith('chain'):
+            continue
+        two_step = by_case.get(r['case'].replace(r['op'], 'denoise_boost' + r['op'][-1], 1))
+        if two_step is None:
+            continue
+        saved = two_step['wall_s'] - r['wall_s']
+        print('{:<40} two requests {:8.2f} s  in memory {:8.2f} s  saved {:7.2f} s ({:.1%})'.format(
+            r['case'], two_step['wall_s'], r['wall_s'], saved, saved / two_step['wall_s']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the denoise and boost pipelines')
+    parser.add_argument('--durations', type=float, nargs='+', default=[5, 60, 600], help='Clip durations in seconds.')
+    parser.add_argument('--sample-rates', type=int, nargs='+', default=[16000, 44100, 48000])
+    parser.add_argument('--formats', nargs='+', default=['wav', 'flac', 'mp3'])
+    parser.add_argument('--ops', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, the median wall time is reported.')
+    parser.add_argument('--corpus-dir', default=os.path.join('media', 'benchmark_corpus'))
+    parser.add_argument('--output', default='', help='Write the results as JSON to this file.')
+    parser.add_argument('--compare', default='', help='Earlier result file to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown reported as regression.')
+    args = parser.parse_args()
+
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    formats = args.formats
+    if shutil.which('ffmpeg') is None:
+        formats = [fmt for fmt in formats if fmt not in FFMPEG_FORMATS]
+
+    model_load_s = load_models(args.ops)
+    results = []
+    for duration in args.durations:
+        for sample_rate in args.sample_rates:
+            for fmt in formats:
+                path, _ = corpus_file(args.corpus_dir, duration, sample_rate, fmt)
+                for op in args.ops:
+                    # the CLI only reads wav files
+                    if op == 'cli' and fmt != 'wav':
+                        continue
+                    case = '{}/{:g}s/{}Hz/{}'.format(op, duration, sample_rate, fmt)
+                    result = {'case': case, 'op': op, 'duration_s': duration, 'sample_rate': sample_rate, 'format': fmt}
+                    result.update(run_case(op, path, duration, args.repeat))
+                    print('{:<40} wall {:8.2f} s  RTF {:7.3f}  peak RSS {:8.1f} MB'.format(
+                        case, result['wall_s'], result['rtf'], result['peak_rss_mb']), flush=True)
+                    results.append(result)
+
+    chain_savings(results)
+    report = {'environment': environment(), 'model_load_s': model_load_s, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks of the VoiceFixer DSP and network building blocks.
+
+    python -m benchmarks.voicefixer_blocks --lengths 1 5 30 --threads 1 4 --output blocks.json
+
+Every block is timed on random input of each length (seconds of 44.1 kHz audio,
+or the matching number of frames with hop 441) under each intra-op thread count.
+Where torchaudio or librosa offer an equivalent operation it is timed as a
+baseline next to it. The summary splits the time of one restore_inmem segment
+into its stages, so optimization effort goes where the time actually is.
+Model weights are randomly initialized, which does not change the cost.
+"""
+import argparse
+import json
+import time
+
+import librosa
+import numpy as np
+import torch
+
+from voicefixer.base import VoiceFixer
+from voicefixer.restorer.model import Generator as RestorerGenerator
+from voicefixer.restorer.model_kqq_bn import UNetResComplex_100Mb
+from voicefixer.tools.base import torch_istft
+from voicefixer.tools.mel_scale import MelScale
+from voicefixer.tools.modules.fDomainHelper import FDomainHelper
+from voicefixer.tools.modules.pqmf import PQMF
+from voicefixer.vocoder.config import Config
+from voicefixer.vocoder.griffin_lim import GriffinLim
+from voicefixer.vocoder.model.generator import Generator as VocoderGenerator
+from voicefixer.vocoder.model.streaming import streaming
+
+SAMPLE_RATE = 44100
+N_FFT = 2048
+HOP = 441
+N_MEL = 128
+# the stages one restore_inmem segment goes through, in order
+SEGMENT_STAGES = ['fdomain_stft', 'mel_scale', 'denoiser', 'unet', 'vocoder']
+
+try:
+    import torchaudio
+except ImportError:
+    torchaudio = None
+
+
+def timeit(fn, repeat):
+    fn()  # warm-up, first call allocates and may pick kernels
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def stream_vocoder(vocoder, conditions, chunk_frames=100):
+    stream = streaming(vocoder)
+    blocks = [stream.step(chunk, False) for chunk in conditions.split(chunk_frames, -1)]
+    return torch.cat(blocks + [stream.step(conditions[..., :0], True)], -1)
+
+
+def build_blocks(seconds):
+    """Return {block: {implementation: callable}} for one input length."""
+    samples = int(seconds * SAMPLE_RATE)
+    frames = samples // HOP + 1
+    wav = torch.randn(1, 1, samples) * 0.1
+    wav_np = wav[0, 0].numpy()
+    window = torch.hann_window(N_FFT)
+
+    f_helper = FDomainHelper(window_size=N_FFT, hop_size=HOP)
+    real, imag = f_helper.stft(wav[:, 0, :])
+    sp, _, _ = f_helper.wav_to_spectrogram_phase(wav)
+    spec = torch.stft(wav[:, 0, :], N_FFT, HOP, window=window, return_complex=True)
+    spec_np = librosa.stft(wav_np, n_fft=N_FFT, hop_length=HOP)
+
+    mel_scale = MelScale(n_mels=N_MEL, sample_rate=SAMPLE_RATE, n_stft=N_FFT // 2 + 1)
+    mel = mel_scale(sp.permute(0, 1, 3, 2)).permute(0, 1, 3, 2)
+    mel_basis = librosa.filters.mel(sr=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MEL, htk=True)
+    mag_np = np.abs(spec_np)
+
+    restorer = RestorerGenerator(N_MEL, N_FFT // 2 + 1, 2).eval()
+    unet = UNetResComplex_100Mb(channels=2).eval()
+    unet_in = torch.cat([torch.log10(mel.clamp(min=1e-8))] * 2, dim=1)
+
+    Config.refresh(SAMPLE_RATE)
+    vocoder = VocoderGenerator(Config.cin_channels).eval()
+    conditions = torch.randn(1, N_MEL, frames + frames % 2 + 4)
+    griffin_lim = GriffinLim(mel_scale.fb)
+
+    blocks = {
+        'fdomain_stft': {
+            'voicefixer': lambda: f_helper.wav_to_spectrogram_phase(wav),
+            'torch.stft': lambda: torch.stft(wav[:, 0, :], N_FFT, HOP, window=window, return_complex=True).abs(),
+            'librosa': lambda: np.abs(librosa.stft(wav_np, n_fft=N_FFT, hop_length=HOP)),
+        },
+        'fdomain_istft': {
+            'voicefixer': lambda: f_helper.istft(real, imag, samples),
+            'torch.istft': lambda: torch.istft(spec, N_FFT, HOP, window=window, length=samples),
+            'librosa': lambda: librosa.istft(spec_np, hop_length=HOP, length=samples),
+        },
+        'torch_istft': {
+            'voicefixer': lambda: torch_istft(torch.view_as_real(spec), N_FFT, hop_length=HOP, window=window, length=samples),
+            'torch.istft': lambda: torch.istft(spec, N_FFT, HOP, window=window, length=samples),
+        },
+        'mel_scale': {
+            'voicefixer': lambda: mel_scale(sp.permute(0, 1, 3, 2)),
+            'librosa': lambda: np.dot(mel_basis, mag_np),
+        },
+        'denoiser': {'voicefixer': lambda: restorer.denoiser(mel)},
+        'unet': {'voicefixer': lambda: unet(unet_in)},
+        'vocoder': {
+            'voicefixer': lambda: vocoder(conditions),
+            'streaming': lambda: stream_vocoder(vocoder, conditions),
+            'griffin_lim': lambda: griffin_lim(mel),
+        },
+        'remove_higher_frequency': {
+            # the method does not use any state of the model, skip loading the checkpoints
+            'voicefixer': lambda: VoiceFixer.remove_higher_frequency(None, wav_np),
+        },
+    }
+    if torchaudio is not None:
+        ta_spectrogram = torchaudio.transforms.Spectrogram(n_fft=N_FFT, hop_length=HOP, power=1)
+        ta_mel = torchaudio.transforms.MelScale(n_mels=N_MEL, sample_rate=SAMPLE_RATE, n_stft=N_FFT // 2 + 1)
+        blocks['fdomain_stft']['torchaudio'] = lambda: ta_spectrogram(wav[:, 0, :])
+        blocks['mel_scale']['torchaudio'] = lambda: ta_mel(sp[0].permute(0, 2, 1))
+    try:
+        pqmf = PQMF(4, 64, "")
+        blocks['pqmf'] = {'voicefixer': lambda: pqmf.synthesis(pqmf.analysis(wav))}
+    except Exception as e:
+        print("Skipping pqmf, the subband filters could not be loaded: {}".format(e))
+    return blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the VoiceFixer building blocks')
+    parser.add_argument('--lengths', type=float, nargs='+', default=[1, 5, 30], help='Input lengths in seconds.')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, torch.get_num_threads()])
+    parser.add_argument('--blocks', nargs='+', default=None, help='Only run these blocks.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='', help='Write the results as JSON to this file.')
+    args = parser.parse_args()
+
+    results = []
+    with torch.no_grad():
+        for seconds in args.lengths:
+            blocks = build_blocks(seconds)
+            for threads in args.threads:
+                torch.set_num_threads(threads)
+                for block, implementations in blocks.items():
+                    if args.blocks and block not in args.blocks:
+                        continue
+                    for impl, fn in implementations.items():
+                        t = timeit(fn, args.repeat)
+                        results.append({
+                            'block': block, 'implementation': impl, 'seconds': seconds,
+                            'threads': threads, 'time_s': t, 'rtf': t / seconds,
+                        })
+                        print('{:<24} {:<12} {:>6g} s audio {:>3} threads  {:9.4f} s  RTF {:.4f}'.format(
+                            block, impl, seconds, threads, t, t / seconds), flush=True)
+
+    print('\nShare of one restore_inmem segment per stage:')
+    for seconds in args.lengths:
+        for threads in args.threads:
+            stages = {
+                r['block']: r['time_s'] for r in results
+                if r['seconds'] == seconds and r['threads'] == threads
+                and r['implementation'] == 'voicefixer' and r['block'] in SEGMENT_STAGES
+            }
+            total = sum(stages.values())
+            if total == 0:
+                continue
+            print('{:g} s, {} threads, {:.3f} s: {}'.format(seconds, threads, total, ', '.join(
+                '{} {:.1%}'.format(stage, stages[stage] / total) for stage in SEGMENT_STAGES if stage in stages)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Report the memory of every worker of a prefork server (gunicorn).
+
+    python -m benchmarks.worker_memory --pid <gunicorn master pid> [--json]
+
+RSS counts every resident page, including the weights shared with the master.
+PSS splits shared pages evenly between the processes mapping them and USS only
+counts pages that belong to one process, which is what each additional worker
+really costs. Linux only, reads /proc/<pid>/smaps_rollup.
+"""
+import argparse
+import json
+import os
+
+
+def read_smaps_rollup(pid):
+    """Return the smaps_rollup counters of a process in kB."""
+    values = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return values
+
+
+def children(pid):
+    pids = []
+    task_dir = '/proc/{}/task'.format(pid)
+    for tid in os.listdir(task_dir):
+        with open(os.path.join(task_dir, tid, 'children')) as f:
+            pids.extend(int(child) for child in f.read().split())
+    return pids
+
+
+def memory_report(pid):
+    rows = []
+    for role, p in [('master', pid)] + [('worker', child) for child in children(pid)]:
+        smaps = read_smaps_rollup(p)
+        rows.append({
+            'pid': p,
+            'role': role,
+            'rss_mb': smaps.get('Rss', 0) / 1024,
+            'pss_mb': smaps.get('Pss', 0) / 1024,
+            'uss_mb': (smaps.get('Private_Clean', 0) + smaps.get('Private_Dirty', 0)) / 1024,
+            'shared_mb': (smaps.get('Shared_Clean', 0) + smaps.get('Shared_Dirty', 0)) / 1024,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-worker RSS/PSS/USS of a prefork server')
+    parser.add_argument('--pid', type=int, required=True, help='PID of the master process.')
+    parser.add_argument('--json', default=False, action='store_true', help='Print the report as JSON.')
+    args = parser.parse_args()
+
+    rows = memory_report(args.pid)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print('{:>8} {:>7} {:>10} {:>10} {:>10} {:>10}'.format('pid', 'role', 'RSS MB', 'PSS MB', 'USS MB', 'shared MB'))
+    for row in rows:
+        print('{pid:>8} {role:>7} {rss_mb:>10.1f} {pss_mb:>10.1f} {uss_mb:>10.1f} {shared_mb:>10.1f}'.format(**row))
+    workers = [row for row in rows if row['role'] == 'worker']
+    if workers:
+        print('Total PSS: {:.1f} MB, mean worker USS: {:.1f} MB'.format(
+            sum(row['pss_mb'] for row in rows),
+            sum(row['uss_mb'] for row in workers) / len(workers),
+        ))
+
+
+if __name__ == '__main__':
+    main()
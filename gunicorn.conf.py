@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration for serving the API with prefork workers.
+
+    gunicorn -c gunicorn.conf.py audio_processor.wsgi
+
+The DeepFilterNet and VoiceFixer models are loaded once in the master process
+and inherited by every worker, see audio_api/preload.py. Use
+benchmarks/worker_memory.py to check the per-worker unique memory.
+"""
+import os
+import shutil
+
+os.environ.setdefault('AUDIO_API_PRELOAD_MODELS', '1')
+# Workers write their Prometheus metrics here, /metrics aggregates them
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/audio_api_metrics')
+
+# Done here, before the preloaded app imports audio_api.metrics and writes the
+# master's own samples (model load times) into the directory. Files left over
+# from an earlier run would be added to the new totals. A reload (HUP) reads
+# this file again in the same master, the live workers' files must stay.
+if os.environ.get('AUDIO_API_METRICS_DIR_READY') != os.environ['PROMETHEUS_MULTIPROC_DIR']:
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+    os.environ['AUDIO_API_METRICS_DIR_READY'] = os.environ['PROMETHEUS_MULTIPROC_DIR']
+
+bind = os.environ.get('AUDIO_API_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('AUDIO_API_WORKERS', '4'))
+# Model inference can take minutes for long uploads
+timeout = int(os.environ.get('AUDIO_API_TIMEOUT', '600'))
+preload_app = True
+
+
+def post_fork(server, worker):
+    from audio_api.preload import worker_init
+    worker_init()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -3,30 +3,230 @@ import time
 from genericpath import exists
 import os.path
 import argparse
+import hashlib
+import json
+import multiprocessing
 from voicefixer import VoiceFixer
+from voicefixer.base import VOCODERS
+from voicefixer.restorer import meta
+from voicefixer.vocoder.config import Config
+from voicefixer.tools.pytorch_util import convert_checkpoint_to_safetensors, freeze_for_fork
 import torch
 import os
 import re
 import soundfile as sf
 
 
-def writefile(voicefixer, infile, outfile, mode, append_mode, cuda, verbose=False):
+MANIFEST_NAME = ".voicefixer-manifest.json"
+CHECKPOINT_NAME = ".voicefixer-checkpoint.jsonl"
+
+# Model of a --jobs worker. With the fork start method it is loaded once in the
+# parent and inherited, the mmap-backed weights are shared through the page cache.
+_worker_voicefixer = None
+
+
+def output_path(outfile, mode, append_mode):
     if append_mode is True:
         outbasename, outext = os.path.splitext(os.path.basename(outfile))
         outfile = os.path.join(
             os.path.dirname(outfile), "{}-mode{}{}".format(outbasename, mode, outext)
         )
+    return outfile
+
 
+def output_files(outfile, mode):
+    """The files written for outfile: one per mode with --mode all."""
+    if str(mode) == "all":
+        return [output_path(outfile, file_mode, True) for file_mode in range(3)]
+    return [outfile]
+
+
+def writefile(voicefixer, infile, outfile, mode, append_mode, cuda, verbose=False, vocoder="neural"):
     if verbose:
         print("Processing {}, mode={}".format(infile, mode))
 
     start = time.time()
 
-    voicefixer.restore(input=infile, output=outfile, cuda=cuda, mode=int(mode))
+    if str(mode) == "all":
+        # decode and extract the features once for all modes
+        outputs = dict(enumerate(output_files(outfile, mode)))
+        voicefixer.restore_modes(input=infile, outputs=outputs, cuda=cuda, vocoder=vocoder)
+    else:
+        outfile = output_path(outfile, mode, append_mode)
+        voicefixer.restore(input=infile, output=outfile, cuda=cuda, mode=int(mode), vocoder=vocoder)
 
     print("Restoration took {} s".format(round(time.time() - start, 1)))
 
 
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(outfolder):
+    """
+    Entries of the outputs produced by earlier runs, keyed by output path: the
+    input path, its mtime, size and sha1 and the mode. Outputs completed by an
+    interrupted run are read from its checkpoint file and folded in.
+
+    :return: (manifest, set of outputs listed in the checkpoint)
+    """
+    manifest, resumed = {}, set()
+    path = os.path.join(outfolder, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    path = os.path.join(outfolder, CHECKPOINT_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of a killed run may be cut off
+                    continue
+                manifest[entry["output"]] = entry
+                resumed.add(entry["output"])
+    return manifest, resumed
+
+
+def save_manifest(outfolder, manifest):
+    path = os.path.join(outfolder, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+    checkpoint = os.path.join(outfolder, CHECKPOINT_NAME)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def is_up_to_date(entry, infile, mode, vocoder="neural"):
+    """
+    Whether the manifest entry of an output still matches its input. The mtime
+    and size are compared first, the hash only when the mtime changed but the
+    size did not (a copied or touched file).
+    """
+    if entry is None or not all(os.path.exists(path) for path in output_files(entry["output"], entry["mode"])):
+        return False
+    if entry["input"] != infile or entry["mode"] != str(mode):
+        return False
+    # entries written before --vocoder existed are neural
+    if entry.get("vocoder", "neural") != vocoder:
+        return False
+    stat = os.stat(infile)
+    if stat.st_size != entry["size"]:
+        return False
+    return stat.st_mtime == entry["mtime"] or file_hash(infile) == entry["sha1"]
+
+
+def init_worker(threads, cuda):
+    global _worker_voicefixer
+    if threads:
+        torch.set_num_threads(threads)
+    if _worker_voicefixer is None:
+        # spawned instead of forked, load the weights (memory-mapped) here
+        _worker_voicefixer = VoiceFixer()
+
+
+def process_task(task):
+    """Restore one (input, output, mode) task in a --jobs worker, return its manifest entry or the error."""
+    infile, outfile, mode, cuda, verbose, vocoder = task
+    stat = os.stat(infile)
+    entry = {
+        "input": infile,
+        "output": outfile,
+        "mode": str(mode),
+        "vocoder": vocoder,
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "sha1": file_hash(infile),
+    }
+    start = time.time()
+    try:
+        writefile(_worker_voicefixer, infile, outfile, mode, False, cuda, verbose=verbose, vocoder=vocoder)
+        entry["audio_seconds"] = sf.info(infile).duration
+    except Exception as e:
+        entry["error"] = "{}: {}".format(type(e).__name__, e)
+    entry["seconds"] = time.time() - start
+    return entry
+
+
+def process_folder_tasks(voicefixer, tasks, args, cuda):
+    """
+    Run the restoration tasks of a folder, in --jobs worker processes, with
+    --incremental/--resume skipping and a checkpoint line per finished output.
+    """
+    global _worker_voicefixer
+    verbose = not args.silent
+    manifest, resumed = load_manifest(args.outfolder)
+    pending = []
+    for infile, outfile, mode in tasks:
+        entry = manifest.get(outfile)
+        if args.resume and outfile in resumed and "error" not in entry:
+            continue
+        if args.incremental and is_up_to_date(entry, infile, mode, args.vocoder):
+            # remember the mtime of a touched but unchanged input so it is not hashed again
+            entry["mtime"] = os.stat(infile).st_mtime
+            continue
+        pending.append((infile, outfile, mode, cuda, verbose, args.vocoder))
+    skipped = len(tasks) - len(pending)
+    if verbose and skipped:
+        print("Skipping {} outputs that are up to date.".format(skipped))
+
+    threads = args.threads_per_job
+    if threads is None and args.jobs > 1:
+        # do not oversubscribe the cores with N workers x all-cores thread pools
+        threads = max(1, (os.cpu_count() or 1) // args.jobs)
+
+    done, failed, audio_seconds = 0, 0, 0.0
+    start = time.time()
+    with open(os.path.join(args.outfolder, CHECKPOINT_NAME), "a") as checkpoint:
+        if args.jobs > 1 and pending:
+            # a forked CUDA context is unusable, CUDA workers load their own model
+            fork = "fork" in multiprocessing.get_all_start_methods() and not cuda
+            if fork:
+                _worker_voicefixer = freeze_for_fork(voicefixer, share_memory=False)
+            context = multiprocessing.get_context("fork" if fork else "spawn")
+            pool = context.Pool(args.jobs, initializer=init_worker, initargs=(threads, cuda))
+            results = pool.imap_unordered(process_task, pending)
+        else:
+            pool = None
+            if threads:
+                torch.set_num_threads(threads)
+            _worker_voicefixer = voicefixer
+            results = map(process_task, pending)
+        try:
+            for entry in results:
+                if "error" in entry:
+                    failed += 1
+                    print("Error: Failed to process {}: {}".format(entry["input"], entry["error"]))
+                else:
+                    done += 1
+                    audio_seconds += entry["audio_seconds"]
+                manifest[entry["output"]] = entry
+                checkpoint.write(json.dumps(entry) + "\n")
+                checkpoint.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    elapsed = time.time() - start
+    save_manifest(args.outfolder, manifest)
+
+    if verbose:
+        print(
+            "Processed {} files ({} failed, {} skipped), {:.1f} s of audio in {:.1f} s: "
+            "{:.3f} files/s, {:.2f} audio-seconds/s".format(
+                done, failed, skipped, audio_seconds, elapsed,
+                done / elapsed if elapsed > 0 else 0.0,
+                audio_seconds / elapsed if elapsed > 0 else 0.0,
+            )
+        )
+
+
 def check_output_format(outfile):
     format = re.search(r"\.(\w+)$", outfile)
     assert format is not None, "Error: A file-extension for the outfile is missing."
@@ -62,6 +262,7 @@ def check_arguments(args):
         output_dirname = args.outfolder
         if len(output_dirname) > 1:
             os.makedirs(args.outfolder, exist_ok=True)
+        assert args.jobs >= 1, "Error: --jobs must be at least 1."
 
     return process_file, process_folder
 
@@ -111,6 +312,12 @@ def main():
         choices=["0", "1", "2", "all"],
         default="0",
     )
+    parser.add_argument(
+        "--vocoder",
+        help="neural: the neural vocoder (default), gl: Griffin-Lim, several times faster, for quick drafts.",
+        choices=list(VOCODERS),
+        default="neural",
+    )
     parser.add_argument('--disable-cuda', help='Set this flag if you do not want to use your gpu.', default=False, action="store_true")
     parser.add_argument(
         "--silent",
@@ -125,6 +332,39 @@ def main():
         action="store_true",
     )
 
+    parser.add_argument(
+        "--weight_convert",
+        help="Set this flag to convert the downloaded weights to safetensors once, so later runs load them memory-mapped.",
+        default=False,
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for --infolder. They share the weights loaded once by the main process.",
+    )
+    parser.add_argument(
+        "--threads-per-job",
+        type=int,
+        default=None,
+        help="Torch threads of each worker. Defaults to the number of cores divided by --jobs.",
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Skip the files of --infolder whose output is up to date (same input mtime and size, or hash) according to the manifest in the output folder.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Skip the files of --infolder that an interrupted run already finished, as listed in its checkpoint file.",
+        default=False,
+        action="store_true",
+    )
+
     args = parser.parse_args()
 
     if torch.cuda.is_available() and not args.disable_cuda:
@@ -135,6 +375,11 @@ def main():
     if args.weight_prepare:
         exit(0)
 
+    if args.weight_convert:
+        for checkpoint, key in [(meta["voicefixer_fe"]["path"], None), (Config.ckpt, "generator")]:
+            print("Converted {} to {}".format(checkpoint, convert_checkpoint_to_safetensors(checkpoint, key=key)))
+        exit(0)
+
     process_file, process_folder = check_arguments(args)
 
     if not args.silent:
@@ -151,27 +396,16 @@ def main():
                 "Error: Error processing the input file. We only support the .wav format currently. Please convert your %s format to .wav. Thanks."
                 % audioext
             )
-        if args.mode == "all":
-            for file_mode in range(3):
-                writefile(
-                    voicefixer,
-                    args.infile,
-                    args.outfile,
-                    file_mode,
-                    True,
-                    cuda,
-                    verbose=not args.silent,
-                )
-        else:
-            writefile(
-                voicefixer,
-                args.infile,
-                args.outfile,
-                args.mode,
-                False,
-                cuda,
-                verbose=not args.silent,
-            )
+        writefile(
+            voicefixer,
+            args.infile,
+            args.outfile,
+            args.mode,
+            False,
+            cuda,
+            verbose=not args.silent,
+            vocoder=args.vocoder,
+        )
 
     if process_folder:
         files = [
@@ -184,32 +418,12 @@ def main():
                 "Found %s .wav files in the input folder %s. Start processing."
                 % (len(files), args.infolder)
             )
+        tasks = []
         for file in files:
-            outbasename, outext = os.path.splitext(os.path.basename(file))
             in_file = os.path.join(args.infolder, file)
             out_file = os.path.join(args.outfolder, file)
-
-            if args.mode == "all":
-                for file_mode in range(3):
-                    writefile(
-                        voicefixer,
-                        in_file,
-                        out_file,
-                        file_mode,
-                        True,
-                        cuda,
-                        verbose=not args.silent,
-                    )
-            else:
-                writefile(
-                    voicefixer,
-                    in_file,
-                    out_file,
-                    args.mode,
-                    False,
-                    cuda,
-                    verbose=not args.silent
-                )
+            tasks.append((in_file, out_file, args.mode))
+        process_folder_tasks(voicefixer, tasks, args, cuda)
 
     if not args.silent:
         print("Done")
@@ -2,6 +2,11 @@ import librosa.display
 from voicefixer.tools.pytorch_util import *
 from voicefixer.tools.wav import *
 from voicefixer.restorer.model import VoiceFixer as voicefixer_fe
+from voicefixer.tools.instrument import span
+from voicefixer.tools.resample import resample
+from voicefixer.tools.segment import segment_bounds
+from voicefixer.tools.vad import skip_silence as _skip_silence
+from voicefixer.vocoder.griffin_lim import GriffinLim
 import ssl
 import certifi
 
@@ -10,6 +15,13 @@ ssl._create_default_https_context = lambda: ssl.create_default_context(cafile=ce
 import os
 
 EPS = 1e-8
+# "neural" is the TFGAN generator, "gl" Griffin-Lim mel inversion for quick drafts
+VOCODERS = ("neural", "gl")
+# mel frames the neural vocoder synthesizes at once, see Vocoder.stream. Same
+# output as one pass with a small fraction of the memory. Only mels of at least
+# VOCODER_STREAM_MIN_FRAMES are streamed, on CPU shorter ones are faster in one pass.
+VOCODER_CHUNK_FRAMES = 100
+VOCODER_STREAM_MIN_FRAMES = 1000
 
 
 class VoiceFixer(nn.Module):
@@ -25,17 +37,21 @@ class VoiceFixer(nn.Module):
             raise RuntimeError("Error 0: The checkpoint for analysis module (vf.ckpt) is not found in ~/.cache/voicefixer/analysis_module/checkpoints. \
                                 By default the checkpoint should be download automatically by this program. Something bad may happened.\
                                 But don't worry! Alternatively you can download it directly from Zenodo: https://zenodo.org/record/5600188/files/vf.ckpt?download=1.")
-        saved_state_dict = torch.load(self.analysis_module_ckpt)
+        saved_state_dict = load_state_dict_mmap(self.analysis_module_ckpt)
         model_state_dict = self._model.state_dict()
 
         new_state_dict = {k: v for k, v in saved_state_dict.items() if k in model_state_dict}
 
-        model_state_dict.update(new_state_dict)
-        self._model.load_state_dict(model_state_dict, strict=False)
+        # assign=True keeps the mmap-backed tensors instead of copying them into the model
+        self._model.load_state_dict(new_state_dict, strict=False, assign=True)
         self._model.eval()
+        self._griffin_lim = None
+        # None synthesizes every segment in one pass, e.g. for per-layer hooks
+        self.vocoder_chunk_frames = VOCODER_CHUNK_FRAMES
 
     def _load_wav_energy(self, path, sample_rate, threshold=0.95):
-        wav_10k, _ = librosa.load(path, sr=sample_rate)
+        wav_10k, sr = librosa.load(path, sr=None)
+        wav_10k = resample(wav_10k, sr, sample_rate)
         stft = np.log10(np.abs(librosa.stft(wav_10k)) + 1.0)
         fbins = stft.shape[0]
         e_stft = np.sum(stft, axis=1)
@@ -50,7 +66,8 @@ class VoiceFixer(nn.Module):
         return wav_10k, int((sample_rate // 2) * (i / fbins))
 
     def _load_wav(self, path, sample_rate, threshold=0.95):
-        wav_10k, _ = librosa.load(path, sr=sample_rate)
+        wav_10k, sr = librosa.load(path, sr=None)
+        wav_10k = resample(wav_10k, sr, sample_rate)
         return wav_10k
 
     def _amp_to_original_f(self, mel_sp_est, mel_sp_target, cutoff=0.2):
@@ -106,46 +123,200 @@ class VoiceFixer(nn.Module):
             i += 1
         spec[i:, ...] = np.zeros_like(spec[i:, ...])
         stft = spec * cos + 1j * spec * sin
-        return librosa.istft(stft)
+        # keep the length, istft would drop the samples after the last full hop
+        return librosa.istft(stft, length=wav.shape[-1])
+
+    def _finish_segment(self, out, segment):
+        # unify energy
+        if torch.max(torch.abs(out)) > 1.0:
+            out = out / torch.max(torch.abs(out))
+            print("Warning: Exceed energy limit,", input)
+        # frame alignment
+        out, _ = self._trim_center(out, segment)
+        return out
+
+    def _vocoder_func(self, vocoder, your_vocoder_func, cuda):
+        """The function synthesizing the mel, None for the neural vocoder"""
+        if your_vocoder_func is not None or vocoder == "neural":
+            return your_vocoder_func
+        if vocoder != "gl":
+            raise ValueError("Unknown vocoder {}, use one of {}".format(vocoder, VOCODERS))
+        if self._griffin_lim is None:
+            self._griffin_lim = GriffinLim(self._model.mel.fb)
+        self._griffin_lim = try_tensor_cuda(self._griffin_lim, cuda=cuda)
+        return self._griffin_lim
+
+    def _synthesize(self, mel, cuda):
+        """The neural vocoder, streamed for long segments"""
+        chunk_frames = self.vocoder_chunk_frames if mel.size()[2] >= VOCODER_STREAM_MIN_FRAMES else None
+        return self._model.vocoder(mel, cuda=cuda, chunk_frames=chunk_frames)
+
+    def _batchnorm_state(self):
+        return [
+            [buffer.clone() for buffer in module.buffers(recurse=False)]
+            for module in self._model.modules()
+            if isinstance(module, nn.modules.batchnorm._BatchNorm)
+        ]
+
+    def _load_batchnorm_state(self, state):
+        """
+        Put back the BatchNorm running statistics saved before mode 2, whose
+        training mode updates them and would change the results of later calls.
+        """
+        modules = [m for m in self._model.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+        for module, buffers in zip(modules, state):
+            for buffer, saved in zip(module.buffers(recurse=False), buffers):
+                buffer.copy_(saved)
 
     @torch.no_grad()
-    def restore_inmem(self, wav_10k, cuda=False, mode=0, your_vocoder_func=None):
+    def restore_inmem(
+        self, wav_10k, cuda=False, mode=0, your_vocoder_func=None, skip_silence=False, vocoder="neural"
+    ):
+        """
+        :param wav_10k: 44.1 kHz mono waveform
+        :param skip_silence: restore the speech only, see voicefixer.tools.vad.skip_silence
+        :param vocoder: one of VOCODERS, "gl" for a quick draft, ignored if your_vocoder_func is given
+        :return: restored waveform
+        """
+        if skip_silence:
+            out, _ = _skip_silence(
+                wav_10k, 44100, lambda wav: self.restore_inmem(wav, cuda, mode, your_vocoder_func, vocoder=vocoder)
+            )
+            # the same [1, samples] shape as the restored segments
+            return out.reshape(1, -1)
         check_cuda_availability(cuda=cuda)
+        griffin_lim = your_vocoder_func is None and vocoder == "gl"
+        your_vocoder_func = self._vocoder_func(vocoder, your_vocoder_func, cuda)
         self._model = try_tensor_cuda(self._model, cuda=cuda)
+        batchnorm_state = None
         if mode == 0:
             self._model.eval()
         elif mode == 1:
             self._model.eval()
         elif mode == 2:
+            batchnorm_state = self._batchnorm_state()
             self._model.train()  # More effective on seriously demaged speech
         res = []
-        seg_length = 44100 * 30
-        break_point = seg_length
-        while break_point < wav_10k.shape[0] + seg_length:
-            segment = wav_10k[break_point - seg_length : break_point]
+        for start, end in segment_bounds(wav_10k, 44100):
+            segment = wav_10k[start:end]
+            audio_seconds = segment.shape[0] / 44100
             if mode == 1:
-                segment = self.remove_higher_frequency(segment)
-            sp, mel_noisy = self._pre(self._model, segment, cuda)
-            out_model = self._model(sp, mel_noisy)
-            denoised_mel = from_log(out_model["mel"])
-            if your_vocoder_func is None:
-                out = self._model.vocoder(denoised_mel, cuda=cuda)
-            else:
-                out = your_vocoder_func(denoised_mel)
-            # unify energy
-            if torch.max(torch.abs(out)) > 1.0:
-                out = out / torch.max(torch.abs(out))
-                print("Warning: Exceed energy limit,", input)
-            # frame alignment
-            out, _ = self._trim_center(out, segment)
-            res.append(out)
-            break_point += seg_length
+                with span("remove_higher_frequency", audio_seconds):
+                    segment = self.remove_higher_frequency(segment)
+            with span("features", audio_seconds) as s:
+                sp, mel_noisy = self._pre(self._model, segment, cuda)
+                s.record(tensor=(sp, mel_noisy))
+            with span("restorer", audio_seconds) as s:
+                out_model = self._model(sp, mel_noisy)
+                denoised_mel = from_log(out_model["mel"])
+                if griffin_lim:
+                    # the neural vocoder normalizes the level, Griffin-Lim keeps that of the mel
+                    denoised_mel, _ = self._amp_to_original_f(denoised_mel, mel_noisy)
+                s.record(tensor=denoised_mel)
+            with span("vocoder", audio_seconds) as s:
+                if your_vocoder_func is None:
+                    out = self._synthesize(denoised_mel, cuda)
+                else:
+                    out = your_vocoder_func(denoised_mel)
+                s.record(tensor=out)
+            res.append(self._finish_segment(out, segment))
+        if batchnorm_state is not None:
+            self._load_batchnorm_state(batchnorm_state)
         out = torch.cat(res, -1)
         return tensor2numpy(out.squeeze(0))
 
-    def restore(self, input, output, cuda=False, mode=0, your_vocoder_func=None):
-        wav_10k = self._load_wav(input, sample_rate=44100)
+    @torch.no_grad()
+    def restore_modes_inmem(self, wav_10k, modes=(0, 1, 2), cuda=False, your_vocoder_func=None, vocoder="neural"):
+        """
+        Restore the same audio in several modes at once. Every segment is
+        decoded and turned into spectrogram and mel features once (plus the
+        low-passed variant for mode 1). Modes 0 and 1 go through the restorer
+        together as one batch, mode 2 reuses the mode 0 features but runs on its
+        own, its BatchNorm and dropout layers are in training mode. On CUDA the
+        vocoder then synthesizes all modes as one batch.
+
+        :param wav_10k: 44.1 kHz mono waveform
+        :param modes: the modes to restore, any of 0, 1 and 2
+        :param vocoder: one of VOCODERS, see restore_inmem
+        :return: {mode: restored waveform}
+        """
+        check_cuda_availability(cuda=cuda)
+        griffin_lim = your_vocoder_func is None and vocoder == "gl"
+        your_vocoder_func = self._vocoder_func(vocoder, your_vocoder_func, cuda)
+        self._model = try_tensor_cuda(self._model, cuda=cuda)
+        modes = sorted(set(int(mode) for mode in modes))
+        eval_modes = [mode for mode in modes if mode != 2]
+        # the order of the modes in the batch of restored mels
+        order = eval_modes + [mode for mode in modes if mode == 2]
+        res = {mode: [] for mode in modes}
+        for start, end in segment_bounds(wav_10k, 44100):
+            segment = wav_10k[start:end]
+            audio_seconds = segment.shape[0] / 44100
+            segments = {mode: segment for mode in modes}
+            if 1 in modes:
+                with span("remove_higher_frequency", audio_seconds):
+                    segments[1] = self.remove_higher_frequency(segment)
+            features = {}
+            with span("features", audio_seconds) as s:
+                if 0 in modes or 2 in modes:
+                    features[0] = features[2] = self._pre(self._model, segment, cuda)
+                if 1 in modes:
+                    features[1] = self._pre(self._model, segments[1], cuda)
+                s.record(tensor=[features[mode] for mode in modes])
+            mels = []
+            with span("restorer", audio_seconds * len(modes)) as s:
+                if eval_modes:
+                    self._model.eval()
+                    sp = torch.cat([features[mode][0] for mode in eval_modes], 0)
+                    mel_noisy = torch.cat([features[mode][1] for mode in eval_modes], 0)
+                    mels.append(from_log(self._model(sp, mel_noisy)["mel"]))
+                if 2 in modes:
+                    batchnorm_state = self._batchnorm_state()
+                    self._model.train()  # More effective on seriously demaged speech
+                    mels.append(from_log(self._model(*features[2])["mel"]))
+                    self._model.eval()
+                    self._load_batchnorm_state(batchnorm_state)
+                denoised_mel = torch.cat(mels, 0)
+                if griffin_lim:
+                    mel_noisy = torch.cat([features[mode][1] for mode in order], 0)
+                    denoised_mel, _ = self._amp_to_original_f(denoised_mel, mel_noisy)
+                s.record(tensor=denoised_mel)
+            with span("vocoder", audio_seconds * len(modes)) as s:
+                # on the CPU the batched neural vocoder is slower than one pass per
+                # mode, its activations no longer fit the caches
+                batches = [denoised_mel] if cuda or griffin_lim else denoised_mel.split(1, 0)
+                if your_vocoder_func is None:
+                    out = torch.cat([self._synthesize(mel, cuda) for mel in batches], 0)
+                else:
+                    out = torch.cat([your_vocoder_func(mel) for mel in batches], 0)
+                s.record(tensor=out)
+            for index, mode in enumerate(order):
+                res[mode].append(self._finish_segment(out[index : index + 1], segments[mode]))
+        return {mode: tensor2numpy(torch.cat(res[mode], -1).squeeze(0)) for mode in modes}
+
+    def restore(self, input, output, cuda=False, mode=0, your_vocoder_func=None, skip_silence=False, vocoder="neural"):
+        with span("load_wav") as s:
+            wav_10k = self._load_wav(input, sample_rate=44100)
+            s.record(audio_seconds=wav_10k.shape[0] / 44100, tensor=wav_10k)
         out_np_wav = self.restore_inmem(
-            wav_10k, cuda=cuda, mode=mode, your_vocoder_func=your_vocoder_func
+            wav_10k, cuda=cuda, mode=mode, your_vocoder_func=your_vocoder_func, skip_silence=skip_silence,
+            vocoder=vocoder,
+        )
+        with span("save_wav", out_np_wav.shape[-1] / 44100, out_np_wav):
+            save_wave(out_np_wav, fname=output, sample_rate=44100)
+
+    def restore_modes(self, input, outputs, cuda=False, your_vocoder_func=None, vocoder="neural"):
+        """
+        Decode input once and restore it in several modes, see restore_modes_inmem.
+
+        :param outputs: {mode: output path}
+        """
+        with span("load_wav") as s:
+            wav_10k = self._load_wav(input, sample_rate=44100)
+            s.record(audio_seconds=wav_10k.shape[0] / 44100, tensor=wav_10k)
+        restored = self.restore_modes_inmem(
+            wav_10k, modes=outputs.keys(), cuda=cuda, your_vocoder_func=your_vocoder_func, vocoder=vocoder
         )
-        save_wave(out_np_wav, fname=output, sample_rate=44100)
+        for mode, out_np_wav in restored.items():
+            with span("save_wav", out_np_wav.shape[-1] / 44100, out_np_wav):
+                save_wave(out_np_wav, fname=outputs[mode], sample_rate=44100)
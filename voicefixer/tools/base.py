@@ -190,8 +190,12 @@ def torch_istft(
     # win_length and n_fft are synonymous from here on
 
     stft_matrix = stft_matrix.transpose(1, 2)  # size (channel, n_frames, fft_size, 2)
-    stft_matrix = torch.irfft(
-        stft_matrix, 1, normalized, onesided, signal_sizes=(n_fft,)
+    # torch.irfft was removed in torch 1.8, torch.fft.irfft is the onesided equivalent
+    stft_matrix = torch.fft.irfft(
+        torch.view_as_complex(stft_matrix.contiguous()),
+        n=n_fft,
+        dim=-1,
+        norm="ortho" if normalized else "backward",
     )  # size (channel, n_frames, n_fft)
 
     assert stft_matrix.size(2) == n_fft
@@ -0,0 +1,150 @@
+import contextvars
+import os
+import time
+
+import numpy as np
+import torch
+
+_trace = contextvars.ContextVar("voicefixer_trace", default=None)
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss():
+    """Resident set size of this process in bytes, 0 where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def nbytes(data):
+    if isinstance(data, torch.Tensor):
+        return data.element_size() * data.nelement()
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, (tuple, list)):
+        return sum(nbytes(each) for each in data)
+    return 0
+
+
+class Trace:
+    """Spans and annotations recorded while a collect() block is active."""
+
+    def __init__(self):
+        self.spans = []
+        # {key: {name: value}}, per-file results of a stage, see annotate()
+        self.annotations = {}
+
+    def breakdown(self):
+        """
+        Aggregate the spans by stage name, in order of first appearance.
+
+        :return: {name: {count, duration_s, audio_s, tensor_bytes, rss_delta_mb}}
+        """
+        stages = {}
+        for s in self.spans:
+            stage = stages.setdefault(
+                s["name"],
+                {"count": 0, "duration_s": 0.0, "audio_s": 0.0, "tensor_bytes": 0, "rss_delta_mb": 0.0},
+            )
+            stage["count"] += 1
+            stage["duration_s"] += s["duration_s"]
+            stage["audio_s"] += s["audio_s"]
+            stage["tensor_bytes"] += s["tensor_bytes"]
+            stage["rss_delta_mb"] += s["rss_delta_mb"]
+        return stages
+
+
+class _Span:
+    __slots__ = ("trace", "name", "audio_s", "tensor_bytes", "start", "rss")
+
+    def __init__(self, trace, name, audio_seconds, tensor):
+        self.trace = trace
+        self.name = name
+        self.audio_s = audio_seconds or 0.0
+        self.tensor_bytes = nbytes(tensor)
+
+    def record(self, audio_seconds=None, tensor=None):
+        """Attach the amount of audio and the size of the data a stage produced."""
+        if audio_seconds is not None:
+            self.audio_s = audio_seconds
+        if tensor is not None:
+            self.tensor_bytes = nbytes(tensor)
+
+    def __enter__(self):
+        self.rss = current_rss()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        self.trace.spans.append(
+            {
+                "name": self.name,
+                "duration_s": duration,
+                "audio_s": self.audio_s,
+                "tensor_bytes": self.tensor_bytes,
+                "rss_delta_mb": (current_rss() - self.rss) / 2**20,
+            }
+        )
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def record(self, audio_seconds=None, tensor=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, audio_seconds=None, tensor=None):
+    """
+    Time one pipeline stage. Outside of a collect() block this returns a shared
+    no-op object, so instrumented code costs one context variable lookup.
+
+        with span("vocoder", audio_seconds=30.0) as s:
+            out = vocoder(mel)
+            s.record(tensor=out)
+    """
+    trace = _trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name, audio_seconds, tensor)
+
+
+def annotate(key, **values):
+    """
+    Attach values a stage decided for one input (e.g. keyed by its path) to
+    the active trace, for the caller to store with the result. A no-op
+    outside of a collect() block.
+    """
+    trace = _trace.get()
+    if trace is not None:
+        trace.annotations.setdefault(key, {}).update(values)
+
+
+class collect:
+    """Record the spans of everything executed inside this block (per thread / task)."""
+
+    def __enter__(self):
+        self.trace = Trace()
+        self._token = _trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        _trace.reset(self._token)
+        return False
@@ -15,6 +15,16 @@ import os.path as op
 from scipy.io import loadmat
 
 
+def filter_path(project_root, fname):
+    path = op.join(
+        project_root, "arnold_workspace/restorer/tools/pytorch/modules/filters", fname
+    )
+    if not op.exists(path):
+        # fall back to the filters shipped with this package
+        path = op.join(op.dirname(op.abspath(__file__)), "filters", fname)
+    return path
+
+
 def load_mat2numpy(fname=""):
     if len(fname) == 0:
         return None
@@ -36,13 +46,7 @@ class PQMF(nn.Module):
         self.ana_conv_filter = nn.Conv1d(
             1, out_channels=N, kernel_size=M, stride=N, bias=False
         )
-        data = load_mat2numpy(
-            op.join(
-                project_root,
-                "arnold_workspace/restorer/tools/pytorch/modules/filters/f_"
-                + self.name,
-            )
-        )
+        data = load_mat2numpy(filter_path(project_root, "f_" + self.name))
         data = data["f"].astype(np.float32) / N
         data = np.flipud(data.T).T
         data = np.reshape(data, (N, 1, M)).copy()
@@ -55,13 +59,7 @@ class PQMF(nn.Module):
         self.syn_conv_filter = nn.Conv1d(
             N, out_channels=N, kernel_size=M // N, stride=1, bias=False
         )
-        gk = load_mat2numpy(
-            op.join(
-                project_root,
-                "arnold_workspace/restorer/tools/pytorch/modules/filters/h_"
-                + self.name,
-            )
-        )
+        gk = load_mat2numpy(filter_path(project_root, "h_" + self.name))
         gk = gk["h"].astype(np.float32)
         gk = np.transpose(np.reshape(gk, (N, M // N, N)), (1, 0, 2)) * N
         gk = np.transpose(gk[::-1, :, :], (2, 1, 0)).copy()
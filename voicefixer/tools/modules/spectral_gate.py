@@ -0,0 +1,117 @@
+"""
+Spectral gating noise reduction, a classical Wiener-style denoiser without a model.
+
+The noise power spectrum is the mean power spectrum of the quietest frames
+(below the ``noise_percentile`` of the frame energies). Every STFT bin is
+scaled by the gain 1 - over_subtraction * noise / power, floored at
+-``reduction_db`` and smoothed over neighbouring frames and bins, so the
+mask does not flicker (musical noise). The masked spectrogram is turned back
+into audio by overlap-add.
+
+The framing is the one of FDomainHelper (Hann window, centered frames,
+reflect padding), computed with torch.stft, which is several times faster
+than the conv1d STFT of torchlibrosa on CPU. Long inputs are processed in
+chunks of whole frames with enough context on both sides for the frames and
+the smoothing, so the output equals that of one pass over the whole input.
+"""
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class SpectralGate(nn.Module):
+    def __init__(
+        self,
+        sample_rate,
+        frame_seconds=0.04,
+        noise_percentile=20,
+        over_subtraction=1.5,
+        reduction_db=18.0,
+        smooth_frames=5,
+        smooth_bins=3,
+        chunk_seconds=30.0,
+    ):
+        """
+        :param frame_seconds: the window is the power of two closest to this, the hop a quarter of it
+        :param noise_percentile: frames at or below this percentile of the energies make the noise profile
+        :param over_subtraction: multiple of the noise power taken off
+        :param reduction_db: largest attenuation of a bin
+        :param smooth_frames: width of the mask smoothing in frames, odd
+        :param smooth_bins: width of the mask smoothing in frequency bins, odd
+        :param chunk_seconds: audio processed at once, bounds the memory of the spectrogram
+        """
+        super(SpectralGate, self).__init__()
+        self.sample_rate = sample_rate
+        self.window_size = 2 ** round(math.log2(frame_seconds * sample_rate))
+        self.hop_size = self.window_size // 4
+        self.noise_percentile = noise_percentile
+        self.over_subtraction = over_subtraction
+        self.floor = 10.0 ** (-reduction_db / 20.0)
+        self.smooth_frames = smooth_frames
+        self.smooth_bins = smooth_bins
+        self.chunk_frames = max(1, int(chunk_seconds * sample_rate) // self.hop_size)
+        # frames reaching into a chunk from either side, for the overlap-add and the smoothing
+        self.context_frames = 4 + smooth_frames // 2
+        self.register_buffer("window", torch.hann_window(self.window_size), persistent=False)
+
+    def stft(self, wav):
+        """[batch, samples] to a complex spectrogram [batch, bins, frames]"""
+        return torch.stft(
+            wav, self.window_size, self.hop_size, window=self.window, center=True, pad_mode="reflect",
+            return_complex=True,
+        )
+
+    def istft(self, spec, length):
+        return torch.istft(spec, self.window_size, self.hop_size, window=self.window, center=True, length=length)
+
+    def noise_profile(self, wav):
+        """
+        Mean power spectrum of the quietest frames.
+
+        :param wav: [batch, samples]
+        :return: [batch, bins, 1]
+        """
+        if wav.shape[-1] < self.window_size:
+            wav = F.pad(wav, (0, self.window_size - wav.shape[-1]))
+        frames = wav.unfold(-1, self.window_size, self.hop_size)
+        energy = frames.pow(2).mean(-1)
+        threshold = torch.quantile(energy, self.noise_percentile / 100.0, dim=-1, keepdim=True)
+        # only the quiet frames are transformed
+        profile = [
+            torch.fft.rfft(row[quiet] * self.window, dim=-1).abs().pow(2).mean(0)
+            for row, quiet in zip(frames, energy <= threshold)
+        ]
+        return torch.stack(profile)[..., None]
+
+    def gain(self, power, noise):
+        """Smoothed gain mask [batch, bins, frames] for the power spectrogram, which is overwritten."""
+        gain = power.clamp_(min=1e-12).reciprocal_().mul_(-self.over_subtraction * noise)
+        gain = gain.add_(1.0).clamp_(min=self.floor)
+        kernel = (self.smooth_bins, self.smooth_frames)
+        padding = (kernel[1] // 2, kernel[1] // 2, kernel[0] // 2, kernel[0] // 2)
+        padded = F.pad(gain[:, None], padding, mode="replicate")
+        return F.avg_pool2d(padded, kernel, stride=1)[:, 0]
+
+    def _denoise(self, wav, noise):
+        spec = self.stft(wav)
+        return self.istft(spec * self.gain(spec.abs().pow(2), noise), wav.shape[-1])
+
+    def forward(self, wav):
+        """
+        :param wav: [batch, samples] or [samples]
+        :return: the denoised audio, same shape
+        """
+        shape = wav.shape
+        wav = wav.reshape(-1, shape[-1])
+        noise = self.noise_profile(wav)
+        chunk, context = self.chunk_frames * self.hop_size, self.context_frames * self.hop_size
+        if wav.shape[-1] <= chunk + 2 * context:
+            return self._denoise(wav, noise).reshape(shape)
+        out = []
+        for start in range(0, wav.shape[-1], chunk):
+            lo, hi = max(0, start - context), min(wav.shape[-1], start + chunk + context)
+            denoised = self._denoise(wav[:, lo:hi], noise)
+            out.append(denoised[:, start - lo : start - lo + chunk])
+        return torch.cat(out, -1).reshape(shape)
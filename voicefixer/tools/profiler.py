@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Per-layer profile of the VoiceFixer restorer and vocoder on a real clip.
+
+    python -m voicefixer.tools.profiler -i clip.wav --seconds 10 --engine eager quantized \\
+        --json layers.json --trace layers.trace.json
+
+Every layer of the restorer generator and the vocoder is hooked while
+restore_inmem runs on the clip. For each layer the report has the number of
+calls, the multiply-accumulates (module_flops), the measured wall time, the size
+of the activations it produced and its share of the total run time. The JSON
+export has one table per engine, so engines can be compared layer by layer; the
+Chrome trace (chrome://tracing or https://ui.perfetto.dev) shows every engine as
+its own process.
+
+Engines:
+    eager        the models as they are loaded
+    torchscript  every layer replaced by its torch.jit.trace, so the numbers
+                 line up with the eager layers one to one
+    quantized    torch.ao.quantization.quantize_dynamic (int8 Linear and GRU)
+"""
+import argparse
+import copy
+import json
+import time
+import warnings
+
+import torch
+import torch.nn as nn
+
+from voicefixer.tools.instrument import collect, nbytes
+from voicefixer.tools.pytorch_util import module_flops
+
+ENGINES = ["eager", "torchscript", "quantized"]
+TRACE_SAMPLES = 44100
+
+
+def iter_layers(module, prefix=""):
+    """
+    Yield (name, module) of the layers of a model: modules without children other
+    than weight-norm parametrizations, which are computed inside the layer they belong to.
+    """
+    children = [(n, c) for n, c in module.named_children() if n != "parametrizations"]
+    if not children or isinstance(module, _Traced):
+        yield prefix, module
+        return
+    for name, child in children:
+        yield from iter_layers(child, "{}.{}".format(prefix, name) if prefix else name)
+
+
+class _Traced(nn.Module):
+    """Holds the TorchScript version of one layer so it can still be hooked."""
+
+    def __init__(self, scripted, original):
+        super(_Traced, self).__init__()
+        self.scripted = scripted
+        self.original_type = type(original).__name__
+        # kept outside of the module tree, only used to count the FLOPs
+        self._original = [original]
+
+    def forward(self, *input):
+        return self.scripted(*input)
+
+
+def _set_submodule(root, name, module):
+    parent_name, _, attr = name.rpartition(".")
+    parent = root.get_submodule(parent_name) if parent_name else root
+    setattr(parent, attr, module)
+
+
+def to_torchscript(roots, run):
+    """
+    Replace every layer under the root modules by its trace. Each layer is traced
+    on its first call during one eager run(), so no example inputs have to be
+    kept around; layers that cannot be traced stay eager.
+    """
+    traced = {}
+    handles = []
+
+    def hook(module, input, output):
+        if module in traced:
+            return
+        traced[module] = None
+        try:
+            traced[module] = torch.jit.trace(module, tuple(input), check_trace=False)
+        except Exception as e:
+            print("Warning: {} stays eager, it could not be traced: {}".format(type(module).__name__, e))
+
+    for root in roots:
+        for _, layer in iter_layers(root):
+            handles.append(layer.register_forward_hook(hook))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        run()
+    for h in handles:
+        h.remove()
+
+    for root in roots:
+        for name, layer in list(iter_layers(root)):
+            if traced.get(layer) is not None:
+                _set_submodule(root, name, _Traced(traced[layer], layer))
+
+
+def to_quantized(root):
+    return torch.ao.quantization.quantize_dynamic(root, {nn.Linear, nn.GRU}, dtype=torch.qint8, inplace=True)
+
+
+class LayerProfiler:
+    """Forward hooks recording FLOPs, time and activation size of every layer of some models."""
+
+    def __init__(self, models):
+        """
+        :param models: {prefix: nn.Module}, the prefix is put in front of the layer names
+        """
+        self.models = models
+        self.events = []
+        self._handles = []
+        self._start = {}
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        for prefix, model in self.models.items():
+            for name, layer in iter_layers(model):
+                full_name = "{}.{}".format(prefix, name) if name else prefix
+                self._handles.append(layer.register_forward_pre_hook(self._pre_hook(full_name)))
+                self._handles.append(layer.register_forward_hook(self._post_hook(full_name)))
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_s = time.perf_counter() - self.t0
+        for h in self._handles:
+            h.remove()
+        self._handles = []
+        return False
+
+    def _pre_hook(self, name):
+        def hook(module, input):
+            self._start[name] = time.perf_counter()
+
+        return hook
+
+    def _post_hook(self, name):
+        def hook(module, input, output):
+            end = time.perf_counter()
+            start = self._start.pop(name)
+            layer = module._original[0] if isinstance(module, _Traced) else module
+            try:
+                flops = module_flops(layer, input, output)
+            except Exception:
+                flops = None
+            self.events.append(
+                {
+                    "name": name,
+                    "type": getattr(module, "original_type", type(module).__name__),
+                    "start_s": start - self.t0,
+                    "time_s": end - start,
+                    "flops": flops,
+                    "activation_bytes": nbytes(output),
+                }
+            )
+
+        return hook
+
+    def layers(self):
+        """Aggregate the calls per layer, in order of first call."""
+        layers = {}
+        for e in self.events:
+            layer = layers.setdefault(
+                e["name"],
+                {"type": e["type"], "calls": 0, "flops": 0, "time_s": 0.0, "activation_bytes": 0},
+            )
+            layer["calls"] += 1
+            layer["time_s"] += e["time_s"]
+            layer["activation_bytes"] += e["activation_bytes"]
+            if e["flops"] is None or layer["flops"] is None:
+                layer["flops"] = None
+            else:
+                layer["flops"] += e["flops"]
+        for layer in layers.values():
+            layer["share"] = layer["time_s"] / self.wall_s if self.wall_s else 0.0
+        return layers
+
+
+def chrome_trace(profiles):
+    """
+    :param profiles: {engine: LayerProfiler}
+    :return: Chrome trace event dict, one process per engine
+    """
+    events = []
+    for pid, (engine, profiler) in enumerate(profiles.items()):
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": engine}})
+        for e in profiler.events:
+            events.append(
+                {
+                    "name": e["name"],
+                    "cat": e["type"],
+                    "ph": "X",
+                    "ts": e["start_s"] * 1e6,
+                    "dur": e["time_s"] * 1e6,
+                    "pid": pid,
+                    "tid": 0,
+                    "args": {"flops": e["flops"], "activation_bytes": e["activation_bytes"]},
+                }
+            )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def profile_engine(voicefixer, wav, engine, mode=0, warmup=1):
+    """
+    Run restore_inmem on wav with the restorer and vocoder converted to engine.
+
+    :return: (LayerProfiler, stage breakdown of the profiled run)
+    """
+    model = voicefixer._model
+    generator, vocoder = model.generator, model.vocoder.model
+    # the streamed vocoder calls the convolutions functionally, past the hooks
+    chunk_frames, voicefixer.vocoder_chunk_frames = voicefixer.vocoder_chunk_frames, None
+
+    def run():
+        voicefixer.restore_inmem(wav, mode=mode)
+
+    try:
+        if engine != "eager":
+            model.generator, model.vocoder.model = copy.deepcopy(generator), copy.deepcopy(vocoder)
+            if engine == "torchscript":
+                # trace on a short excerpt, the traced convolutions accept any length
+                with torch.no_grad():
+                    to_torchscript(
+                        [model.generator, model.vocoder.model],
+                        lambda: voicefixer.restore_inmem(wav[:TRACE_SAMPLES], mode=mode),
+                    )
+            elif engine == "quantized":
+                to_quantized(model.generator)
+                to_quantized(model.vocoder.model)
+        for _ in range(warmup):
+            run()
+        with collect() as trace, LayerProfiler(
+            {"restorer": model.generator, "vocoder": model.vocoder.model}
+        ) as profiler:
+            run()
+    finally:
+        model.generator, model.vocoder.model = generator, vocoder
+        voicefixer.vocoder_chunk_frames = chunk_frames
+    return profiler, trace.breakdown()
+
+
+def print_layers(engine, profiler, top):
+    layers = profiler.layers()
+    print("\n{}: {:.3f} s total, top {} layers by time".format(engine, profiler.wall_s, top))
+    print("{:<48} {:<16} {:>6} {:>10} {:>10} {:>10} {:>7}".format(
+        "layer", "type", "calls", "GMACs", "time ms", "act MB", "share"))
+    ranked = sorted(layers.items(), key=lambda item: item[1]["time_s"], reverse=True)
+    for name, layer in ranked[:top]:
+        print("{:<48} {:<16} {:>6} {:>10} {:>10.2f} {:>10.2f} {:>6.1%}".format(
+            name[-48:], layer["type"][:16], layer["calls"],
+            "-" if layer["flops"] is None else "{:.3f}".format(layer["flops"] / 1e9),
+            layer["time_s"] * 1e3, layer["activation_bytes"] / 2**20, layer["share"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-layer profile of the VoiceFixer restorer and vocoder")
+    parser.add_argument("-i", "--infile", required=True, help="Clip to run the models on.")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Only use the first seconds of the clip, 0 for all.")
+    parser.add_argument("--mode", type=int, default=0)
+    parser.add_argument("--engine", nargs="+", choices=ENGINES, default=["eager"])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--warmup", type=int, default=1, help="Unprofiled runs before the profiled one.")
+    parser.add_argument("--top", type=int, default=20, help="Layers to print per engine.")
+    parser.add_argument("--json", default="", help="Write the per-layer tables to this file.")
+    parser.add_argument("--trace", default="", help="Write a Chrome trace to this file.")
+    args = parser.parse_args()
+
+    from voicefixer import VoiceFixer
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    voicefixer = VoiceFixer()
+    wav = voicefixer._load_wav(args.infile, sample_rate=44100)
+    if args.seconds:
+        wav = wav[: int(args.seconds * 44100)]
+
+    profiles, report = {}, {}
+    for engine in args.engine:
+        profiler, stages = profile_engine(voicefixer, wav, engine, mode=args.mode, warmup=args.warmup)
+        profiles[engine] = profiler
+        report[engine] = {"wall_s": profiler.wall_s, "stages": stages, "layers": profiler.layers()}
+        print_layers(engine, profiler, args.top)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {"infile": args.infile, "audio_s": wav.shape[0] / 44100, "mode": args.mode,
+                 "threads": torch.get_num_threads(), "engines": report},
+                f,
+                indent=2,
+            )
+    if args.trace:
+        with open(args.trace, "w") as f:
+            json.dump(chrome_trace(profiles), f)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
+import os
 import torch
 import torch.nn as nn
 import numpy as np
 
+try:
+    from safetensors.torch import load_file as load_safetensors
+    from safetensors.torch import save_file as save_safetensors
+except ImportError:
+    load_safetensors = None
+    save_safetensors = None
+
 
 def check_cuda_availability(cuda):
     if cuda and not torch.cuda.is_available():
@@ -44,6 +52,75 @@ def tensor2numpy(tensor):
         return tensor.detach().numpy()
 
 
+def safetensors_path(checkpoint_path):
+    return os.path.splitext(checkpoint_path)[0] + ".safetensors"
+
+
+def load_state_dict_mmap(checkpoint_path, key=None):
+    """
+    Load a checkpoint with its tensors backed by a read-only file mapping, so the
+    weights are not copied into anonymous memory and the page cache is shared by
+    every process that loads the same file.
+
+    :param checkpoint_path: path to the original torch checkpoint
+    :param key: optional entry of the checkpoint that holds the state dict
+    :return: state dict
+    """
+    converted = safetensors_path(checkpoint_path)
+    if load_safetensors is not None and os.path.exists(converted):
+        return load_safetensors(converted, device="cpu")
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True)
+    if key is not None:
+        checkpoint = checkpoint[key]
+    return checkpoint
+
+
+def convert_checkpoint_to_safetensors(checkpoint_path, key=None):
+    """
+    One-time conversion of a torch checkpoint into a safetensors file next to it.
+
+    :param checkpoint_path: path to the original torch checkpoint
+    :param key: optional entry of the checkpoint that holds the state dict
+    :return: path of the safetensors file
+    """
+    if save_safetensors is None:
+        raise RuntimeError(
+            "Error: Converting checkpoints requires safetensors. Please install it by: pip install safetensors"
+        )
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    if key is not None:
+        checkpoint = checkpoint[key]
+    # safetensors refuses tensors that share storage, so every entry gets its own copy
+    state_dict = {
+        k: v.detach().clone().contiguous()
+        for k, v in checkpoint.items()
+        if isinstance(v, torch.Tensor)
+    }
+    output_path = safetensors_path(checkpoint_path)
+    save_safetensors(state_dict, output_path)
+    return output_path
+
+
+def freeze_for_fork(model, share_memory=True):
+    """
+    Prepare a loaded model to be inherited by forked worker processes. Parameters
+    stop tracking gradients and are moved into shared memory, so no worker ever
+    writes to (and thereby copies) the pages holding the weights. Buffers such as
+    BatchNorm running statistics stay private, they are small and mode 2 updates them.
+
+    :param model: nn.Module
+    :param share_memory: set to False for weights loaded with load_state_dict_mmap,
+        they are already shared through the page cache and moving them would copy them
+    :return: the same module
+    """
+    model.eval()
+    for p in model.parameters():
+        p.requires_grad_(False)
+        if share_memory:
+            p.share_memory_()
+    return model
+
+
 def count_parameters(model):
     for p in model.parameters():
         if p.requires_grad:
@@ -51,6 +128,53 @@ def count_parameters(model):
     return sum(p.numel() for p in model.parameters() if p.requires_grad)
 
 
+def _gru_flops(module, input, output):
+    x = input[0]
+    if isinstance(x, nn.utils.rnn.PackedSequence):
+        steps = x.data.size(0)
+    else:
+        # batch * sequence length, in either layout
+        steps = x.size(0) * x.size(1) if x.dim() == 3 else x.size(0)
+    directions = 2 if module.bidirectional else 1
+    hidden = module.hidden_size
+    flops = 0
+    for layer in range(module.num_layers):
+        input_size = module.input_size if layer == 0 else hidden * directions
+        # three gates, each with an input and a recurrent projection, plus the gate arithmetic
+        flops += directions * (3 * (input_size * hidden + hidden * hidden) + 6 * hidden)
+    return steps * flops
+
+
+def module_flops(module, input, output):
+    """
+    Multiply-accumulate count of one forward call of a layer, from the arguments
+    of a forward hook. Uses the same conventions as count_flops, None for layer
+    types without a formula.
+    """
+    if isinstance(module, (nn.Conv1d, nn.Conv2d)):
+        # every output element is a dot product over the kernel and the input channels of its group
+        kernel_ops = int(np.prod(module.kernel_size)) * (module.in_channels // module.groups)
+        bias_ops = 1 if module.bias is not None else 0
+        return output.nelement() * (kernel_ops + bias_ops)
+    if isinstance(module, (nn.ConvTranspose1d, nn.ConvTranspose2d)):
+        # every input element is scattered through the kernel into the output channels of its group
+        kernel_ops = int(np.prod(module.kernel_size)) * (module.out_channels // module.groups)
+        bias_ops = output.nelement() if module.bias is not None else 0
+        return input[0].nelement() * kernel_ops + bias_ops
+    if isinstance(module, nn.GRU) or type(module).__name__ == "GRU":
+        return _gru_flops(module, input, output)
+    if isinstance(module, nn.Linear) or hasattr(module, "in_features"):
+        rows = output.nelement() // module.out_features
+        return rows * module.out_features * (module.in_features + 1)
+    if isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d, nn.InstanceNorm1d)):
+        return input[0].nelement()
+    if isinstance(module, (nn.ReLU, nn.LeakyReLU, nn.ELU, nn.Tanh, nn.Sigmoid)):
+        return input[0].nelement()
+    if isinstance(module, (nn.AvgPool1d, nn.MaxPool1d, nn.AvgPool2d, nn.MaxPool2d)):
+        return output.nelement() * int(np.prod(module.kernel_size))
+    return None
+
+
 def count_flops(model, audio_length):
     multiply_adds = False
     list_conv2d = []
@@ -137,6 +261,11 @@ def count_flops(model, audio_length):
 
         list_pooling2d.append(flops)
 
+    list_other = []
+
+    def other_hook(self, input, output):
+        list_other.append(module_flops(self, input, output))
+
     def foo(net):
         childrens = list(net.children())
         if not childrens:
@@ -144,6 +273,8 @@ def count_flops(model, audio_length):
                 net.register_forward_hook(conv2d_hook)
             elif isinstance(net, nn.ConvTranspose2d):
                 net.register_forward_hook(conv2d_hook)
+            elif isinstance(net, (nn.ConvTranspose1d, nn.GRU)):
+                net.register_forward_hook(other_hook)
             elif isinstance(net, nn.Conv1d):
                 net.register_forward_hook(conv1d_hook)
             elif isinstance(net, nn.Linear):
@@ -175,6 +306,7 @@ def count_flops(model, audio_length):
         + sum(list_relu)
         + sum(list_pooling2d)
         + sum(list_pooling1d)
+        + sum(list_other)
     )
 
     return total_flops
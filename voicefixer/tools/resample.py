@@ -0,0 +1,172 @@
+"""
+Polyphase sinc resampling in torch, with the filter banks cached per rate pair.
+
+The resampler is the Kaiser-windowed sinc of torchaudio.functional.resample:
+for rates reduced to orig:new by their gcd, every group of orig input samples
+yields new output samples, one per filter of a bank of new phases, applied as
+a strided conv1d. Computing the bank (an outer product of sinc and window
+over new x (2 * width + orig) taps) costs about as much as resampling a few
+seconds of audio, so banks are kept in a small LRU cache keyed by
+(orig_sr, new_sr, quality), together with their copies per dtype and device.
+
+StreamingResampler applies the same bank to a stream of blocks and produces
+the output of resampling the concatenated stream at once, up to float
+rounding of the convolution.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# "best" are the kaiser_best parameters of torchaudio and DeepFilterNet,
+# "fast" trades some stopband attenuation for a shorter transition
+QUALITY = {
+    "best": {"lowpass_filter_width": 16, "rolloff": 0.9475937167399596, "beta": 14.769656459379492},
+    "fast": {"lowpass_filter_width": 16, "rolloff": 0.85, "beta": 8.555504641634386},
+}
+CACHE_SIZE = 32
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_listeners = []
+
+
+class FilterBank:
+    """Polyphase filter bank of one rate pair."""
+
+    def __init__(self, orig_sr, new_sr, quality="best"):
+        if quality not in QUALITY:
+            raise ValueError("Unknown resampling quality {}, use one of {}".format(quality, sorted(QUALITY)))
+        gcd = math.gcd(int(orig_sr), int(new_sr))
+        self.orig, self.new = int(orig_sr) // gcd, int(new_sr) // gcd
+        params = QUALITY[quality]
+        lowpass_filter_width, rolloff, beta = params["lowpass_filter_width"], params["rolloff"], params["beta"]
+
+        base_freq = min(self.orig, self.new) * rolloff
+        # input samples the filters reach on each side of a group of orig samples
+        self.width = math.ceil(lowpass_filter_width * self.orig / base_freq)
+        idx = torch.arange(-self.width, self.width + self.orig, dtype=torch.float64)[None, None] / self.orig
+        t = torch.arange(0, -self.new, -1, dtype=torch.float64)[:, None, None] / self.new + idx
+        t = (t * base_freq).clamp_(-lowpass_filter_width, lowpass_filter_width)
+        window = torch.special.i0(beta * torch.sqrt(1 - (t / lowpass_filter_width) ** 2)) / torch.special.i0(
+            torch.tensor(float(beta), dtype=torch.float64)
+        )
+        t = t * math.pi
+        kernel = torch.where(t == 0, torch.tensor(1.0, dtype=torch.float64), t.sin() / t)
+        self.kernel = (kernel * window * base_freq / self.orig).to(torch.float32)
+        self._kernels = {}
+
+    def _kernel_for(self, waveform):
+        key = (waveform.dtype, waveform.device)
+        kernel = self._kernels.get(key)
+        if kernel is None:
+            kernel = self._kernels[key] = self.kernel.to(dtype=waveform.dtype, device=waveform.device)
+        return kernel
+
+    def output_length(self, length):
+        return math.ceil(self.new * length / self.orig)
+
+    def apply(self, waveform):
+        """
+        :param waveform: tensor [..., samples]
+        :return: tensor [..., output_length(samples)]
+        """
+        shape = waveform.shape
+        x = waveform.reshape(-1, shape[-1])
+        x = F.pad(x, (self.width, self.width + self.orig))
+        out = F.conv1d(x[:, None], self._kernel_for(x), stride=self.orig)
+        out = out.transpose(1, 2).reshape(x.shape[0], -1)[..., : self.output_length(shape[-1])]
+        return out.reshape(shape[:-1] + out.shape[-1:])
+
+
+def add_cache_listener(listener):
+    """Call ``listener(hit)`` on every filter bank lookup, e.g. to count cache hits."""
+    _cache_listeners.append(listener)
+
+
+def filter_bank(orig_sr, new_sr, quality="best"):
+    key = (int(orig_sr), int(new_sr), quality)
+    with _cache_lock:
+        bank = _cache.get(key)
+        if bank is not None:
+            _cache.move_to_end(key)
+    hit = bank is not None
+    if not hit:
+        bank = FilterBank(orig_sr, new_sr, quality)
+        with _cache_lock:
+            _cache[key] = bank
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    for listener in _cache_listeners:
+        listener(hit)
+    return bank
+
+
+def resample(waveform, orig_sr, new_sr, quality="best"):
+    """
+    Resample along the last axis.
+
+    :param waveform: torch tensor or numpy array [..., samples], batches and channels in front
+    :return: the same type, float32 for numpy input
+    """
+    if int(orig_sr) == int(new_sr):
+        return waveform
+    bank = filter_bank(orig_sr, new_sr, quality)
+    if isinstance(waveform, np.ndarray):
+        x = torch.from_numpy(np.ascontiguousarray(waveform, dtype=np.float32))
+        return bank.apply(x).numpy()
+    return bank.apply(waveform)
+
+
+class StreamingResampler:
+    """
+    Resample a stream of blocks. Each block is filtered together with the
+    input the filters need on its left, and output is only returned once all
+    the input it depends on has arrived, so the concatenated output equals
+    resample() of the concatenated input up to float rounding.
+    """
+
+    def __init__(self, orig_sr, new_sr, quality="best"):
+        self.bank = filter_bank(orig_sr, new_sr, quality)
+        self.pending = None
+        # global index of the first pending input sample and of the next output group
+        self.offset = 0
+        self.next_group = 0
+        self.context_groups = math.ceil(self.bank.width / self.bank.orig)
+
+    def _emit(self, final):
+        orig, new = self.bank.orig, self.bank.new
+        available = self.pending.shape[-1]
+        local_start = self.offset // orig
+        if final:
+            end_group = math.ceil((self.offset + available) / orig)
+        else:
+            # groups whose input [g * orig - width, (g + 1) * orig + width) has arrived
+            end_group = (self.offset + available - self.bank.width) // orig
+        if end_group <= self.next_group:
+            return self.pending[..., :0]
+        out = self.bank.apply(self.pending)
+        first = (self.next_group - local_start) * new
+        out = out[..., first:] if final else out[..., first : (end_group - local_start) * new]
+        self.next_group = end_group
+        keep_from = max(self.offset, (self.next_group - self.context_groups) * orig)
+        self.pending = self.pending[..., keep_from - self.offset :]
+        self.offset = keep_from
+        return out
+
+    def process(self, block):
+        """
+        :param block: tensor [..., samples], the next samples of the stream
+        :return: tensor [..., samples] of output that is complete, may be empty
+        """
+        self.pending = block if self.pending is None else torch.cat([self.pending, block], -1)
+        return self._emit(final=False)
+
+    def flush(self):
+        """:return: the rest of the output at the end of the stream"""
+        if self.pending is None:
+            return None
+        return self._emit(final=True)
@@ -0,0 +1,65 @@
+"""
+Segment boundaries for long inputs that fall into pauses.
+
+VoiceFixer restores long inputs in segments of about 30 s. Cutting at fixed
+multiples of 30 s splits words, and leaves a short last segment that costs a
+full model call. Here the number of segments is chosen first, so that none
+needs to be longer than ``target + tolerance`` seconds, and the ideal cut points
+split the input into equal parts. Each cut then moves to the quietest point
+(frame energy smoothed over ``smooth`` seconds) within ``tolerance`` seconds of
+its ideal position, but only as far as keeps every segment within
+``target + tolerance`` seconds. Segments come out of similar length, which
+batches well, and a short tail is merged into the segment before it.
+"""
+import math
+
+import numpy as np
+
+HOP_SECONDS = 0.01
+
+
+def smoothed_energy(wav, sample_rate, smooth=0.1):
+    """Mean square of wav over ``smooth`` seconds around every hop of 10 ms."""
+    hop = max(1, int(HOP_SECONDS * sample_rate))
+    window = max(hop, int(smooth * sample_rate))
+    cumulative = np.concatenate([[0.0], np.cumsum(np.asarray(wav, dtype=np.float64) ** 2)])
+    centers = np.arange(0, wav.shape[-1], hop)
+    lo = np.clip(centers - window // 2, 0, wav.shape[-1])
+    hi = np.clip(centers + window // 2 + 1, 0, wav.shape[-1])
+    return (cumulative[hi] - cumulative[lo]) / np.maximum(hi - lo, 1), hop
+
+
+def find_cut(energy, hop, around, tolerance, lo=0, hi=None):
+    """The sample of the quietest hop within ``tolerance`` samples of ``around``, kept in [lo, hi]."""
+    hi = len(energy) * hop if hi is None else hi
+    first = max(around - tolerance, lo) // hop + 1
+    last = min(around + tolerance, hi) // hop
+    if last < first:
+        return min(max(around, lo), hi)
+    return int((first + np.argmin(energy[first : last + 1])) * hop)
+
+
+def segment_bounds(wav, sample_rate, target=30.0, tolerance=2.0):
+    """
+    :param wav: mono waveform [samples]
+    :param target: seconds per segment the input is split for
+    :param tolerance: how far in seconds a cut may move to reach a pause
+    :return: [(start, end)] sample ranges covering wav, none empty
+    """
+    length = wav.shape[-1]
+    longest = int((target + tolerance) * sample_rate)
+    count = max(1, math.ceil(length / longest))
+    if count == 1:
+        return [(0, length)]
+    energy, hop = smoothed_energy(wav, sample_rate)
+    # a cut keeps at least half the tolerance away from the previous one
+    window, gap = int(tolerance * sample_rate), int(tolerance * sample_rate / 2)
+    cuts = [0]
+    for i in range(1, count):
+        around = round(i * length / count)
+        # no longer than the longest segment, and the rest must fit in the segments left
+        lo = max(cuts[-1] + gap, length - (count - i) * longest)
+        hi = min(length - gap, cuts[-1] + longest)
+        cuts.append(find_cut(energy, hop, around, window, lo=lo, hi=hi))
+    cuts.append(length)
+    return list(zip(cuts[:-1], cuts[1:]))
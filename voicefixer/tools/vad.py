@@ -0,0 +1,181 @@
+"""
+Energy and spectral flatness voice activity detection, to keep long
+non-speech regions away from the models.
+
+Frames of 30 ms (hop 10 ms) count as speech when they are well above the
+noise floor (a low percentile of the frame energies) and either tonal (low
+spectral flatness, voiced speech has harmonics, noise does not) or very loud.
+Only non-speech runs longer than ``min_silence`` are skipped, and the speech
+spans keep ``padding`` of context on both sides, so the models see the onsets
+and decays of speech as before.
+
+skip_silence() runs a model on the speech spans only: they are concatenated,
+processed in one call and put back in place. The skipped regions are filled
+with the attenuated input, with crossfades inside the padding.
+"""
+import numpy as np
+
+from voicefixer.tools.instrument import span
+
+FRAME_SECONDS = 0.03
+HOP_SECONDS = 0.01
+# Frames processed at once, bounds the memory of the framed signal
+CHUNK_FRAMES = 8192
+
+
+def frame_features(wav, sample_rate):
+    """
+    :param wav: mono waveform [samples]
+    :return: (energy in dB, spectral flatness) per frame
+    """
+    frame, hop = int(FRAME_SECONDS * sample_rate), int(HOP_SECONDS * sample_rate)
+    if wav.shape[-1] < frame:
+        return np.zeros(0), np.zeros(0)
+    frames = np.lib.stride_tricks.sliding_window_view(np.asarray(wav, dtype=np.float32), frame)[::hop]
+    window = np.hanning(frame).astype(np.float32)
+    energy, flatness = [], []
+    for start in range(0, frames.shape[0], CHUNK_FRAMES):
+        chunk = frames[start : start + CHUNK_FRAMES]
+        energy.append(10 * np.log10(np.mean(chunk**2, axis=-1) + 1e-12))
+        power = np.abs(np.fft.rfft(chunk * window, axis=-1))[:, 1:] ** 2 + 1e-12
+        flatness.append(np.exp(np.mean(np.log(power), axis=-1)) / np.mean(power, axis=-1))
+    return np.concatenate(energy), np.concatenate(flatness)
+
+
+def estimate_snr(wav, sample_rate, windows=8, window_seconds=2.0, speech_percentile=90, floor_percentile=10):
+    """
+    Quick SNR estimate from ``windows`` windows of ``window_seconds`` spread
+    evenly over wav: the level of the loud (speech) frames over the noise floor,
+    the ``speech_percentile`` and ``floor_percentile`` of the frame energies.
+    It reads about 6 dB above the SNR of speech mixed into stationary noise,
+    as the speech frames are louder than the speech on average.
+
+    :param wav: mono waveform [samples]
+    :return: SNR in dB, None if wav is shorter than one frame
+    """
+    length, window = wav.shape[-1], int(window_seconds * sample_rate)
+    if length <= windows * window:
+        parts = [wav]
+    else:
+        parts = [wav[start : start + window] for start in np.linspace(0, length - window, windows).astype(int)]
+    energy = np.concatenate([frame_features(part, sample_rate)[0] for part in parts])
+    if not len(energy):
+        return None
+    return float(np.percentile(energy, speech_percentile) - np.percentile(energy, floor_percentile))
+
+
+def speech_spans(
+    wav,
+    sample_rate,
+    padding=0.25,
+    min_silence=1.0,
+    margin_db=10.0,
+    loud_db=20.0,
+    max_flatness=0.3,
+    floor_percentile=10,
+    absolute_db=-60.0,
+):
+    """
+    :param wav: mono waveform [samples]
+    :param padding: seconds of context kept around the speech
+    :param min_silence: shortest non-speech run that is skipped, in seconds
+    :param margin_db: speech is at least this far above the noise floor
+    :param loud_db: frames this far above the floor are speech regardless of flatness
+    :param absolute_db: frames below this level are never speech
+    :return: [(start, end)] sample ranges to process, sorted, not overlapping
+    """
+    length = wav.shape[-1]
+    energy, flatness = frame_features(wav, sample_rate)
+    if not len(energy):
+        return [(0, length)]
+    floor = np.percentile(energy, floor_percentile)
+    threshold = max(floor + margin_db, absolute_db)
+    speech = (energy > threshold) & ((flatness < max_flatness) | (energy > floor + loud_db))
+
+    hop = int(HOP_SECONDS * sample_rate)
+    frame = int(FRAME_SECONDS * sample_rate)
+    pad = int(padding * sample_rate)
+    # sample ranges of the speech runs
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], speech.astype(np.int8), [0]])))
+    runs = [(start * hop, (end - 1) * hop + frame) for start, end in zip(edges[::2], edges[1::2])]
+    spans = []
+    for start, end in runs:
+        start, end = max(0, start - pad), min(length, end + pad)
+        # gaps too short to be worth skipping stay in
+        if spans and start - spans[-1][1] < min_silence * sample_rate:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    if spans and spans[0][0] < min_silence * sample_rate:
+        spans[0] = (0, spans[0][1])
+    if spans and length - spans[-1][1] < min_silence * sample_rate:
+        spans[-1] = (spans[-1][0], length)
+    return spans
+
+
+def compact(wav, spans):
+    """The spans of wav, concatenated."""
+    return np.concatenate([wav[..., start:end] for start, end in spans], axis=-1)
+
+
+def expand(processed, wav, spans, sample_rate, fill_gain=0.01, crossfade=0.02):
+    """
+    Put the processed spans back at their places of wav and fill the rest with
+    ``fill_gain`` x wav, crossfading over ``crossfade`` seconds at every border
+    that is not the start or end of the file.
+    """
+    length = wav.shape[-1]
+    out = (np.asarray(wav, dtype=np.float32) * fill_gain).copy()
+    fade = int(crossfade * sample_rate)
+    offset = 0
+    for start, end in spans:
+        n = end - start
+        chunk = processed[..., offset : offset + n]
+        if chunk.shape[-1] < n:
+            chunk = np.pad(chunk, [(0, 0)] * (chunk.ndim - 1) + [(0, n - chunk.shape[-1])])
+        offset += n
+        weight = np.ones(n, dtype=np.float32)
+        ramp = min(fade, n // 2)
+        if start > 0 and ramp:
+            weight[:ramp] = np.linspace(0.0, 1.0, ramp, dtype=np.float32)
+        if end < length and ramp:
+            weight[n - ramp :] = np.linspace(1.0, 0.0, ramp, dtype=np.float32)
+        out[..., start:end] = weight * chunk + (1 - weight) * out[..., start:end]
+    return out
+
+
+def detect(wav, sample_rate, **options):
+    """
+    speech_spans() of wav, recorded as the spans "vad" (all of the audio) and
+    "vad_skipped" (the audio outside the speech spans), so a trace shows the
+    fraction of the audio that is skipped.
+
+    :param wav: waveform [..., samples], the spans are detected on the channel mean
+    :return: (spans, fraction of the samples skipped)
+    """
+    length = wav.shape[-1]
+    with span("vad", length / sample_rate):
+        mono = wav if wav.ndim == 1 else wav.reshape(-1, length).mean(axis=0)
+        spans = speech_spans(mono, sample_rate, **options)
+    kept = sum(end - start for start, end in spans)
+    # a span without work of its own, it carries the seconds skipped
+    with span("vad_skipped", (length - kept) / sample_rate):
+        pass
+    return spans, (1.0 - kept / length if length else 0.0)
+
+
+def skip_silence(wav, sample_rate, process, fill_gain=0.01, **options):
+    """
+    Run ``process(waveform) -> waveform`` (same length and sample rate) on the
+    speech spans of wav only, see detect().
+
+    :param options: passed to speech_spans
+    :return: (output, fraction of the samples skipped)
+    """
+    spans, skipped = detect(wav, sample_rate, **options)
+    if spans == [(0, wav.shape[-1])]:
+        return process(wav), 0.0
+    if not spans:
+        return np.asarray(wav, dtype=np.float32) * fill_gain, 1.0
+    processed = process(compact(wav, spans))
+    return expand(processed, wav, spans, sample_rate, fill_gain=fill_gain), skipped
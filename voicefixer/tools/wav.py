@@ -5,6 +5,8 @@ import scipy.signal as signal
 import soundfile as sf
 import librosa
 
+from voicefixer.tools.resample import resample
+
 
 def save_wave(frames: np.ndarray, fname, sample_rate=44100):
     shape = list(frames.shape)
@@ -133,15 +135,17 @@ def read_wave(
         portion_end = 1
     if portion_end != 1:
         duration = get_duration(fname)
-        wav, _ = librosa.load(
+        wav, sr = librosa.load(
             fname,
-            sr=sample_rate,
+            sr=None,
             offset=portion_start * duration,
             duration=(portion_end - portion_start) * duration,
             mono=False,
         )
     else:
-        wav, _ = librosa.load(fname, sr=sample_rate, mono=False)
+        wav, sr = librosa.load(fname, sr=None, mono=False)
+    if sample_rate is not None:
+        wav = resample(wav, sr, sample_rate)
     if len(list(wav.shape)) == 1:
         wav = wav[..., None]
     else:
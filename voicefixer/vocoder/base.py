@@ -2,6 +2,7 @@ from voicefixer.vocoder.model.generator import Generator
 from voicefixer.tools.wav import read_wave, save_wave
 from voicefixer.tools.pytorch_util import *
 from voicefixer.vocoder.model.util import *
+from voicefixer.vocoder.model.streaming import streaming
 from voicefixer.vocoder.config import Config
 import os
 import numpy as np
@@ -23,8 +24,10 @@ class Vocoder(nn.Module):
 
     def _load_pretrain(self, pth):
         self.model = Generator(Config.cin_channels)
-        checkpoint = load_checkpoint(pth, torch.device("cpu"))
-        load_try(checkpoint["generator"], self.model)
+        # Parameters are assigned the mmap-backed tensors instead of being copied into
+        # freshly allocated ones, so the weights stay shared through the page cache
+        state = load_state_dict_mmap(pth, key="generator")
+        load_try(state, self.model, assign=True)
         self.model.eval()
         self.model.remove_weight_norm()
         self.model.remove_weight_norm()
@@ -39,22 +42,54 @@ class Vocoder(nn.Module):
     #         wav_re = self.model(mel) # torch.Size([1, 1, 104076])
     #         save_wave(tensor2numpy(wav_re)*2**15,save_dir,sample_rate=sample_rate)
 
-    def forward(self, mel, cuda=False):
+    def _normalize(self, mel):
+        self.weight_torch = self.weight_torch.type_as(mel)
+        mel = mel / self.weight_torch
+        return tr_normalize(tr_amp_to_db(torch.abs(mel)) - 20.0)
+
+    def forward(self, mel, cuda=False, chunk_frames=None):
         """
         :param non normalized mel spectrogram: [batchsize, 1, t-steps, n_mel]
+        :param chunk_frames: synthesize the mel in chunks of this many frames with stream(), same output
         :return: [batchsize, 1, samples]
         """
         assert mel.size()[-1] == 128
+        if chunk_frames is not None and mel.size()[2] > chunk_frames:
+            return torch.cat(list(self.stream(mel.split(chunk_frames, 2), cuda=cuda)), -1)
         check_cuda_availability(cuda=cuda)
         self.model = try_tensor_cuda(self.model, cuda=cuda)
         mel = try_tensor_cuda(mel, cuda=cuda)
-        self.weight_torch = self.weight_torch.type_as(mel)
-        mel = mel / self.weight_torch
-        mel = tr_normalize(tr_amp_to_db(torch.abs(mel)) - 20.0)
+        mel = self._normalize(mel)
         mel = tr_pre(mel[:, 0, ...])
         wav_re = self.model(mel)
         return wav_re
 
+    def stream(self, mels, cuda=False):
+        """
+        Synthesize a mel spectrogram that arrives in chunks, see
+        voicefixer.vocoder.model.streaming. Memory is bounded by the chunk size
+        instead of the length of the mel.
+
+        :param mels: iterable of non normalized mel spectrogram chunks [batchsize, 1, t-steps, n_mel]
+        :return: generator of waveform blocks [batchsize, 1, samples], concatenated they equal forward()
+        """
+        check_cuda_availability(cuda=cuda)
+        self.model = try_tensor_cuda(self.model, cuda=cuda)
+        stream = streaming(self.model)
+        frames, conditions = 0, None
+        for mel in mels:
+            assert mel.size()[-1] == 128
+            conditions = self._normalize(try_tensor_cuda(mel, cuda=cuda))[:, 0].transpose(1, 2)
+            frames += conditions.size()[-1]
+            block = stream.step(conditions, False)
+            if block.size()[-1]:
+                yield block
+        if conditions is None:
+            return
+        # the frames tr_pre appends
+        pad_tail = torch.zeros([conditions.size()[0], Config.num_mels, frames % 2 + 4]).type_as(conditions) + -4.0
+        yield stream.step(pad_tail, True)
+
     def oracle(self, fpath, out_path, cuda=False):
         check_cuda_availability(cuda=cuda)
         self.model = try_tensor_cuda(self.model, cuda=cuda)
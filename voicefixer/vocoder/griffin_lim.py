@@ -0,0 +1,90 @@
+"""
+Griffin-Lim mel inversion, a vocoder without a model for quick drafts.
+
+The mel spectrogram of the restorer is the STFT magnitude of FDomainHelper
+(Hann window of Config.n_fft, hop Config.hop_length, centered frames) times
+the mel filter bank. It is mapped back to a linear magnitude with the
+pseudo-inverse of the filter bank (negative values clipped), sharpened by
+Config.power at the same energy, and given a phase by fast Griffin-Lim (Perraudin et al. 2013):
+Griffin-Lim with momentum on the projected spectrogram, Config.griffin_lim_iters
+iterations. All items of a batch are inverted at once.
+
+torch.stft/istft compute the FDomainHelper framing; they are several times
+faster than its conv1d STFT, which matters as every iteration runs one pair.
+No de-emphasis is applied, Config.preemphasis belongs to the neural vocoder's
+training targets, the restorer's mel is computed from the waveform as is.
+"""
+import torch
+import torch.nn as nn
+
+from voicefixer.vocoder.config import Config
+
+
+class GriffinLim(nn.Module):
+    def __init__(
+        self,
+        mel_basis,
+        n_fft=Config.n_fft,
+        hop_length=Config.hop_length,
+        n_iter=Config.griffin_lim_iters,
+        power=Config.power,
+        momentum=0.99,
+        seed=0,
+    ):
+        """
+        :param mel_basis: mel filter bank [n_fft // 2 + 1, n_mels], e.g. MelScale.fb of the restorer
+        :param power: the magnitude is raised to this power at the same energy, > 1 reduces the phasiness
+        :param momentum: of fast Griffin-Lim, 0 is the original algorithm
+        :param seed: of the random initial phase, so the output is reproducible
+        """
+        super(GriffinLim, self).__init__()
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.n_iter = n_iter
+        self.power = power
+        self.momentum = momentum
+        self.seed = seed
+        self.register_buffer("inverse_basis", torch.linalg.pinv(mel_basis.float()), persistent=False)
+        self.register_buffer("window", torch.hann_window(n_fft), persistent=False)
+
+    def magnitude(self, mel):
+        """
+        :param mel: non normalized mel spectrogram [batchsize, 1, t-steps, n_mel]
+        :return: linear magnitude [batchsize, n_fft // 2 + 1, t-steps]
+        """
+        magnitude = torch.matmul(mel[:, 0], self.inverse_basis.type_as(mel)).clamp_(min=0.0).transpose(1, 2)
+        if self.power != 1.0:
+            energy = magnitude.pow(2).sum(dim=(1, 2), keepdim=True)
+            magnitude = magnitude.pow(self.power)
+            # sharpen the peaks but keep the level
+            magnitude = magnitude * (energy / magnitude.pow(2).sum(dim=(1, 2), keepdim=True).clamp(min=1e-16)).sqrt()
+        return magnitude
+
+    def _stft(self, wav):
+        return torch.stft(
+            wav, self.n_fft, self.hop_length, window=self.window, center=True, pad_mode="reflect",
+            return_complex=True,
+        )
+
+    def _istft(self, spec, length):
+        return torch.istft(spec, self.n_fft, self.hop_length, window=self.window, center=True, length=length)
+
+    def forward(self, mel):
+        """
+        :param mel: non normalized mel spectrogram [batchsize, 1, t-steps, n_mel]
+        :return: [batchsize, 1, t-steps * hop_length]
+        """
+        magnitude = self.magnitude(mel)
+        # the length whose STFT has as many frames as the mel
+        length = (magnitude.shape[-1] - 1) * self.hop_length
+        generator = torch.Generator(device=magnitude.device).manual_seed(self.seed)
+        phase = torch.rand(magnitude.shape, generator=generator, device=magnitude.device) * (2 * torch.pi)
+        angles = torch.polar(torch.ones_like(magnitude), phase)
+        previous = torch.zeros_like(angles)
+        acceleration = self.momentum / (1 + self.momentum)
+        for _ in range(self.n_iter):
+            rebuilt = self._stft(self._istft(magnitude * angles, length))
+            angles = rebuilt - previous * acceleration
+            angles = angles / angles.abs().clamp_(min=1e-16)
+            previous = rebuilt
+        return self._istft(magnitude * angles, length + self.hop_length)[:, None]
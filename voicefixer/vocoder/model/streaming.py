@@ -0,0 +1,195 @@
+"""
+Streaming inference of the vocoder generator, layer by layer.
+
+The generator is a stack of non-causal convolutions. Every layer of the
+streaming version keeps the tail of its input that its next outputs still
+depend on, and emits an output sample as soon as all the inputs it depends on
+have arrived. So the mel can be fed in chunks of any size. The waveform comes
+out in blocks, and concatenated they equal the output of one pass over the
+whole mel up to float rounding. Nothing is computed twice, and the largest
+activation held is that of one chunk plus the cached context of each layer.
+
+A block of audio needs the mel up to receptive_field() frames ahead of it.
+Most of this comes from the dilated convolutions of the ResStacks, so it grows
+threefold with every layer of their depth. The released 44.1 kHz checkpoint
+(Config.refresh(44100), 8 layers per ResStack) needs about 578 frames, 5.8 s,
+and its first block comes out after 576 frames have been fed. With the 6 layers
+of the default Config it is about 75 frames, the first block after 73.
+
+The layers streamed are those of Generator with the configuration of the
+released checkpoints: conv (zero padded, stride 1), transposed conv, reflection
+pad, pointwise activations, UpsampleNet without skip and ResStack without WaveNet
+or shift-scale. streaming() raises NotImplementedError for anything else.
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from voicefixer.vocoder.model.generator import Generator
+from voicefixer.vocoder.model.modules import ResStack, UpsampleNet
+
+
+def _empty(x, length=0, channels=None):
+    return x.new_zeros(x.shape[0], x.shape[1] if channels is None else channels, length)
+
+
+class StreamingConv1d(object):
+    def __init__(self, conv):
+        assert conv.stride[0] == 1 and conv.padding_mode == "zeros", "Only zero padded convolutions of stride 1"
+        self.conv = conv
+        self.padding = conv.padding[0]
+        self.span = (conv.kernel_size[0] - 1) * conv.dilation[0]
+        self.buffer = None
+        self.scale = 1
+        self.lookahead = self.span - self.padding
+
+    def step(self, x, last):
+        if self.buffer is None:
+            self.buffer = _empty(x, self.padding)
+        buffer = torch.cat([self.buffer, x] + ([_empty(x, self.padding)] if last else []), -1)
+        if buffer.shape[-1] <= self.span:
+            self.buffer = buffer
+            return _empty(x, channels=self.conv.out_channels)
+        out = F.conv1d(
+            buffer, self.conv.weight, self.conv.bias, dilation=self.conv.dilation, groups=self.conv.groups
+        )
+        # a copy, a view would keep all of the buffer alive
+        self.buffer = buffer[..., buffer.shape[-1] - self.span :].clone()
+        return out
+
+
+class StreamingConvTranspose1d(object):
+    def __init__(self, conv):
+        self.conv = conv
+        self.stride = conv.stride[0]
+        kernel = conv.kernel_size[0]
+        assert kernel % self.stride == 0 and conv.dilation[0] == 1, "Only kernels of a multiple of the stride"
+        self.kernel = kernel
+        # inputs overlapping an output sample besides the newest one
+        self.overlap = kernel // self.stride - 1
+        # the full output is cropped by padding on the left, padding - output_padding on the right
+        self.skip = conv.padding[0]
+        self.crop = conv.padding[0] - conv.output_padding[0]
+        self.buffer = None
+        self.scale = self.stride
+        self.lookahead = self.skip / self.stride
+
+    def step(self, x, last):
+        if self.buffer is None:
+            # inputs before the first one contribute nothing
+            self.buffer = _empty(x, self.overlap)
+        buffer = torch.cat([self.buffer, x], -1)
+        new = x.shape[-1]
+        self.buffer = buffer[..., buffer.shape[-1] - self.overlap :].clone()
+        if new == 0 and not last:
+            return _empty(x, channels=self.conv.out_channels)
+        full = F.conv_transpose1d(buffer, self.conv.weight, self.conv.bias, stride=self.stride)
+        # the outputs no later input adds to
+        start = self.overlap * self.stride
+        end = full.shape[-1] if last else (new + self.overlap) * self.stride
+        out = full[..., start:end]
+        if last and self.crop:
+            out = out[..., : out.shape[-1] - self.crop]
+        skip = min(self.skip, out.shape[-1])
+        self.skip -= skip
+        return out[..., skip:]
+
+
+class StreamingReflectionPad1d(object):
+    def __init__(self, pad):
+        self.left, self.right = pad.padding
+        # the first inputs, until there are enough to reflect at the start
+        self.head = None
+        # the last inputs, to reflect at the end
+        self.tail = None
+        self.scale = 1
+        self.lookahead = 0
+
+    def step(self, x, last):
+        out = x
+        if self.tail is None:
+            x = x if self.head is None else torch.cat([self.head, x], -1)
+            if x.shape[-1] <= self.left and not last:
+                self.head = x
+                return _empty(x)
+            self.head = None
+            self.tail = _empty(x)
+            out = torch.cat([x[..., 1 : self.left + 1].flip(-1), x], -1)
+        self.tail = torch.cat([self.tail, x], -1)[..., -(self.right + 1) :].clone()
+        if last:
+            out = torch.cat([out, self.tail[..., :-1].flip(-1)], -1)
+        return out
+
+
+class StreamingPointwise(object):
+    def __init__(self, function):
+        self.function = function
+        self.scale = 1
+        self.lookahead = 0
+
+    def step(self, x, last):
+        return self.function(x)
+
+
+class StreamingResidual(object):
+    """x + layer(x), x is kept until the layer's output catches up."""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.pending = None
+        self.scale = 1
+        self.lookahead = layer.lookahead
+
+    def step(self, x, last):
+        y = self.layer.step(x, last)
+        pending = x if self.pending is None else torch.cat([self.pending, x], -1)
+        n = y.shape[-1]
+        self.pending = pending[..., n:].clone()
+        return pending[..., :n] + y
+
+
+class StreamingSequential(object):
+    def __init__(self, layers):
+        self.layers = layers
+        self.scale = 1
+        self.lookahead = 0
+        for layer in layers:
+            # in samples of the sequence's input
+            self.lookahead += layer.lookahead / self.scale
+            self.scale *= layer.scale
+
+    def step(self, x, last):
+        for layer in self.layers:
+            x = layer.step(x, last)
+        return x
+
+
+def streaming(module):
+    """A streaming version of a vocoder module, it uses the module's weights."""
+    if isinstance(module, Generator) and not module.use_cond_rnn and module.out_channels == 1:
+        condnet = [streaming(module.condnet)] if module.use_condnet else []
+        return StreamingSequential(condnet + [streaming(module.generator)])
+    if isinstance(module, nn.Sequential):
+        return StreamingSequential([streaming(layer) for layer in module])
+    if isinstance(module, nn.Conv1d):
+        return StreamingConv1d(module)
+    if isinstance(module, nn.ConvTranspose1d):
+        return StreamingConvTranspose1d(module)
+    if isinstance(module, nn.ReflectionPad1d):
+        return StreamingReflectionPad1d(module)
+    if isinstance(module, nn.LeakyReLU):
+        return StreamingPointwise(lambda x: F.leaky_relu(x, module.negative_slope))
+    if isinstance(module, nn.ELU):
+        return StreamingPointwise(lambda x: F.elu(x, module.alpha))
+    if isinstance(module, nn.Tanh):
+        return StreamingPointwise(torch.tanh)
+    if isinstance(module, UpsampleNet) and not module.org and module.no_skip and module.up_type == "transpose":
+        return StreamingSequential([StreamingPointwise(lambda x: x + torch.sin(x)), streaming(module.layer)])
+    if isinstance(module, ResStack) and not module.use_wn and not module.use_shift_scale:
+        return StreamingSequential([StreamingResidual(streaming(layer)) for layer in module.layers])
+    raise NotImplementedError("No streaming version of {}".format(type(module).__name__))
+
+
+def receptive_field(module):
+    """Input samples (mel frames for the generator) an output depends on ahead of its own position."""
+    return streaming(module).lookahead
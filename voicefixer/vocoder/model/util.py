@@ -94,11 +94,11 @@ def pre(npy):
     return torch.cat([conditions, zeros], dim=-1)
 
 
-def load_try(state, model):
+def load_try(state, model, assign=False):
     model_dict = model.state_dict()
     try:
         model_dict.update(state)
-        model.load_state_dict(model_dict)
+        model.load_state_dict(model_dict, assign=assign)
     except RuntimeError as e:
         print(str(e))
         model_dict = model.state_dict()